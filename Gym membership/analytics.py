@@ -0,0 +1,263 @@
+"""Retention, churn, plan-mix and renewal reports over a columnar member snapshot.
+
+The four member fields the reports need are pulled into NumPy arrays through
+a batched cursor (Storage.member_snapshot). The snapshot is kept for
+ANALYTICS_CACHE_SECONDS, so /analytics scans the members once per interval
+rather than once per request. Every report is computed with array operations
+over the whole snapshot; there is no per-member Python loop.
+
+Renewals overwrite subscription.start_date/expiry_date in place, so a
+member's history is not kept. The reports therefore treat a subscription
+that started after the member's first month as a renewal. An expiry that has
+passed and was not pushed forward counts as churn.
+"""
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+ANALYTICS_CACHE_SECONDS = int(os.environ.get('GYM_ANALYTICS_CACHE_SECONDS', 300))
+SNAPSHOT_BATCH_SIZE = 5000
+COHORT_MONTHS = 12
+CHURN_MONTHS = 12
+FORECAST_MONTHS = 6
+# Complete months the renewal rate is estimated from
+RENEWAL_RATE_MONTHS = 3
+NO_PLAN = -1
+
+
+def month_index(dates):
+    """Months since 1970-01 for a datetime64 array (NaT becomes a large negative)."""
+    return dates.astype('datetime64[M]').astype(np.int64)
+
+
+def month_label(index):
+    return str(np.datetime64(int(index), 'M'))
+
+
+def month_start(index):
+    return np.datetime64(int(index), 'M').astype('datetime64[s]')
+
+
+class MemberSnapshot:
+    """Columnar copy of plan_id, start_date, expiry_date and created_at."""
+
+    def __init__(self, plan_id, start_date, expiry_date, created_at, taken_at, load_seconds):
+        self.plan_id = plan_id
+        self.start_date = start_date
+        self.expiry_date = expiry_date
+        self.created_at = created_at
+        self.taken_at = taken_at
+        self.load_seconds = load_seconds
+
+    def __len__(self):
+        return len(self.plan_id)
+
+    @classmethod
+    def load(cls, batches):
+        started = time.perf_counter()
+        taken_at = datetime.now()
+        plan_ids, starts, expiries, created = [], [], [], []
+        for rows in batches:
+            if not rows:
+                continue
+            plan_id, start_date, expiry_date, created_at = zip(*rows)
+            plan_ids.append(np.array([NO_PLAN if plan is None else plan for plan in plan_id], dtype=np.int64))
+            # None becomes NaT
+            starts.append(np.array(start_date, dtype='datetime64[s]'))
+            expiries.append(np.array(expiry_date, dtype='datetime64[s]'))
+            created.append(np.array(created_at, dtype='datetime64[s]'))
+
+        def column(chunks, dtype):
+            return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+        return cls(column(plan_ids, np.int64), column(starts, 'datetime64[s]'),
+                   column(expiries, 'datetime64[s]'), column(created, 'datetime64[s]'),
+                   taken_at, time.perf_counter() - started)
+
+
+class SnapshotCache:
+    """One MemberSnapshot per branch, reloaded after ttl seconds."""
+
+    def __init__(self, loader, ttl=ANALYTICS_CACHE_SECONDS):
+        self.loader = loader
+        self.ttl = ttl
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "loads": 0}
+
+    def get(self, branch_id):
+        with self._lock:
+            entry = self._entries.get(branch_id)
+        if entry is not None and time.monotonic() - entry[0] < self.ttl:
+            self.stats["hits"] += 1
+            return entry[1]
+
+        snapshot = MemberSnapshot.load(self.loader(branch_id))
+        self.stats["loads"] += 1
+        with self._lock:
+            self._entries[branch_id] = (time.monotonic(), snapshot)
+        return snapshot
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+def _percent(part, whole):
+    return round(100.0 * float(part) / float(whole), 1) if whole else None
+
+
+def cohort_retention(snapshot, now, months=COHORT_MONTHS):
+    """Share of each monthly sign-up cohort still subscribed k months later.
+
+    retention[k - 1] is the percentage of the cohort whose expiry date was
+    after the start of the k-th month after joining, for the months that
+    have already begun.
+    """
+    current = month_index(np.datetime64(now, 's'))
+    first = current - months + 1
+    valid = ~np.isnat(snapshot.created_at) & ~np.isnat(snapshot.expiry_date)
+    cohort = month_index(snapshot.created_at[valid])
+    # Sign-ups dated after now (clock skew, imported data) have no row yet
+    in_range = (cohort >= first) & (cohort <= current)
+    cohort = cohort[in_range]
+    # Last month whose start the subscription outlived
+    last_active = month_index(snapshot.expiry_date[valid][in_range] - np.timedelta64(1, 's'))
+    survived = np.clip(last_active - cohort, -1, months) + 1
+
+    counts = np.zeros((months, months + 2), dtype=np.int64)
+    np.add.at(counts, (cohort - first, survived), 1)
+    # at_least[row, k + 1]: members of the cohort that survived k or more months
+    at_least = counts[:, ::-1].cumsum(axis=1)[:, ::-1]
+
+    rows = []
+    for row in range(months):
+        size = int(at_least[row, 0])
+        elapsed = months - 1 - row
+        rows.append({
+            "cohort": month_label(first + row),
+            "size": size,
+            "retention": [_percent(at_least[row, k + 1], size) if k <= elapsed else None
+                          for k in range(1, months)],
+        })
+    return rows
+
+
+def monthly_churn(snapshot, now, months=CHURN_MONTHS):
+    """Members active at the start of each month and how many of them lapsed in it."""
+    now64 = np.datetime64(now, 's')
+    current = month_index(now64)
+    first = current - months + 1
+    boundaries = np.array([month_start(first + offset) for offset in range(months)])
+
+    # Subscriptions starting after now are left out, so one whose expiry date was
+    # entered before its start date can't take an active member away (NaT compares False)
+    future = snapshot.start_date > now64
+    starts = np.sort(snapshot.start_date[~np.isnat(snapshot.start_date) & ~future])
+    expiries = np.sort(snapshot.expiry_date[~np.isnat(snapshot.expiry_date) & ~future])
+    active = np.searchsorted(starts, boundaries, 'left') - np.searchsorted(expiries, boundaries, 'right')
+
+    # A lapse in month m: expired (and not renewed) in m, having started before m
+    valid = ~np.isnat(snapshot.start_date) & ~np.isnat(snapshot.expiry_date)
+    expiry_month = month_index(snapshot.expiry_date[valid])
+    lapsed = ((snapshot.expiry_date[valid] < now64)
+              & (month_index(snapshot.start_date[valid]) < expiry_month)
+              & (expiry_month >= first) & (expiry_month <= current))
+    churned = np.bincount(expiry_month[lapsed] - first, minlength=months)[:months]
+
+    return [{"month": month_label(first + offset), "active": int(active[offset]),
+             "churned": int(churned[offset]), "rate": _percent(churned[offset], active[offset])}
+            for offset in range(months)]
+
+
+def renewal_rate(snapshot, now, months=RENEWAL_RATE_MONTHS):
+    """Renewals / (renewals + lapses) over the last complete months, or None."""
+    now64 = np.datetime64(now, 's')
+    current = month_index(now64)
+    first, last = current - months, current - 1
+
+    valid = ~np.isnat(snapshot.start_date) & ~np.isnat(snapshot.created_at)
+    start_month = month_index(snapshot.start_date[valid])
+    renewed = ((start_month > month_index(snapshot.created_at[valid]))
+               & (start_month >= first) & (start_month <= last))
+
+    valid = ~np.isnat(snapshot.start_date) & ~np.isnat(snapshot.expiry_date)
+    expiry_month = month_index(snapshot.expiry_date[valid])
+    lapsed = ((snapshot.expiry_date[valid] < now64)
+              & (month_index(snapshot.start_date[valid]) < expiry_month)
+              & (expiry_month >= first) & (expiry_month <= last))
+
+    renewals, lapses = int(renewed.sum()), int(lapsed.sum())
+    return renewals / (renewals + lapses) if renewals + lapses else None
+
+
+def plan_mix(snapshot, now, plans):
+    """Active members per plan, their share and monthly recurring revenue."""
+    active = snapshot.expiry_date > np.datetime64(now, 's')
+    plan_ids, counts = np.unique(snapshot.plan_id[active], return_counts=True)
+    by_plan = dict(zip(plan_ids.tolist(), counts.tolist()))
+    total = int(active.sum())
+
+    rows = []
+    for plan in plans:
+        count = by_plan.pop(plan["plan_id"], 0)
+        duration = plan.get("duration_days") or 30
+        rows.append({
+            "plan_id": plan["plan_id"],
+            "plan_name": plan["plan_name"],
+            "members": count,
+            "share": _percent(count, total),
+            "monthly_revenue": round(count * plan.get("price", 0) * 30 / duration, 2),
+        })
+    for plan_id, count in sorted(by_plan.items()):
+        rows.append({"plan_id": plan_id, "plan_name": "Unknown plan", "members": count,
+                     "share": _percent(count, total), "monthly_revenue": 0})
+    return rows
+
+
+def projected_renewals(snapshot, now, plans, rate, months=FORECAST_MONTHS):
+    """Subscriptions expiring in each coming month, and the renewals and
+    revenue expected from them at the given renewal rate."""
+    now64 = np.datetime64(now, 's')
+    current = month_index(now64)
+    upcoming = snapshot.expiry_date >= now64
+    expiry_month = month_index(snapshot.expiry_date[upcoming]) - current
+    in_range = expiry_month < months
+
+    prices = {plan["plan_id"]: plan.get("price", 0) for plan in plans}
+    plan_price = np.array([prices.get(plan_id, 0) for plan_id in range(max(prices, default=0) + 1)],
+                          dtype=np.float64)
+    plan_id = snapshot.plan_id[upcoming][in_range]
+    known = (plan_id >= 0) & (plan_id < len(plan_price))
+    revenue = np.zeros(len(plan_id))
+    revenue[known] = plan_price[plan_id[known]]
+
+    expiring = np.bincount(expiry_month[in_range], minlength=months)
+    value = np.bincount(expiry_month[in_range], weights=revenue, minlength=months)
+    return [{
+        "month": month_label(current + offset),
+        "expiring": int(expiring[offset]),
+        "renewals": round(float(expiring[offset]) * rate, 1) if rate is not None else None,
+        "revenue": round(float(value[offset]) * rate, 2) if rate is not None else None,
+    } for offset in range(months)]
+
+
+def build_report(snapshot, plans, now=None):
+    now = now or datetime.now()
+    started = time.perf_counter()
+    rate = renewal_rate(snapshot, now)
+    report = {
+        "members": len(snapshot),
+        "taken_at": snapshot.taken_at,
+        "load_ms": round(snapshot.load_seconds * 1000, 1),
+        "cohorts": cohort_retention(snapshot, now),
+        "churn": monthly_churn(snapshot, now),
+        "plan_mix": plan_mix(snapshot, now, plans),
+        "renewal_rate": _percent(rate, 1) if rate is not None else None,
+        "forecast": projected_renewals(snapshot, now, plans, rate),
+    }
+    report["compute_ms"] = round((time.perf_counter() - started) * 1000, 1)
+    return report
@@ -0,0 +1,57 @@
+"""Fingerprinted static assets with long-lived cache headers.
+
+Every file under static/ is read once at startup. Each file is hashed and
+compressed ahead of time, with gzip and with Brotli when available.
+Templates link to asset_url('css/index.css'), which gives
+/assets/css/index.<hash>.css. The hash changes with the file contents, so a
+response can be cached by browsers and proxies for ASSET_MAX_AGE. After a
+deploy the pages link to the new name. Edited files are only picked up on
+restart.
+"""
+import hashlib
+import mimetypes
+import os
+from collections import namedtuple
+
+from compression import brotli, compress
+
+ASSET_MAX_AGE = 365 * 24 * 3600
+FINGERPRINT_LENGTH = 12
+
+Asset = namedtuple('Asset', 'path mimetype etag bodies')
+
+
+class AssetManifest:
+    """Maps logical paths (css/index.css) to fingerprinted, precompressed assets."""
+
+    def __init__(self, root):
+        self.root = root
+        self._urls = {}
+        self._assets = {}
+        self.load()
+
+    def load(self):
+        urls, assets = {}, {}
+        for directory, _, filenames in os.walk(self.root):
+            for filename in sorted(filenames):
+                full_path = os.path.join(directory, filename)
+                path = os.path.relpath(full_path, self.root).replace(os.sep, '/')
+                with open(full_path, 'rb') as f:
+                    data = f.read()
+
+                digest = hashlib.sha256(data).hexdigest()[:FINGERPRINT_LENGTH]
+                base, extension = os.path.splitext(path)
+                fingerprinted = f"{base}.{digest}{extension}"
+                bodies = {None: data, 'gzip': compress(data, 'gzip', best=True)}
+                if brotli is not None:
+                    bodies['br'] = compress(data, 'br', best=True)
+                mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+                urls[path] = f"/assets/{fingerprinted}"
+                assets[fingerprinted] = Asset(path, mimetype, digest, bodies)
+        self._urls, self._assets = urls, assets
+
+    def url(self, path):
+        return self._urls[path]
+
+    def get(self, fingerprinted):
+        return self._assets.get(fingerprinted)
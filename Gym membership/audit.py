@@ -0,0 +1,45 @@
+from datetime import datetime
+
+AUDIT_COLLECTION = 'audit_log'
+AUDIT_RETENTION_DAYS = 365
+HISTORY_LIMIT = 200
+
+
+def flatten(document, prefix=''):
+    fields = {}
+    for key, value in (document or {}).items():
+        path = f"{prefix}{key}"
+        if isinstance(value, dict) and value:
+            fields.update(flatten(value, path + '.'))
+        else:
+            fields[path] = value
+    return fields
+
+
+def diff_documents(before, after):
+    """List of {field, before, after} for every dotted field that changed."""
+    old = flatten(before)
+    new = flatten(after)
+    changes = []
+    for field in sorted(set(old) | set(new)):
+        if field in ('_id', 'updated_at'):
+            continue
+        if old.get(field) != new.get(field):
+            changes.append({"field": field, "before": old.get(field), "after": new.get(field)})
+    return changes
+
+
+def audit_entry(action, member_id, before, after, admin=None, branch_id=None, change_id=None):
+    """An audit log entry. An entry with a change_id is only recorded once,
+    so a retried job doesn't log the same change twice."""
+    entry = {
+        "member_id": member_id,
+        "branch_id": branch_id,
+        "action": action,
+        "admin": admin,
+        "ts": datetime.now(),
+        "changes": diff_documents(before, after),
+    }
+    if change_id is not None:
+        entry["change_id"] = change_id
+    return entry
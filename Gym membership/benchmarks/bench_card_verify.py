@@ -0,0 +1,64 @@
+"""Membership card verifications per second on one core.
+
+Usage: python benchmarks/bench_card_verify.py [--cards N] [--revoked N] [--seconds S]
+
+Signs N cards and revokes some of them, then times verify_card() on its own
+and GET /verify through the Flask test client, cycling over the cards. Uses
+the in-memory storage backend, so no mongod is needed; verification reads
+nothing from storage either way.
+"""
+import argparse
+import itertools
+import os
+import sys
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rate(check, tokens, seconds):
+    cards = itertools.cycle(tokens)
+    done = 0
+    started = time.perf_counter()
+    deadline = started + seconds
+    while time.perf_counter() < deadline:
+        for token in itertools.islice(cards, 1000):
+            check(token)
+        done += 1000
+    return done / (time.perf_counter() - started)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--cards', type=int, default=10000)
+    parser.add_argument('--revoked', type=int, default=1000)
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+
+    os.environ['GYM_STORAGE'] = 'memory'
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    from bson.objectid import ObjectId
+
+    import gymmember
+    from cards import sign_card, verify_card
+
+    now = datetime.now()
+    member_ids = [ObjectId() for _ in range(args.cards)]
+    tokens = [sign_card(gymmember.card_key, member_id, now + timedelta(days=30), now) for member_id in member_ids]
+    for member_id in member_ids[:args.revoked]:
+        gymmember.card_revocations.revoke(member_id, gymmember.DEFAULT_BRANCH_ID, now + timedelta(days=30), 'bench')
+
+    per_second = rate(lambda token: verify_card(gymmember.card_key, token, gymmember.card_revocations),
+                      tokens, args.seconds)
+    print(f"verify_card()  {per_second:>10,.0f} per second")
+
+    client = gymmember.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+    per_second = rate(lambda token: client.get(f'/verify?token={token}'), tokens, args.seconds)
+    print(f"GET /verify    {per_second:>10,.0f} per second")
+
+
+if __name__ == '__main__':
+    main()
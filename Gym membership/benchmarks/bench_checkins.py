@@ -0,0 +1,68 @@
+"""Sustained check-in write throughput against a live MongoDB.
+
+Usage: python benchmarks/bench_checkins.py [--uri URI] [--count N] [--batch-sizes 1,100,1000]
+
+Writes into a scratch database (GymBench by default) which is dropped at the
+end, so it is safe to point at a development server.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson.objectid import ObjectId
+from pymongo import MongoClient
+
+from checkins import CheckinStore
+
+
+def run(store, member_ids, count, batch_size):
+    start_ts = datetime.now()
+    batch = []
+    started = time.perf_counter()
+    for i in range(count):
+        batch.append(('main', random.choice(member_ids), start_ts + timedelta(milliseconds=i * 50)))
+        if len(batch) >= batch_size:
+            store.record_many(batch)
+            batch = []
+    store.record_many(batch)
+    return time.perf_counter() - started
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='GymBench')
+    parser.add_argument('--count', type=int, default=50000)
+    parser.add_argument('--members', type=int, default=5000)
+    parser.add_argument('--batch-sizes', default='1,100,1000')
+    parser.add_argument('--bucketed', action='store_true',
+                        help='force the pre-5.0 bucketed layout')
+    args = parser.parse_args()
+
+    client = MongoClient(args.uri)
+    db = client[args.db]
+    member_ids = [ObjectId() for _ in range(args.members)]
+
+    try:
+        for batch_size in [int(size) for size in args.batch_sizes.split(',')]:
+            db.drop_collection('checkins')
+            store = CheckinStore(db)
+            store.ensure_collection(bucketed=True if args.bucketed else None)
+
+            # Unbatched writes are far slower; keep that run short
+            count = min(args.count, 5000) if batch_size == 1 else args.count
+            elapsed = run(store, member_ids, count, batch_size)
+            layout = 'bucketed' if store.bucketed else 'time-series'
+            print(f"{layout:12} batch={batch_size:<6} {count} check-ins in {elapsed:.2f}s "
+                  f"-> {count / elapsed:,.0f} writes/sec")
+    finally:
+        client.drop_database(args.db)
+
+
+if __name__ == '__main__':
+    main()
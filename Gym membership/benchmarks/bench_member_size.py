@@ -0,0 +1,117 @@
+"""Member document size and working set before and after the cold-field split.
+
+Usage: python benchmarks/bench_member_size.py [--uri URI] [--members N] [--years N]
+
+Seeds members that embed years of renewals in subscription.payments plus
+free-text profile fields, as members stored before member_details.py do.
+It then prints collStats for the members collection (average document
+size, data size and index size, which together are the working set the list
+pages need) and the time to page through the dashboard listing. Then it
+moves the cold fields out with split_members() and prints the same numbers
+again. Writes into a scratch database (GymBench by default) which is dropped
+at the end.
+"""
+import argparse
+import os
+import random
+import sys
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from bson.objectid import ObjectId
+
+from member_details import PAYMENTS_COLLECTION, PROFILES_COLLECTION, split_members
+from mongo_storage import MongoStorage
+
+BRANCH_ID = 'bench'
+PAGE_SIZE = 1000
+
+
+def seed(storage, count, years):
+    now = datetime.now()
+    members = []
+    for i in range(count):
+        start = now - timedelta(days=365 * years)
+        members.append({
+            "_id": ObjectId(),
+            "branch_id": BRANCH_ID,
+            "name": f"Member {i:07d}",
+            "age": random.randint(18, 70),
+            "contact": f"555{i:07d}",
+            "email": f"member{i}@example.com",
+            "address": f"{i} Long Street, Apartment {i % 300}, " * 3,
+            "emergency_contact": f"Contact {i} (555-000-{i % 10000:04d})",
+            "health_notes": "Knee injury in 2019, avoid deep squats. " * random.randint(1, 8),
+            "subscription": {
+                "plan_id": 1,
+                "plan_name": "Basic",
+                "price": 50,
+                "start_date": now - timedelta(days=30),
+                "expiry_date": now + timedelta(days=random.randint(-60, 300)),
+                "status": "active",
+                # One renewal a month
+                "payments": [{"date": start + timedelta(days=30 * month), "method": "credit card", "price": 50}
+                             for month in range(12 * years)],
+            },
+            "created_at": start,
+            "updated_at": now,
+        })
+        if len(members) == 5000:
+            storage.insert_members(members)
+            members = []
+    if members:
+        storage.insert_members(members)
+
+
+def measure(storage):
+    stats = storage.db.command('collStats', 'members')
+    started = time.perf_counter()
+    after, pages = None, 0
+    while True:
+        page = storage.list_members(BRANCH_ID, after=after, limit=PAGE_SIZE, primary=True)
+        if not page:
+            break
+        pages += 1
+        after = (page[-1]["name"], page[-1]["_id"])
+    return stats, pages, time.perf_counter() - started
+
+
+def show(title, stats, pages, elapsed):
+    working_set = stats["size"] + stats["totalIndexSize"]
+    print(f"{title:7} avg {stats.get('avgObjSize', 0):>7,.0f} B   data {stats['size'] / 1e6:>8.1f} MB   "
+          f"indexes {stats['totalIndexSize'] / 1e6:>6.1f} MB   working set {working_set / 1e6:>8.1f} MB   "
+          f"{pages} listing pages in {elapsed:.2f}s")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='mongodb://localhost:27017/')
+    parser.add_argument('--db', default='GymBench')
+    parser.add_argument('--members', type=int, default=50000)
+    parser.add_argument('--years', type=int, default=5)
+    args = parser.parse_args()
+
+    storage = MongoStorage(args.uri, args.db)
+    try:
+        storage.client.drop_database(args.db)
+        storage.members.create_index([("branch_id", 1), ("name", 1), ("_id", 1)])
+        storage.payments.create_index([("payment_id", 1)], unique=True)
+        storage.profiles.create_index([("member_id", 1)], unique=True)
+        seed(storage, args.members, args.years)
+
+        show("Before", *measure(storage))
+        started = time.perf_counter()
+        moved = split_members(storage)
+        print(f"Split {moved} members in {time.perf_counter() - started:.1f}s")
+        show("After", *measure(storage))
+        for name in (PROFILES_COLLECTION, PAYMENTS_COLLECTION):
+            stats = storage.db.command('collStats', name)
+            print(f"  {name}: {stats['count']} documents, {stats['size'] / 1e6:.1f} MB (read by view_member only)")
+    finally:
+        storage.client.drop_database(args.db)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,64 @@
+"""Template render time for the member list pages.
+
+Usage: python benchmarks/bench_render.py [--members N] [--repeat N]
+
+Seeds the in-memory storage backend, then times the dashboard and
+members-by-plan templates separately from the queries that feed them, and
+reports render time scaled to 10k rows. annotate_members() is counted as part
+of rendering, since it replaced the per-row date work the templates used to do.
+The dashboard's member table is built in the browser from /api/v1/member-table
+(timed by bench_routes.py), so for index.html only the expired list is rendered.
+"""
+import argparse
+import os
+import statistics
+import sys
+import time
+from datetime import datetime
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--members', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    os.environ['GYM_STORAGE'] = 'memory'
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    import gymmember
+    from bench_routes import seed_members
+    from flask import render_template
+    from member_dates import annotate_members
+
+    seed_members(gymmember.storage, args.members, gymmember.DEFAULT_BRANCH_ID)
+    storage, branch_id = gymmember.storage, gymmember.DEFAULT_BRANCH_ID
+    now = datetime.now()
+    pages = {
+        'index.html': ([], storage.expired_members(branch_id, now),
+                       {'plans': gymmember.plan_catalog.all(), 'plan_badges': gymmember.plan_catalog.badges()}),
+        'members_by_plan.html': (storage.list_members(branch_id, plan_id=2), [],
+                                 {'plan': gymmember.plan_catalog.get(2), 'plans': gymmember.plan_catalog.all()}),
+    }
+
+    with gymmember.app.test_request_context('/'):
+        for template, (members, expired, context) in pages.items():
+            samples = []
+            for _ in range(args.repeat):
+                started = time.perf_counter()
+                render_template(template, members=annotate_members(members, now),
+                                expired_members=annotate_members(expired, now),
+                                current_date=now, **context)
+                samples.append((time.perf_counter() - started) * 1000)
+            rows = len(members) + len(expired)
+            median = statistics.median(samples)
+            print(f"{template:22} rows={rows:<6} median={median:8.1f}ms "
+                  f"per 10k rows={median * 10000 / rows:8.1f}ms")
+
+    gymmember.write_queue.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+"""Per-route latency benchmark using the Flask test client.
+
+Usage: python benchmarks/bench_routes.py [--storage memory|sqlite|mongo] [--members N] [--requests N]
+       python benchmarks/bench_routes.py --compare memory,sqlite,mongo
+
+Runs against the in-memory storage backend by default, so no mongod is needed
+and the whole suite finishes in seconds. --storage sqlite uses a temporary
+database file. With --storage mongo the members are added to the configured
+database (GYM_MONGO_URI); use a scratch server. --compare runs each backend in
+its own process so startup time and peak memory are measured separately.
+"""
+import argparse
+import os
+import random
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def seed_members(storage, count, branch_id):
+    from plans import subscription_for
+
+    now = datetime.now()
+    plans = storage.list_plans()
+    members = []
+    for i in range(count):
+        start = now - timedelta(days=random.randint(0, 400))
+        subscription = subscription_for(random.choice(plans), start)
+        members.append({
+            "branch_id": branch_id,
+            "name": f"Member {i:06d}",
+            "age": random.randint(16, 70),
+            "contact": f"555-{i:07d}",
+            "subscription": subscription,
+            "created_at": start,
+            "updated_at": start
+        })
+    storage.insert_members(members)
+
+
+def timed(client, method, url, data=None):
+    started = time.perf_counter()
+    response = client.open(url, method=method, data=data)
+    elapsed = (time.perf_counter() - started) * 1000
+    # 403 (expired check-in) and 302 (form redirect) are normal answers
+    if response.status_code >= 500:
+        raise RuntimeError(f"{method} {url} returned {response.status_code}")
+    return elapsed
+
+
+def report(name, samples):
+    samples.sort()
+    p95 = samples[min(len(samples) - 1, int(len(samples) * 0.95))]
+    print(f"{name:28} n={len(samples):<5} mean={statistics.mean(samples):8.2f}ms "
+          f"p50={statistics.median(samples):8.2f}ms p95={p95:8.2f}ms")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--storage', default='memory', choices=['memory', 'sqlite', 'mongo'])
+    parser.add_argument('--compare', help='comma-separated backends to run one after another')
+    parser.add_argument('--members', type=int, default=2000)
+    parser.add_argument('--requests', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.compare:
+        for backend in args.compare.split(','):
+            print(f"=== {backend}", flush=True)
+            subprocess.run([sys.executable, os.path.abspath(__file__), '--storage', backend,
+                            '--members', str(args.members), '--requests', str(args.requests)])
+        return
+
+    os.environ['GYM_STORAGE'] = args.storage
+    if args.storage == 'sqlite' and 'GYM_SQLITE_PATH' not in os.environ:
+        os.environ['GYM_SQLITE_PATH'] = os.path.join(tempfile.mkdtemp(), 'bench.db')
+    os.chdir(APP_DIR)
+    sys.path.insert(0, APP_DIR)
+    started = time.perf_counter()
+    import gymmember
+    print(f"startup ({args.storage}): {(time.perf_counter() - started) * 1000:.0f}ms")
+
+    seed_members(gymmember.storage, args.members, gymmember.DEFAULT_BRANCH_ID)
+    client = gymmember.app.test_client()
+    client.post('/login', data={'username': 'admin', 'password': 'admin123'})
+
+    member_ids = [str(member["_id"]) for member in
+                  gymmember.storage.list_members(gymmember.DEFAULT_BRANCH_ID, limit=500, fields=[])]
+    routes = {
+        'GET /': lambda: ('GET', '/', None),
+        'GET /members_by_plan/2': lambda: ('GET', '/members_by_plan/2', None),
+        'GET /view_member': lambda: ('GET', f'/view_member/{random.choice(member_ids)}', None),
+        'GET /api/v1/members': lambda: ('GET', '/api/v1/members?limit=100', None),
+        'GET /api/v1/member-table': lambda: ('GET', '/api/v1/member-table?limit=1000', None),
+        'GET /api/v1/members/<id>': lambda: ('GET', f'/api/v1/members/{random.choice(member_ids)}', None),
+        'POST /checkin': lambda: ('POST', f'/checkin/{random.choice(member_ids)}', None),
+        'POST /update_subscription': lambda: ('POST', f'/update_subscription/{random.choice(member_ids)}', {
+            'new_plan': '2', 'start_date': '2026-01-01', 'expiry_date': '2026-04-01'
+        }),
+    }
+
+    print(f"{args.members} members, {args.requests} requests per route")
+    for name, make_request in routes.items():
+        samples = []
+        for _ in range(args.requests):
+            method, url, data = make_request()
+            samples.append(timed(client, method, url, data))
+        report(name, samples)
+
+    gymmember.write_queue.close()
+    # ru_maxrss is in kilobytes on Linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"peak memory (RSS): {peak_mb:.1f}MB")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,108 @@
+"""Check read routing and read-your-writes against a live replica set.
+
+Usage: python benchmarks/check_read_routing.py [--uri URI] [--read-preference MODE]
+
+A single-node replica set is enough:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0
+    mongosh --eval 'rs.initiate()'
+    python benchmarks/check_read_routing.py --uri 'mongodb://localhost:27017/?replicaSet=rs0'
+
+Every command the storage layer sends is recorded with the server that ran
+it, its $readPreference and whether it carried afterClusterTime. A member is
+added in one causal session and listed in a second session started from the
+first one's token, as the dashboard redirect does. The listing must include
+the member. Writes into a scratch database (GymReadRoutingCheck by default)
+which is dropped at the end.
+"""
+import argparse
+import os
+import sys
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from pymongo import MongoClient, monitoring
+
+from mongo_storage import MongoStorage
+from storage import MAX_STALENESS_SECONDS, READ_PREFERENCE
+
+BRANCH_ID = 'read-routing-check'
+
+
+class CommandLog(monitoring.CommandListener):
+
+    def __init__(self):
+        self.commands = []
+
+    def started(self, event):
+        if event.command_name in ('find', 'aggregate', 'insert', 'update', 'delete', 'findAndModify'):
+            command = event.command
+            self.commands.append((event.command_name, f"{event.connection_id[0]}:{event.connection_id[1]}",
+                                  command.get("$readPreference"),
+                                  "afterClusterTime" in (command.get("readConcern") or {})))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+
+def show(title, commands):
+    print(title)
+    for name, server, read_preference, after_cluster_time in commands:
+        mode = read_preference.get("mode") if read_preference else "primary"
+        staleness = (read_preference or {}).get("maxStalenessSeconds")
+        print(f"  {name:14} {server:22} {mode}"
+              f"{f' (max staleness {staleness}s)' if staleness else ''}"
+              f"{' afterClusterTime' if after_cluster_time else ''}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--uri', default='mongodb://localhost:27017/?replicaSet=rs0')
+    parser.add_argument('--db', default='GymReadRoutingCheck')
+    parser.add_argument('--read-preference', default=READ_PREFERENCE)
+    parser.add_argument('--max-staleness', type=int, default=MAX_STALENESS_SECONDS)
+    args = parser.parse_args()
+
+    hello = MongoClient(args.uri).admin.command('hello')
+    if 'setName' not in hello:
+        print("Not a replica set member. Start mongod with --replSet rs0, run rs.initiate() "
+              "and pass --uri 'mongodb://localhost:27017/?replicaSet=rs0'")
+        return 1
+    print(f"Replica set {hello['setName']}: {', '.join(hello['hosts'])}")
+
+    log = CommandLog()
+    storage = MongoStorage(args.uri, args.db, read_preference=args.read_preference,
+                           max_staleness=args.max_staleness, event_listeners=[log])
+    try:
+        now = datetime.now()
+        member = {"branch_id": BRANCH_ID, "name": "Read Routing", "age": 30, "contact": "0",
+                  "subscription": {"plan_id": 1, "start_date": now, "expiry_date": now + timedelta(days=30)},
+                  "created_at": now, "updated_at": now}
+        with storage.causal_session() as token:
+            member_id = storage.insert_member(member)
+            after = token()
+        show("Write (add_member):", log.commands)
+        print(f"  token: {after}")
+
+        log.commands.clear()
+        with storage.causal_session(after=after):
+            members = storage.list_members(BRANCH_ID)
+            storage.expired_members(BRANCH_ID, now)
+            storage.get_member(BRANCH_ID, member_id)
+        show("Reads after the redirect (dashboard):", log.commands)
+
+        if member_id not in [listed["_id"] for listed in members]:
+            print("FAIL: the listing does not include the member just added")
+            return 1
+        print("OK: the listing includes the member just added")
+        return 0
+    finally:
+        storage.client.drop_database(args.db)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,212 @@
+"""Membership cards that the front desk verifies without a database read.
+
+A card carries a token signed with HMAC-SHA256 over the member's _id, the
+subscription expiry date and the time the card was issued. The token is
+base64url of:
+
+    version (1 byte) | _id (12) | expiry (4) | issued (4) | signature (16)
+
+with times in seconds since 1970. That is 50 characters, small enough for a
+low-density QR code that any phone camera reads. verify_card() checks the
+signature and the expiry date from the token alone. The only other thing it
+looks at is the in-memory revocation set.
+
+A card is revoked by recording revoked_before for its member in the
+card_revocations collection. Cards issued before that time stop verifying,
+and cards issued after it work. Members are revoked when:
+
+- they are deleted,
+- their expiry date is moved earlier (their old cards show the later date),
+- an admin reports a lost card.
+
+Each process keeps the revocations in memory. It updates them at once for
+its own revocations and reloads the others' every
+GYM_CARD_REVOCATION_REFRESH_SECONDS. A revocation is dropped from memory
+once every card it covers has expired anyway, so the set stays small.
+
+The signing key is GYM_CARD_SECRET. Every app process must use the same key,
+and cards printed with one key stop verifying when the key changes.
+"""
+import base64
+import binascii
+import hashlib
+import hmac
+import logging
+import os
+import struct
+import threading
+from datetime import datetime, timedelta
+
+try:
+    import segno
+except ImportError:  # segno is optional; without it the card shows the token as text
+    segno = None
+
+logger = logging.getLogger(__name__)
+
+CARD_REVOCATIONS_COLLECTION = 'card_revocations'
+REVOCATION_REFRESH_SECONDS = int(os.environ.get('GYM_CARD_REVOCATION_REFRESH_SECONDS', 30))
+TOKEN_VERSION = 1
+SIGNATURE_BYTES = 16
+# Each refresh reads back this far, for revocations written by a node whose clock is behind
+REFRESH_OVERLAP = timedelta(minutes=1)
+
+_EPOCH = datetime(1970, 1, 1)
+_PAYLOAD = struct.Struct('>B12sII')
+_TOKEN_BYTES = _PAYLOAD.size + SIGNATURE_BYTES
+
+
+class InvalidCardError(ValueError):
+    pass
+
+
+def card_secret():
+    """The signing key from GYM_CARD_SECRET, or a random one for this
+    process only."""
+    secret = os.environ.get('GYM_CARD_SECRET')
+    if secret:
+        return secret.encode()
+    logger.warning("GYM_CARD_SECRET is not set; membership cards will stop verifying after a restart")
+    return os.urandom(32)
+
+
+def _seconds(value):
+    return int((value - _EPOCH).total_seconds())
+
+
+def _signature(key, payload):
+    return hmac.new(key, payload, hashlib.sha256).digest()[:SIGNATURE_BYTES]
+
+
+def sign_card(key, member_id, expiry_date, issued_at):
+    """The card token for a member whose subscription ends at expiry_date."""
+    payload = _PAYLOAD.pack(TOKEN_VERSION, member_id.binary, _seconds(expiry_date), _seconds(issued_at))
+    return base64.urlsafe_b64encode(payload + _signature(key, payload)).rstrip(b'=').decode('ascii')
+
+
+def read_card(key, token):
+    """(member_id bytes, expiry_date, issued_at) of a token with a valid
+    signature. Raises InvalidCardError otherwise."""
+    try:
+        raw = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+    except (binascii.Error, ValueError):
+        raise InvalidCardError("malformed")
+    if len(raw) != _TOKEN_BYTES:
+        raise InvalidCardError("malformed")
+    payload, signature = raw[:_PAYLOAD.size], raw[_PAYLOAD.size:]
+    if not hmac.compare_digest(signature, _signature(key, payload)):
+        raise InvalidCardError("bad_signature")
+    version, member_id, expiry, issued = _PAYLOAD.unpack(payload)
+    if version != TOKEN_VERSION:
+        raise InvalidCardError("unsupported_version")
+    return member_id, _EPOCH + timedelta(seconds=expiry), _EPOCH + timedelta(seconds=issued)
+
+
+def card_qr_svg(token):
+    """The token as an inline SVG QR code, or None without segno."""
+    if segno is None:
+        return None
+    return segno.make(token, error='m').svg_inline(scale=5, border=2)
+
+
+class CardRevocations:
+    """In-memory member_id -> (revoked_before, expires_at) of revoked cards.
+
+    expires_at is the latest expiry date a revoked card of the member can
+    carry; after it the entry is no longer needed.
+    """
+
+    def __init__(self, storage, interval=REVOCATION_REFRESH_SECONDS):
+        self.storage = storage
+        self.interval = interval
+        self.stats = {"refreshes": 0, "failed": 0, "revoked": 0}
+        self._entries = {}
+        self._since = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def revoke(self, member_id, branch_id, expires_at, reason, now=None):
+        """Revoke the member's cards issued until now."""
+        now = now or datetime.now()
+        expires_at = expires_at or now
+        # Whole seconds, like the tokens; a card issued later in this second still works
+        revoked_before = now.replace(microsecond=0) + timedelta(seconds=1)
+        self.storage.revoke_cards(member_id, branch_id, revoked_before, expires_at, reason, now)
+        self._add(member_id.binary, revoked_before, expires_at)
+        self.stats["revoked"] += 1
+
+    def issue_time(self, member_id, now=None):
+        """When a card printed now counts as issued: never before the
+        member's last revocation."""
+        now = (now or datetime.now()).replace(microsecond=0)
+        entry = self._entries.get(member_id.binary)
+        return max(now, entry[0]) if entry is not None else now
+
+    def is_revoked(self, member_id, issued_at):
+        entry = self._entries.get(member_id)
+        return entry is not None and issued_at < entry[0]
+
+    def refresh(self, now=None):
+        """Load the revocations recorded since the last refresh, and drop
+        the ones whose cards have all expired."""
+        now = now or datetime.now()
+        since = self._since
+        for revocation in self.storage.card_revocations(since - REFRESH_OVERLAP if since else None):
+            self._add(revocation["member_id"].binary, revocation["revoked_before"], revocation["expires_at"])
+            since = max(since or revocation["updated_at"], revocation["updated_at"])
+        with self._lock:
+            self._entries = {member_id: entry for member_id, entry in self._entries.items() if entry[1] >= now}
+        self._since = since
+        self.stats["refreshes"] += 1
+
+    def _add(self, member_id, revoked_before, expires_at):
+        with self._lock:
+            entry = self._entries.get(member_id)
+            if entry is not None:
+                revoked_before, expires_at = max(revoked_before, entry[0]), max(expires_at, entry[1])
+            self._entries[member_id] = (revoked_before, expires_at)
+
+    def start(self):
+        self.refresh()
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='card-revocations', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            try:
+                self.refresh()
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("Card revocation refresh failed")
+
+    def snapshot(self):
+        return dict(self.stats, size=len(self._entries), interval_seconds=self.interval)
+
+
+def verify_card(key, token, revocations, now=None):
+    """Check a card token: signature, expiry date and revocation.
+
+    Returns {"valid", "reason", "member_id", "expiry_date", "issued_at"}.
+    reason is None for a valid card, otherwise malformed, bad_signature,
+    unsupported_version, expired or revoked.
+    """
+    now = now or datetime.now()
+    try:
+        member_id, expiry_date, issued_at = read_card(key, token)
+    except InvalidCardError as e:
+        return {"valid": False, "reason": str(e), "member_id": None, "expiry_date": None, "issued_at": None}
+
+    reason = None
+    if revocations.is_revoked(member_id, issued_at):
+        reason = "revoked"
+    elif expiry_date < now:
+        reason = "expired"
+    return {"valid": reason is None, "reason": reason, "member_id": member_id.hex(),
+            "expiry_date": expiry_date, "issued_at": issued_at}
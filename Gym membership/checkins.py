@@ -0,0 +1,221 @@
+import os
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from threading import Lock
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import CollectionInvalid
+
+CHECKINS_COLLECTION = 'checkins'
+BUCKET_SIZE = 500
+EXPIRY_CACHE_TTL = 60  # seconds
+EXPIRY_CACHE_SIZE = int(os.environ.get('GYM_EXPIRY_CACHE_SIZE', 4096))
+
+
+class ExpiryCache:
+    """Bounded LRU cache of (branch_id, member_id) -> subscription expiry date.
+
+    Door check-ins only need the expiry date, so it is kept in memory and
+    refreshed at most once per TTL. Unknown members are cached as None too,
+    so a card that is swiped repeatedly doesn't hit the database each time.
+    Expired entries are dropped as they are found, and a date loaded while
+    the member was being invalidated is returned but not cached.
+    """
+
+    def __init__(self, loader, ttl=EXPIRY_CACHE_TTL, capacity=EXPIRY_CACHE_SIZE):
+        self.loader = loader
+        self.ttl = ttl
+        self.capacity = capacity
+        self._entries = OrderedDict()
+        # key -> generation of the load in flight; invalidate() drops it
+        self._loading = {}
+        self._generation = 0
+        self._lock = Lock()
+
+    def get(self, branch_id, member_id):
+        key = (branch_id, member_id)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                if entry[1] > time.monotonic():
+                    self._entries.move_to_end(key)
+                    return entry[0]
+                del self._entries[key]
+            self._generation += 1
+            generation = self._loading[key] = self._generation
+
+        loaded = False
+        try:
+            expiry_date = self.loader(branch_id, member_id)
+            loaded = True
+        finally:
+            with self._lock:
+                if self._loading.get(key) == generation:
+                    del self._loading[key]
+                    if loaded:
+                        self._store(key, expiry_date)
+        return expiry_date
+
+    def _store(self, key, expiry_date):
+        now = time.monotonic()
+        self._entries[key] = (expiry_date, now + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+        # Expired entries collect at the least recently used end
+        while self._entries:
+            oldest = next(iter(self._entries.values()))
+            if oldest[1] > now:
+                break
+            self._entries.popitem(last=False)
+
+    def invalidate(self, branch_id, member_id):
+        with self._lock:
+            self._loading.pop((branch_id, member_id), None)
+            self._entries.pop((branch_id, member_id), None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._loading.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class CheckinStore:
+    """Check-in events stored in a time-series collection.
+
+    Servers older than MongoDB 5.0 have no time-series collections, so the
+    events are grouped into hourly bucket documents of up to BUCKET_SIZE
+    entries per branch instead. Both layouts answer the same queries, and
+    every query is scoped to one branch.
+    """
+
+    def __init__(self, db, name=CHECKINS_COLLECTION, report_db=None):
+        self.db = db
+        self.name = name
+        self.collection = db[name]
+        # Occupancy reports may be served by a secondary
+        self.report_collection = (report_db if report_db is not None else db)[name]
+        self.bucketed = False
+
+    def ensure_collection(self, bucketed=None):
+        if bucketed is None:
+            version = self.db.client.server_info().get("versionArray", [0])
+            bucketed = version < [5, 0]
+        self.bucketed = bucketed
+
+        if self.bucketed:
+            self.collection.create_index([("branch_id", ASCENDING), ("hour", ASCENDING), ("count", ASCENDING)])
+            self.collection.create_index([("branch_id", ASCENDING), ("events.member_id", ASCENDING),
+                                          ("hour", ASCENDING)])
+            return
+
+        if self.name not in self.db.list_collection_names():
+            try:
+                self.db.create_collection(self.name, timeseries={
+                    "timeField": "ts",
+                    "metaField": "meta",
+                    "granularity": "minutes"
+                })
+            except CollectionInvalid:
+                pass  # Created concurrently by another worker
+        self.collection.create_index([("meta.branch_id", ASCENDING), ("meta.member_id", ASCENDING),
+                                      ("ts", DESCENDING)])
+        self.collection.create_index([("meta.branch_id", ASCENDING), ("ts", ASCENDING)])
+
+    def record(self, branch_id, member_id, ts=None):
+        self.record_many([(branch_id, member_id, ts or datetime.now())])
+
+    def record_many(self, checkins):
+        """Write a batch of (branch_id, member_id, ts) in a single round-trip."""
+        if not checkins:
+            return
+
+        if not self.bucketed:
+            self.collection.insert_many(
+                [{"meta": {"branch_id": branch_id, "member_id": member_id}, "ts": ts}
+                 for branch_id, member_id, ts in checkins],
+                ordered=False
+            )
+            return
+
+        by_hour = {}
+        for branch_id, member_id, ts in checkins:
+            hour = ts.replace(minute=0, second=0, microsecond=0)
+            by_hour.setdefault((branch_id, hour), []).append({"member_id": member_id, "ts": ts})
+
+        # Fill the open bucket of each branch and hour; a full bucket no longer
+        # matches the filter, so the upsert starts a new one
+        operations = []
+        for (branch_id, hour), events in by_hour.items():
+            for start in range(0, len(events), BUCKET_SIZE):
+                chunk = events[start:start + BUCKET_SIZE]
+                operations.append(UpdateOne(
+                    {"branch_id": branch_id, "hour": hour, "count": {"$lte": BUCKET_SIZE - len(chunk)}},
+                    {"$push": {"events": {"$each": chunk}}, "$inc": {"count": len(chunk)}},
+                    upsert=True
+                ))
+        self.collection.bulk_write(operations, ordered=False)
+
+    def member_checkins(self, branch_id, member_id, limit=50):
+        if not self.bucketed:
+            return list(self.collection.find(
+                {"meta.branch_id": branch_id, "meta.member_id": member_id}, {"_id": 0, "ts": 1}
+            ).sort("ts", DESCENDING).limit(limit))
+
+        pipeline = [
+            {"$match": {"branch_id": branch_id, "events.member_id": member_id}},
+            {"$sort": {"hour": DESCENDING}},
+            {"$unwind": "$events"},
+            {"$match": {"events.member_id": member_id}},
+            {"$sort": {"events.ts": DESCENDING}},
+            {"$limit": limit},
+            {"$project": {"_id": 0, "ts": "$events.ts"}}
+        ]
+        return list(self.collection.aggregate(pipeline))
+
+    def reassign(self, member_ids, new_member_id):
+        """Move the check-ins of member_ids to new_member_id (merged duplicates)."""
+        member_ids = list(member_ids)
+        if not self.bucketed:
+            # meta is the time-series metaField, which update_many may change
+            self.collection.update_many({"meta.member_id": {"$in": member_ids}},
+                                        {"$set": {"meta.member_id": new_member_id}})
+            return
+
+        self.collection.update_many(
+            {"events.member_id": {"$in": member_ids}},
+            {"$set": {"events.$[event].member_id": new_member_id}},
+            array_filters=[{"event.member_id": {"$in": member_ids}}]
+        )
+
+    def hourly_occupancy(self, branch_id, start, end):
+        """Check-ins and distinct members of a branch per hour between start and end."""
+        if not self.bucketed:
+            pipeline = [
+                {"$match": {"meta.branch_id": branch_id, "ts": {"$gte": start, "$lt": end}}},
+                {"$group": {
+                    "_id": {"$dateTrunc": {"date": "$ts", "unit": "hour"}},
+                    "checkins": {"$sum": 1},
+                    "members": {"$addToSet": "$meta.member_id"}
+                }}
+            ]
+        else:
+            pipeline = [
+                {"$match": {"branch_id": branch_id, "hour": {"$gte": start - timedelta(hours=1), "$lt": end}}},
+                {"$unwind": "$events"},
+                {"$match": {"events.ts": {"$gte": start, "$lt": end}}},
+                {"$group": {
+                    "_id": "$hour",
+                    "checkins": {"$sum": 1},
+                    "members": {"$addToSet": "$events.member_id"}
+                }}
+            ]
+        pipeline += [
+            {"$project": {"_id": 0, "hour": "$_id", "checkins": 1,
+                          "unique_members": {"$size": "$members"}}},
+            {"$sort": {"hour": ASCENDING}}
+        ]
+        return list(self.report_collection.aggregate(pipeline))
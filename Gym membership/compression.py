@@ -0,0 +1,131 @@
+"""On-the-fly gzip / Brotli compression of HTML and JSON responses.
+
+Responses smaller than COMPRESS_MIN_SIZE go out as they are; compressing
+them costs more than it saves. Whole responses are compressed in one call.
+Streamed responses (stream_template pages) are compressed incrementally.
+The first COMPRESS_MIN_SIZE bytes are buffered to decide whether
+compressing is worthwhile. After that the compressor is flushed every
+STREAM_FLUSH_SIZE bytes of input, so the browser can start rendering long
+member tables before the last row is generated.
+"""
+import zlib
+
+try:
+    import brotli
+except ImportError:  # Brotli is optional; responses fall back to gzip
+    brotli = None
+
+COMPRESS_MIN_SIZE = 500
+COMPRESSIBLE_TYPES = ('text/html', 'application/json', 'text/css', 'application/javascript')
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 4  # fast enough for per-request compression
+STREAM_FLUSH_SIZE = 16 * 1024
+
+
+def accepted_encoding(accept_encoding):
+    """'br' or 'gzip' if the client accepts it (q > 0), else None."""
+    accepted = set()
+    for part in (accept_encoding or '').split(','):
+        token, _, params = part.strip().partition(';')
+        params = params.replace(' ', '')
+        if token and params not in ('q=0', 'q=0.0', 'q=0.00', 'q=0.000'):
+            accepted.add(token.lower())
+    if brotli is not None and 'br' in accepted:
+        return 'br'
+    if 'gzip' in accepted:
+        return 'gzip'
+    return None
+
+
+class StreamCompressor:
+    """Incremental compressor with a common interface for gzip and Brotli."""
+
+    def __init__(self, encoding, best=False):
+        self.encoding = encoding
+        if encoding == 'br':
+            self._compressor = brotli.Compressor(quality=11 if best else BROTLI_QUALITY)
+        else:
+            # wbits=31: zlib stream with a gzip header and trailer
+            self._compressor = zlib.compressobj(9 if best else GZIP_LEVEL, zlib.DEFLATED, 31)
+
+    def compress(self, data):
+        if self.encoding == 'br':
+            return self._compressor.process(data)
+        return self._compressor.compress(data)
+
+    def flush(self):
+        """Everything compressed so far, without ending the stream."""
+        if self.encoding == 'br':
+            return self._compressor.flush()
+        return self._compressor.flush(zlib.Z_SYNC_FLUSH)
+
+    def finish(self):
+        if self.encoding == 'br':
+            return self._compressor.finish()
+        return self._compressor.flush(zlib.Z_FINISH)
+
+
+def compress(data, encoding, best=False):
+    """Compress data in one go; best trades speed for size (for static files)."""
+    compressor = StreamCompressor(encoding, best)
+    return compressor.compress(data) + compressor.finish()
+
+
+def compress_stream(chunks, encoding, flush_size=STREAM_FLUSH_SIZE):
+    compressor = StreamCompressor(encoding)
+    pending = 0
+    for chunk in chunks:
+        output = compressor.compress(chunk)
+        pending += len(chunk)
+        if pending >= flush_size:
+            output += compressor.flush()
+            pending = 0
+        if output:
+            yield output
+    yield compressor.finish()
+
+
+def _compressible(response):
+    return (response.mimetype in COMPRESSIBLE_TYPES
+            and not response.direct_passthrough
+            and 'Content-Encoding' not in response.headers
+            and response.status_code not in (204, 304))
+
+
+def compress_response(response, accept_encoding, min_size=COMPRESS_MIN_SIZE):
+    """Compress response in place if the client and the content allow it."""
+    if not _compressible(response):
+        return response
+    response.vary.add('Accept-Encoding')
+    encoding = accepted_encoding(accept_encoding)
+    if encoding is None:
+        return response
+
+    if not response.is_streamed:
+        data = response.get_data()
+        if len(data) < min_size:
+            return response
+        response.set_data(compress(data, encoding))
+        response.headers['Content-Encoding'] = encoding
+        return response
+
+    # Buffer until min_size is reached; a short stream is sent uncompressed
+    chunks = response.iter_encoded()
+    head, size = [], 0
+    for chunk in chunks:
+        head.append(chunk)
+        size += len(chunk)
+        if size >= min_size:
+            break
+    else:
+        response.response = head
+        return response
+
+    def body():
+        yield from head
+        yield from chunks
+
+    response.response = compress_stream(body(), encoding)
+    response.headers['Content-Encoding'] = encoding
+    response.headers.pop('Content-Length', None)
+    return response
@@ -0,0 +1,251 @@
+"""Contact normalization and merging of duplicate members.
+
+Members keep their contact number as typed ("555-123 4567", "(555) 1234567").
+Next to it they get contact_normalized, which holds only the digits, and
+email_normalized, which is the email trimmed and lower-cased. A unique
+partial index on (branch_id, contact_normalized) stops new duplicates, and
+add_member points at the member that already has the number.
+
+Members created before normalization are filled in by a background
+backfill. The backfill skips a member whose number is already taken by
+another member, so it never fails on the unique index. Those duplicates,
+and any that predate the backfill, are merged by hand:
+
+    python dedupe.py            # list duplicate groups
+    python dedupe.py --apply    # merge them, DEDUPE_BATCH_SIZE groups at a time
+
+Duplicates are found in a single pass (one $group aggregation on MongoDB)
+that normalizes the raw contact itself, so it also finds members the
+backfill had to skip. In each group the member with the latest expiry date
+survives. It receives the payments of all the others, fields (and profile
+fields) it has no value for, and the check-ins of the others. The other
+members are then deleted.
+"""
+import argparse
+import logging
+import re
+import sys
+import threading
+from datetime import datetime
+
+from audit import audit_entry
+from member_details import PROFILE_FIELDS, payment_record, split_member
+
+logger = logging.getLogger(__name__)
+
+NORMALIZE_BATCH_SIZE = 1000
+DEDUPE_BATCH_SIZE = 100
+
+NON_DIGITS = re.compile(r'[^0-9]')
+
+# Fields merge_group() never copies from a duplicate into the survivor
+MERGE_SKIPPED_FIELDS = ('_id', 'branch_id', 'subscription', 'created_at', 'updated_at',
+                        'contact_normalized', 'email_normalized', 'merged_ids')
+
+
+def normalize_contact(contact):
+    """Digits of a contact number, or None if it has none."""
+    digits = NON_DIGITS.sub('', contact) if isinstance(contact, str) else ''
+    return digits or None
+
+
+def normalize_email(email):
+    email = email.strip().lower() if isinstance(email, str) else ''
+    return email or None
+
+
+def normalized_fields(member):
+    return {
+        "contact_normalized": normalize_contact(member.get("contact")),
+        "email_normalized": normalize_email(member.get("email")),
+    }
+
+
+def normalize_members(storage, batch_size=NORMALIZE_BATCH_SIZE, on_batch=None):
+    """Set the normalized fields on members that lack them.
+
+    Walks the members in _id order. A member whose number already belongs to
+    another member of its branch is skipped and left for merge_duplicates().
+    Returns (updated, skipped).
+    """
+    after, updated, skipped = None, 0, 0
+    while True:
+        rows = storage.members_without_normalized_fields(after, batch_size)
+        if not rows:
+            return updated, skipped
+
+        updates = [(member_id, normalized_fields({"contact": contact, "email": email}))
+                   for member_id, contact, email in rows]
+        changed = storage.set_normalized_fields(updates)
+        updated += changed
+        skipped += len(updates) - changed
+        if on_batch is not None:
+            on_batch([member_id for member_id, _ in updates])
+        after = rows[-1][0]
+
+
+def normalize_in_background(storage, on_batch=None):
+    def run():
+        try:
+            updated, skipped = normalize_members(storage, on_batch=on_batch)
+            if updated:
+                logger.info("Normalized contact and email of %d members", updated)
+            if skipped:
+                logger.warning("%d members share a contact number with another member; "
+                               "run python dedupe.py --apply to merge them", skipped)
+        except Exception:
+            logger.exception("Contact normalization failed")
+
+    thread = threading.Thread(target=run, name='contact-normalize', daemon=True)
+    thread.start()
+    return thread
+
+
+def _purchase(member):
+    """The purchase of a member's current subscription, as a payment.
+
+    Members added from the dashboard before payments were recorded have no
+    payments. For them this purchase is the history.
+    """
+    subscription = member.get("subscription") or {}
+    if subscription.get("start_date") is None:
+        return None
+    payment = {"date": subscription["start_date"], "method": subscription.get("method_payment")}
+    for field in ('plan_id', 'plan_name', 'price'):
+        if subscription.get(field) is not None:
+            payment[field] = subscription[field]
+    return payment
+
+
+def merge_group(members, profiles=None, now=None):
+    """Merge one group of duplicates.
+
+    members hold no profile fields or payments (see member_details.py);
+    profiles maps their _ids to their profiles. Returns (merged, profile,
+    duplicates). merged is the surviving member with the fields it was
+    missing and profile its profile filled in the same way. duplicates
+    are the other members of the group.
+    """
+    now = now or datetime.now()
+    members = sorted(members, key=lambda member: (member.get("created_at") or datetime.max, member["_id"]))
+    # Latest expiry wins; on a tie, the oldest member (max keeps the first)
+    survivor = max(members, key=lambda member: (member.get("subscription") or {}).get("expiry_date")
+                   or datetime.min)
+    duplicates = [member for member in members if member["_id"] != survivor["_id"]]
+
+    merged = dict(survivor)
+    for member in members:
+        for field, value in member.items():
+            if field not in MERGE_SKIPPED_FIELDS and merged.get(field) in (None, ''):
+                merged[field] = value
+
+    profiles = profiles or {}
+    profile = {}
+    for member in [survivor] + duplicates:
+        for field, value in (profiles.get(member["_id"]) or {}).items():
+            if field in PROFILE_FIELDS and profile.get(field) in (None, ''):
+                profile[field] = value
+
+    created = [member["created_at"] for member in members if member.get("created_at")]
+    if created:
+        merged["created_at"] = min(created)
+    merged["merged_ids"] = list(survivor.get("merged_ids") or []) + [member["_id"] for member in duplicates]
+    merged.update(normalized_fields(merged))
+    merged["updated_at"] = now
+    return merged, profile, duplicates
+
+
+def merge_duplicates(storage, batch_size=DEDUPE_BATCH_SIZE, apply=False, on_batch=None):
+    """Find duplicate groups and, with apply, merge them batch_size groups at a time.
+
+    Each batch reads its members in one query per branch and writes one
+    audit entry per member. on_batch is called with the _ids each batch
+    changed. Returns (groups, members removed).
+    """
+    groups = removed = 0
+    batch = []
+
+    def flush():
+        nonlocal removed
+        by_branch = {}
+        for branch_id, _, member_ids in batch:
+            by_branch.setdefault(branch_id, []).extend(member_ids)
+        documents = {}
+        for branch_id, member_ids in by_branch.items():
+            documents.update((member["_id"], member) for member in storage.get_members(branch_id, member_ids))
+
+        entries, changed = [], []
+        for branch_id, _, member_ids in batch:
+            members = [documents[member_id] for member_id in member_ids if member_id in documents]
+            if len(members) < 2:
+                continue
+            # Embedded profile fields and payments go to their side collections
+            # first; merge_members then moves the duplicates' payments over
+            splits = [split_member(member) for member in members]
+            storage.move_cold_fields([(member["_id"], branch_id, profile, payments)
+                                      for member, profile, payments in splits if profile or payments])
+            members = [member for member, _, _ in splits]
+            purchases = []
+            for member in members:
+                purchase = _purchase(member)
+                if purchase is not None and not storage.member_payments(branch_id, member["_id"], 1):
+                    purchases.append(payment_record(member["_id"], branch_id, purchase, f"{member['_id']}:purchase"))
+            storage.insert_payments(purchases)
+
+            profiles = {member["_id"]: storage.get_member_profile(branch_id, member["_id"]) for member in members}
+            merged, profile, duplicates = merge_group(members, profiles)
+            if profile:
+                storage.move_cold_fields([(merged["_id"], branch_id, profile, [])])
+            survivor = next(member for member in members if member["_id"] == merged["_id"])
+            removed += storage.merge_members(branch_id, merged, [member["_id"] for member in duplicates])
+            entries.append(audit_entry('merge_member', merged["_id"], survivor, merged,
+                                       admin='dedupe', branch_id=branch_id))
+            entries += [audit_entry('merge_duplicate', member["_id"], member, None,
+                                    admin='dedupe', branch_id=branch_id) for member in duplicates]
+            changed += [member["_id"] for member in members]
+        if entries:
+            storage.insert_audit_entries(entries)
+        if on_batch is not None:
+            on_batch(changed)
+        batch.clear()
+
+    for group in storage.duplicate_contact_groups():
+        groups += 1
+        if not apply:
+            branch_id, contact, member_ids = group
+            print(f"{branch_id} {contact}: {', '.join(str(member_id) for member_id in member_ids)}")
+            continue
+        batch.append(group)
+        if len(batch) == batch_size:
+            flush()
+    if batch:
+        flush()
+    return groups, removed
+
+
+def main():
+    from storage import create_storage
+
+    parser = argparse.ArgumentParser(description="Find and merge members that share a contact number")
+    parser.add_argument('--apply', action='store_true', help='merge the duplicates')
+    parser.add_argument('--batch-size', type=int, default=DEDUPE_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    storage = create_storage()
+    groups, removed = merge_duplicates(storage, args.batch_size, apply=args.apply)
+    if not groups:
+        print("No duplicate members")
+        return 0
+    if not args.apply:
+        print(f"{groups} duplicate groups; run with --apply to merge them")
+        return 1
+
+    updated, skipped = normalize_members(storage)
+    print(f"Merged {groups} groups, removed {removed} duplicate members, "
+          f"normalized {updated} members ({skipped} skipped)")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,45 +1,119 @@
 import os
+import atexit
+import base64
+import json
+import time
 from datetime import datetime, timedelta
 from functools import wraps
 from bson.objectid import ObjectId
+from bson.errors import InvalidId
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask import (
     Flask, render_template, request, redirect, 
-    url_for, flash, session, abort, make_response
+    url_for, flash, session, abort, make_response,
+    stream_template, g, send_from_directory
 )
-from pymongo import MongoClient, ASCENDING
 from pymongo.errors import PyMongoError
+from assets import ASSET_MAX_AGE, AssetManifest
+from audit import HISTORY_LIMIT, audit_entry
+from cards import CardRevocations, card_qr_svg, card_secret, sign_card, verify_card
+from checkins import ExpiryCache
+from compression import accepted_encoding, compress_response
+from dedupe import normalize_in_background, normalized_fields
+from jobs import JobRunner
+from member_cache import MemberCache, attach_invalidation
+from member_dates import annotate_member, annotate_members
+from notifications import GYM_NAME, NOTIFICATIONS_LIMIT, NotificationDispatcher, create_transports
+from member_details import (PAYMENTS_LIMIT, PROFILE_FIELDS, payment_record, split_in_background,
+                            split_member)
+from plans import BADGE_CLASSES, PlanCatalog, backfill_in_background, plan_version, subscription_for
+from profiling import (PROFILE_ARG, PROFILE_HEADER, PROFILE_MODE, ProfiledTemplate, RequestProfiler, RouteTimings,
+                       current as current_profile, profile_mode)
+from proration import PERIODS_LIMIT, change_plan, migrate_members, subscription_period
+from storage import DuplicateMemberError, PlanVersionExistsError, create_storage
+from sweeper import StatusSweeper
+from warmup import WarmUp
+from write_behind import WriteBehindQueue
+
+try:
+    import analytics
+except ImportError:  # NumPy is optional; only /analytics needs it
+    analytics = None
 
 app = Flask(__name__)
 app.secret_key = os.urandom(24)  # Better to use a fixed secret key in production
 
-# MongoDB connection
-client = MongoClient('mongodb://localhost:27017/')
-db = client['GymDB']
-members_collection = db['members']
-subscriptions_collection = db['subscriptions']
-admin_collection = db['admin']
+# Stylesheets are served from /assets under content-hashed names, cached for a year
+asset_manifest = AssetManifest(app.static_folder)
+app.jinja_env.globals['asset_url'] = asset_manifest.url
+# Times rendering per template and block while a request is profiled
+app.jinja_env.template_class = ProfiledTemplate
+
+# Request durations per route; GYM_PROFILE or an admin's X-Gym-Profile header profiles requests
+route_timings = RouteTimings()
+request_profiler = RequestProfiler()
+UNTIMED_ENDPOINTS = ('asset', 'static', 'healthz', 'readyz')
+
+# Storage backend: MongoDB by default, GYM_STORAGE=memory for tests and benchmarks
+storage = create_storage()
+
+# Plans change rarely; pages and forms read them from memory
+plan_catalog = PlanCatalog(lambda: storage.list_plans())
+
+# Recently opened members (view -> print -> back) are served from memory
+member_cache = MemberCache()
+attach_invalidation(member_cache, storage)
+
+# Small, frequent writes (last_login, check-ins) are batched off the request path
+write_queue = WriteBehindQueue()
+write_queue.add_sink('admin', lambda logins: storage.record_logins(logins))
+write_queue.add_sink('checkins', lambda checkins: storage.checkins.record_many(checkins))
+write_queue.add_sink('audit', lambda entries: storage.insert_audit_entries(entries))
+write_queue.start()
+atexit.register(write_queue.close)
+
+# Long-running admin actions run as jobs on worker threads, not in the request
+job_runner = JobRunner(storage)
+
+# Membership cards are verified from their signature; revoked cards are kept in memory
+card_key = card_secret()
+card_revocations = CardRevocations(storage)
+
+# Columnar member snapshots for /analytics, reloaded every ANALYTICS_CACHE_SECONDS
+if analytics is not None:
+    snapshot_cache = analytics.SnapshotCache(
+        lambda branch_id: storage.member_snapshot(branch_id, analytics.SNAPSHOT_BATCH_SIZE))
+
+# Every member and admin belongs to one branch (gym location). Member queries
+# are always scoped to the logged-in admin's branch, and every members index is
+# led by branch_id so {branch_id: 1, _id: 1} can later become the shard key.
+DEFAULT_BRANCH_ID = 'main'
+
+def current_branch():
+    return session.get('branch_id', DEFAULT_BRANCH_ID)
 
 # Create templates directory if it doesn't exist
 os.makedirs('templates', exist_ok=True)
 
 def initialize_sample_data():
     # Create indexes for better performance
-    members_collection.create_index([("subscription.expiry_date", ASCENDING)])
-    members_collection.create_index([("subscription.plan_id", ASCENDING)])
-    members_collection.create_index([("name", ASCENDING)])
-    admin_collection.create_index([("username", ASCENDING)], unique=True)
+    storage.ensure_indexes()
     
-    if subscriptions_collection.count_documents({}) == 0:
-        subscriptions_collection.insert_many([
-            {"plan_id": 1, "plan_name": "Basic", "price": 50, "duration": "1 Month", "duration_days": 30},
-            {"plan_id": 2, "plan_name": "Standard", "price": 120, "duration": "3 Months", "duration_days": 90},
-            {"plan_id": 3, "plan_name": "Premium", "price": 400, "duration": "1 Year", "duration_days": 365}
+    if storage.count_plans() == 0:
+        storage.insert_plans([
+            {"plan_id": 1, "version": 1, "plan_name": "Basic", "price": 50, "duration": "1 Month",
+             "duration_days": 30, "display": {"badge": "badge-secondary", "icon": "tag"}},
+            {"plan_id": 2, "version": 1, "plan_name": "Standard", "price": 120, "duration": "3 Months",
+             "duration_days": 90, "display": {"badge": "badge-success", "icon": "star"}},
+            {"plan_id": 3, "version": 1, "plan_name": "Premium", "price": 400, "duration": "1 Year",
+             "duration_days": 365, "display": {"badge": "badge-primary", "icon": "crown"}}
         ])
 
-    if members_collection.count_documents({}) == 0:
-        members_collection.insert_many([
+    if storage.count_members() == 0:
+        seeds = [
             {
+                "_id": ObjectId(),
+                "branch_id": DEFAULT_BRANCH_ID,
                 "name": "John Doe",
                 "age": 28,
                 "gender": "male",
@@ -61,6 +135,8 @@ def initialize_sample_data():
                 "updated_at": datetime.now()
             },
             {
+                "_id": ObjectId(),
+                "branch_id": DEFAULT_BRANCH_ID,
                 "name": "Jane Smith",
                 "age": 30,
                 "gender": "female",
@@ -81,17 +157,47 @@ def initialize_sample_data():
                 "created_at": datetime.now(),
                 "updated_at": datetime.now()
             }
-        ])
+        ]
+        # Profile fields and payments go to their side collections (member_details.py)
+        splits = [split_member(member) for member in seeds]
+        storage.insert_members([member for member, _, _ in splits])
+        storage.move_cold_fields([(member["_id"], member["branch_id"], profile, payments)
+                                  for member, profile, payments in splits])
     
-    if admin_collection.count_documents({}) == 0:
-        admin_collection.insert_one({
+    if storage.count_admins() == 0:
+        storage.insert_admin({
             "username": "admin",
             "password": generate_password_hash("admin123"),
             "full_name": "Administrator",
+            "branch_id": DEFAULT_BRANCH_ID,
             "created_at": datetime.now(),
             "last_login": None
         })
 
+    # Data created before branches existed belongs to the default branch
+    storage.assign_default_branch(DEFAULT_BRANCH_ID)
+
+def record_audit(action, member_id, before, after):
+    write_audit(audit_entry(action, member_id, before, after,
+                            admin=session.get('admin_username'), branch_id=current_branch()))
+
+def record_period(member_id, subscription, reason, previous=None, proration=None):
+    storage.insert_subscription_periods([subscription_period(
+        member_id, current_branch(), subscription, reason, str(ObjectId()),
+        previous=previous, proration=proration, admin=session.get('admin_username'))])
+
+def record_payment(member_id, subscription, date, method, amount_due=None):
+    payment = {"date": date, "method": method, "plan_id": subscription.get("plan_id"),
+               "plan_name": subscription.get("plan_name"), "price": subscription.get("price")}
+    if amount_due is not None:
+        payment["amount_due"] = amount_due
+    storage.insert_payments([payment_record(member_id, current_branch(), payment, str(ObjectId()))])
+
+def write_audit(entry):
+    # Written through the write-behind queue so auditing adds no request latency
+    if not write_queue.enqueue('audit', entry):
+        storage.insert_audit_entries([entry])
+
 def create_templates():
     login_html = """<!DOCTYPE html>
 <html lang="en">
@@ -100,168 +206,7 @@ def create_templates():
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Admin Login Gym Management System</title>
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
-    <style>
-        :root {
-            --primary: #4361ee;
-            --secondary: #3f37c9;
-            --accent: #4895ef;
-            --danger: #f72585;
-            --success: #4cc9f0;
-            --light: #f8f9fa;
-            --dark: #212529;
-            --gray: #6c757d;
-            --light-gray: #e9ecef;
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        }
-        
-        body {
-            background: linear-gradient(rgba(0, 0, 0, 0.5), rgba(0, 0, 0, 0.7)), 
-                        url('https://vigyr.com/wp-content/uploads/2020/01/features-of-best-gym-management-systems-scaled.jpg');
-            background-size: cover;
-            background-position: center;
-            background-attachment: fixed;
-            min-height: 100vh;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            color: var(--dark);
-            line-height: 1.6;
-        }
-        
-        .login-container {
-            width: 100%;
-            max-width: 400px;
-            padding: 2rem;
-        }
-        
-        .login-card {
-            background: rgba(255, 255, 255, 0.81);
-            padding: 2rem;
-            border-radius: 10px;
-            box-shadow: 0 10px 30px rgba(0, 0, 0, 0.3);
-            text-align: center;
-            position: relative;
-            overflow: hidden;
-        }
-        
-        .login-card::before {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: 0;
-            width: 5px;
-            height: 100%;
-            background: linear-gradient(to bottom, var(--primary), var(--accent));
-        }
-        
-        .login-card h1 {
-            color: var(--primary);
-            margin-bottom: 1.5rem;
-            font-size: 1.8rem;
-            display: flex;
-            justify-content: center;
-            align-items: center;
-            gap: 10px;
-        }
-        
-        .form-group {
-            margin-bottom: 1.5rem;
-            text-align: left;
-        }
-        
-        label {
-            display: block;
-            margin-bottom: 0.5rem;
-            font-weight: 500;
-            color: var(--dark);
-        }
-        
-        input {
-            width: 100%;
-            padding: 0.8rem;
-            border: 1px solid var(--light-gray);
-            border-radius: 6px;
-            font-size: 1rem;
-            transition: border-color 0.3s ease, box-shadow 0.3s ease;
-        }
-        
-        input:focus {
-            outline: none;
-            border-color: var(--accent);
-            box-shadow: 0 0 0 3px rgba(72, 149, 239, 0.2);
-        }
-        
-        .btn {
-            display: inline-flex;
-            align-items: center;
-            justify-content: center;
-            gap: 8px;
-            background: linear-gradient(to right, var(--primary), var(--secondary));
-            color: white;
-            padding: 0.8rem 1.5rem;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            text-decoration: none;
-            font-size: 1rem;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            box-shadow: 0 4px 6px rgba(67, 97, 238, 0.3);
-            width: 100%;
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 7px 15px rgba(67, 97, 238, 0.4);
-        }
-        
-        .alert {
-            padding: 1rem;
-            margin-bottom: 1.5rem;
-            border-radius: 6px;
-            font-weight: 500;
-            display: flex;
-            align-items: center;
-            justify-content: center;
-            gap: 10px;
-            animation: slideIn 0.5s ease-out;
-        }
-        
-        .alert-danger {
-            background-color: rgba(247, 37, 133, 0.1);
-            border-left: 4px solid var(--danger);
-            color: var(--danger);
-        }
-        
-        @keyframes slideIn {
-            from {
-                transform: translateY(-20px);
-                opacity: 0;
-            }
-            to {
-                transform: translateY(0);
-                opacity: 1;
-            }
-        }
-        
-        .input-icon {
-            position: relative;
-        }
-        
-        .input-icon i {
-            position: absolute;
-            right: 15px;
-            top: 50%;
-            transform: translateY(-50%);
-            color: var(--gray);
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/login.css') }}">
 </head>
 <body>
     <div class="login-container">
@@ -314,365 +259,7 @@ def create_templates():
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Gym Membership Management</title>
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
-    <style>
-        :root {
-            --primary: #4361ee;
-            --secondary: #3f37c9;
-            --accent: #4895ef;
-            --danger: #f72585;
-            --success: #4cc9f0;
-            --light: #f8f9fa;
-            --dark: #212529;
-            --gray: #6c757d;
-            --light-gray: #e9ecef;
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        }
-        
-        body {
-            background: linear-gradient(rgba(0, 0, 0, 0.7), rgba(0, 0, 0, 0.7)), 
-                        url('https://vigyr.com/wp-content/uploads/2020/01/features-of-best-gym-management-systems-scaled.jpg');
-            background-size: cover;
-            background-position: center;
-            background-attachment: fixed;
-            min-height: 100vh;
-            color: var(--light);
-            line-height: 1.6;
-        }
-        
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 20px;
-        }
-        
-        header {
-            background: linear-gradient(to right, rgba(67, 97, 238, 0.9), rgba(63, 55, 201, 0.9));
-            color: white;
-            padding: 1.5rem 0;
-            margin-bottom: 2rem;
-            border-radius: 0 0 10px 10px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-            text-align: center;
-            position: relative;
-            overflow: hidden;
-        }
-        
-        header::after {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: 0;
-            right: 0;
-            bottom: 0;
-            background: linear-gradient(45deg, transparent 65%, rgba(255,255,255,0.2) 100%);
-            pointer-events: none;
-        }
-        
-        header h1 {
-            font-size: 2.5rem;
-            margin-bottom: 0.5rem;
-            position: relative;
-            z-index: 1;
-            text-shadow: 1px 1px 3px rgba(0,0,0,0.5);
-        }
-        
-        .logout-btn {
-            position: absolute;
-            right: 20px;
-            top: 20px;
-            background: rgba(255,255,255,0.2);
-            border: none;
-            color: white;
-            padding: 8px 15px;
-            border-radius: 4px;
-            cursor: pointer;
-            transition: background 0.3s;
-        }
-        
-        .logout-btn:hover {
-            background: rgba(255,255,255,0.3);
-        }
-        
-        .card {
-            background: rgba(255, 255, 255, 0.77);;
-            padding: 1.5rem;
-            margin-bottom: 2rem;
-            border-radius: 8px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-            position: relative;
-            overflow: hidden;
-        }
-        
-        .card:hover {
-            transform: translateY(-5px);
-            box-shadow: 0 10px 20px rgba(0, 0, 0, 0.4);
-        }
-        
-        .card::before {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: 0;
-            width: 5px;
-            height: 100%;
-            background: linear-gradient(to bottom, var(--primary), var(--accent));
-        }
-        
-        .card h2 {
-            color: var(--primary);
-            margin-bottom: 1.5rem;
-            font-size: 1.5rem;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        
-        .card h2 i {
-            color: var(--accent);
-        }
-        
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 1.5rem 0;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.2);
-        }
-        
-        table th {
-            background: linear-gradient(to right, var(--primary), var(--secondary));
-            color: white;
-            padding: 12px 15px;
-            text-align: left;
-            font-weight: 500;
-        }
-        
-        table td {
-            padding: 12px 15px;
-            border-bottom: 1px solid var(--light-gray);
-            vertical-align: middle;
-            color: var(--dark);
-        }
-        
-        table tr:nth-child(even) {
-            background-color: rgba(67, 97, 238, 0.1);
-        }
-        
-        table tr:hover {
-            background-color: rgba(67, 97, 238, 0.2);
-        }
-        
-        .btn {
-            display: inline-flex;
-            align-items: center;
-            justify-content: center;
-            gap: 8px;
-            background: linear-gradient(to right, var(--primary), var(--secondary));
-            color: white;
-            padding: 0.6rem 1.2rem;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            text-decoration: none;
-            font-size: 0.9rem;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            box-shadow: 0 2px 5px rgba(67, 97, 238, 0.4);
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 15px rgba(67, 97, 238, 0.6);
-            color: white;
-        }
-        
-        .btn-danger {
-            background: linear-gradient(to right, var(--danger), #d81159);
-        }
-        
-        .btn-danger:hover {
-            box-shadow: 0 5px 15px rgba(247, 37, 133, 0.6);
-        }
-        
-        .btn-secondary {
-            background: linear-gradient(to right, var(--gray), #5a6268);
-        }
-        
-        .btn-secondary:hover {
-            box-shadow: 0 5px 15px rgba(108, 117, 125, 0.6);
-        }
-        
-        .btn-info {
-            background: linear-gradient(to right, #17a2b8, #138496);
-        }
-        
-        .btn-info:hover {
-            box-shadow: 0 5px 15px rgba(23, 162, 184, 0.6);
-        }
-        
-        .form-group {
-            margin-bottom: 1.2rem;
-        }
-        
-        label {
-            display: block;
-            margin-bottom: 0.5rem;
-            font-weight: 500;
-            color: var(--dark);
-        }
-        
-        input, select {
-            width: 100%;
-            padding: 0.8rem;
-            border: 1px solid var(--light-gray);
-            border-radius: 6px;
-            font-size: 1rem;
-            transition: border-color 0.3s ease, box-shadow 0.3s ease;
-        }
-        
-        input:focus, select:focus {
-            outline: none;
-            border-color: var(--accent);
-            box-shadow: 0 0 0 3px rgba(72, 149, 239, 0.3);
-        }
-        
-        .status-active {
-            color: #2ecc71;
-            font-weight: 600;
-        }
-        
-        .status-expired {
-            color: var(--danger);
-            font-weight: 600;
-        }
-        
-        .alert {
-            padding: 1rem;
-            margin-bottom: 1.5rem;
-            border-radius: 6px;
-            font-weight: 500;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            animation: slideIn 0.5s ease-out;
-        }
-        
-        .alert-success {
-            background-color: rgba(76, 201, 240, 0.3);
-            border-left: 4px solid var(--success);
-            color: white;
-        }
-        
-        .badge {
-            display: inline-block;
-            padding: 0.35em 0.65em;
-            font-size: 0.75em;
-            font-weight: 700;
-            line-height: 1;
-            color: #fff;
-            text-align: center;
-            white-space: nowrap;
-            vertical-align: baseline;
-            border-radius: 50rem;
-        }
-        
-        .badge-primary {
-            background-color: var(--primary);
-        }
-        
-        .badge-danger {
-            background-color: var(--danger);
-        }
-        
-        .badge-success {
-            background-color: var(--success);
-        }
-        
-        .action-buttons {
-            display: flex;
-            gap: 8px;
-            flex-wrap: wrap;
-        }
-        
-        .plan-buttons {
-            display: flex;
-            gap: 10px;
-            flex-wrap: wrap;
-            margin-top: 1rem;
-        }
-        
-        .member-id {
-            font-family: monospace;
-            background-color: var(--light-gray);
-            padding: 2px 6px;
-            border-radius: 4px;
-            font-size: 0.9rem;
-        }
-        
-        @keyframes slideIn {
-            from {
-                transform: translateY(-20px);
-                opacity: 0;
-            }
-            to {
-                transform: translateY(0);
-                opacity: 1;
-            }
-        }
-        
-        @media (max-width: 768px) {
-            table {
-                display: block;
-                overflow-x: auto;
-                white-space: nowrap;
-            }
-            
-            .container {
-                padding: 15px;
-            }
-            
-            header h1 {
-                font-size: 2rem;
-            }
-            
-            .card {
-                padding: 1rem;
-            }
-            
-            .logout-btn {
-                position: static;
-                margin-top: 10px;
-            }
-        }
-        
-        /* Floating animation for header */
-        @keyframes floating {
-            0% { transform: translateY(0px); }
-            50% { transform: translateY(-10px); }
-            100% { transform: translateY(0px); }
-        }
-        
-        .floating {
-            animation: floating 3s ease-in-out infinite;
-        }
-        
-        /* Pulse animation for buttons */
-        @keyframes pulse {
-            0% { transform: scale(1); }
-            50% { transform: scale(1.05); }
-            100% { transform: scale(1); }
-        }
-        
-        .pulse:hover {
-            animation: pulse 1.5s infinite;
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/index.css') }}">
 </head>
 <body>
     <header>
@@ -733,8 +320,8 @@ def create_templates():
                     <input type="date" id="start_date" name="start_date" required>
                 </div>
                 <div class="form-group">
-                    <label for="expiry_date"><i class="fas fa-calendar-times"></i> Expiry Date:</label>
-                    <input type="date" id="expiry_date" name="expiry_date" required>
+                    <label for="expiry_date"><i class="fas fa-calendar-times"></i> Expiry Date (optional):</label>
+                    <input type="date" id="expiry_date" name="expiry_date" title="Leave empty to use the plan's duration">
                 </div>
                 <button type="submit" class="btn pulse">
                     <i class="fas fa-save"></i> Add Member
@@ -745,76 +332,26 @@ def create_templates():
         <!-- Members List -->
         <div class="card">
             <h2><i class="fas fa-users"></i> All Members</h2>
-            <table>
-                <thead>
-                    <tr>
-                        <th>ID</th>
-                        <th>Name</th>
-                        <th>Age</th>
-                        <th>Contact</th>
-                        <th>Plan</th>
-                        <th>Start Date</th>
-                        <th>Expiry Date</th>
-                        <th>Status</th>
-                        <th>Actions</th>
-                    </tr>
-                </thead>
-                <tbody>
-                    {% for member in members %}
+            <p class="table-status" id="member-status">Loading members...</p>
+            <!-- Rows come from /api/v1/member-table in chunks; only the visible ones are rendered -->
+            <div class="table-viewport" id="member-viewport">
+                <table>
+                    <thead>
                         <tr>
-                            <td><span class="member-id">{{ member._id }}</span></td>
-                            <td>{{ member.name }}</td>
-                            <td>{{ member.age }}</td>
-                            <td>{{ member.contact }}</td>
-                            <td>
-                                {% for plan in plans %}
-                                    {% if plan.plan_id == member.subscription.plan_id %}
-                                        <span class="badge 
-                                            {% if plan.plan_name == 'Premium' %}badge-primary
-                                            {% elif plan.plan_name == 'Standard' %}badge-success
-                                            {% else %}badge-secondary{% endif %}">
-                                            {{ plan.plan_name }}
-                                        </span>
-                                    {% endif %}
-                                {% endfor %}
-                            </td>
-                            <td>{{ member.subscription.start_date.strftime('%Y-%m-%d') }}</td>
-                            <td>{{ member.subscription.expiry_date.strftime('%Y-%m-%d') }}</td>
-                            <td class="{% if member.subscription.expiry_date > current_date %}status-active{% else %}status-expired{% endif %}">
-                                {% if member.subscription.expiry_date > current_date %}
-                                    <i class="fas fa-check-circle"></i> Active
-                                {% else %}
-                                    <i class="fas fa-times-circle"></i> Expired
-                                {% endif %}
-                            </td>
-                            <td>
-                                <div class="action-buttons">
-                                    <a href="/view_member/{{ member._id }}" class="btn btn-info pulse">
-                                        <i class="fas fa-eye"></i> View
-                                    </a>
-                                    <form action="/update_subscription/{{ member._id }}" method="POST" style="width: 100%; margin-top: 5px;">
-                                        <select name="new_plan" required style="margin-bottom: 5px;">
-                                            {% for plan in plans %}
-                                                <option value="{{ plan.plan_id }}" {% if plan.plan_id == member.subscription.plan_id %}selected{% endif %}>
-                                                    {{ plan.plan_name }}
-                                                </option>
-                                            {% endfor %}
-                                        </select>
-                                        <input type="date" name="start_date" value="{{ member.subscription.start_date.strftime('%Y-%m-%d') }}" required style="margin-bottom: 5px;">
-                                        <input type="date" name="expiry_date" value="{{ member.subscription.expiry_date.strftime('%Y-%m-%d') }}" required style="margin-bottom: 5px;">
-                                        <button type="submit" class="btn btn-secondary pulse" style="width: 100%;">
-                                            <i class="fas fa-sync-alt"></i> Update
-                                        </button>
-                                    </form>
-                                    <a href="/delete_member/{{ member._id }}" class="btn btn-danger pulse" style="width: 100%; margin-top: 5px;">
-                                        <i class="fas fa-trash-alt"></i> Delete
-                                    </a>
-                                </div>
-                            </td>
+                            <th style="width: 16%;">ID</th>
+                            <th style="width: 14%;">Name</th>
+                            <th style="width: 6%;">Age</th>
+                            <th style="width: 11%;">Contact</th>
+                            <th style="width: 9%;">Plan</th>
+                            <th style="width: 9%;">Start Date</th>
+                            <th style="width: 9%;">Expiry Date</th>
+                            <th style="width: 8%;">Status</th>
+                            <th style="width: 18%;">Actions</th>
                         </tr>
-                    {% endfor %}
-                </tbody>
-            </table>
+                    </thead>
+                    <tbody id="member-rows"></tbody>
+                </table>
+            </div>
         </div>
 
         <!-- Expired Members -->
@@ -836,17 +373,11 @@ def create_templates():
                             <tr>
                                 <td><span class="member-id">{{ member._id }}</span></td>
                                 <td>{{ member.name }}</td>
-                                <td>
-                                    {% for plan in plans %}
-                                        {% if plan.plan_id == member.subscription.plan_id %}
-                                            {{ plan.plan_name }}
-                                        {% endif %}
-                                    {% endfor %}
-                                </td>
-                                <td>{{ member.subscription.expiry_date.strftime('%Y-%m-%d') }}</td>
+                                <td>{{ member.subscription.plan_name }}</td>
+                                <td>{{ member.dates.expiry }}</td>
                                 <td>
                                     <span class="badge badge-danger">
-                                        {{ (current_date - member.subscription.expiry_date).days }} days
+                                        {{ member.dates.days_expired }} days
                                     </span>
                                 </td>
                             </tr>
@@ -869,13 +400,255 @@ def create_templates():
             <div class="plan-buttons">
                 {% for plan in plans %}
                     <a href="/members_by_plan/{{ plan.plan_id }}" class="btn pulse">
-                        <i class="fas fa-{% if plan.plan_name == 'Premium' %}crown{% elif plan.plan_name == 'Standard' %}star{% else %}tag{% endif %}"></i> 
+                        <i class="fas fa-{{ plan.display.icon }}"></i> 
                         {{ plan.plan_name }}
                     </a>
                 {% endfor %}
+                <a href="/plans" class="btn btn-secondary">
+                    <i class="fas fa-tags"></i> Manage Plans
+                </a>
             </div>
         </div>
+
+        <!-- Analytics -->
+        <div class="card">
+            <h2><i class="fas fa-chart-line"></i> Analytics</h2>
+            <a href="/analytics" class="btn pulse">
+                <i class="fas fa-chart-line"></i> Retention, Churn &amp; Renewals
+            </a>
+            <a href="/admin/profiles" class="btn btn-secondary">
+                <i class="fas fa-stopwatch"></i> Slowest Routes &amp; Profiles
+            </a>
+        </div>
     </div>
+
+    <!-- One update form shared by every row -->
+    <div class="modal" id="update-modal" hidden>
+        <div class="card">
+            <h2><i class="fas fa-sync-alt"></i> Update Subscription</h2>
+            <p class="modal-member" id="update-member"></p>
+            <form id="update-form" method="POST">
+                <div class="form-group">
+                    <label for="new_plan"><i class="fas fa-tag"></i> Membership Plan:</label>
+                    <select id="new_plan" name="new_plan" required>
+                        {% for plan in plans %}
+                            <option value="{{ plan.plan_id }}">{{ plan.plan_name }}</option>
+                        {% endfor %}
+                    </select>
+                </div>
+                <div class="form-group">
+                    <label for="update_start_date"><i class="fas fa-calendar-alt"></i> Start Date:</label>
+                    <input type="date" id="update_start_date" name="start_date" required>
+                </div>
+                <div class="form-group">
+                    <label for="update_method"><i class="fas fa-bank"></i> Method of Payment:</label>
+                    <input type="text" id="update_method" name="method of payment" placeholder="Same as last payment">
+                </div>
+                <div class="modal-buttons">
+                    <button type="submit" class="btn btn-secondary">
+                        <i class="fas fa-sync-alt"></i> Update
+                    </button>
+                    <button type="button" class="btn btn-danger" id="update-cancel">
+                        <i class="fas fa-times"></i> Cancel
+                    </button>
+                </div>
+            </form>
+        </div>
+    </div>
+
+    <script>
+        (function () {
+            var ROW_HEIGHT = 52;
+            var OVERSCAN = 10;
+            // plan_id -> badge class, from the plan catalog
+            var PLAN_BADGES = {{ plan_badges|tojson }};
+            var viewport = document.getElementById('member-viewport');
+            var tbody = document.getElementById('member-rows');
+            var status = document.getElementById('member-status');
+            var modal = document.getElementById('update-modal');
+            var form = document.getElementById('update-form');
+            var rows = [];
+            var col = {};
+            var shown = null;
+            var done = false;
+            var pending = false;
+
+            function cell(tr, text, className) {
+                var td = document.createElement('td');
+                if (className) {
+                    td.className = className;
+                }
+                if (text !== null) {
+                    td.textContent = text;
+                    td.title = text;
+                }
+                tr.appendChild(td);
+                return td;
+            }
+
+            function button(tag, className, icon, label) {
+                var el = document.createElement(tag);
+                el.className = 'btn btn-sm ' + className;
+                var i = document.createElement('i');
+                i.className = 'fas ' + icon;
+                el.appendChild(i);
+                el.appendChild(document.createTextNode(' ' + label));
+                return el;
+            }
+
+            function spacer(height) {
+                var tr = document.createElement('tr');
+                tr.className = 'spacer';
+                var td = document.createElement('td');
+                td.colSpan = 9;
+                td.style.height = height + 'px';
+                tr.appendChild(td);
+                return tr;
+            }
+
+            function memberRow(index) {
+                var row = rows[index];
+                var id = row[col._id];
+                var plan = row[col.plan_name] || '';
+                var badgeClass = PLAN_BADGES[row[col.plan_id]] || 'badge-secondary';
+                var tr = document.createElement('tr');
+                tr.className = 'member-row' + (index % 2 ? ' odd' : '');
+
+                var idCell = cell(tr, null);
+                var idSpan = document.createElement('span');
+                idSpan.className = 'member-id';
+                idSpan.textContent = id;
+                idCell.appendChild(idSpan);
+                cell(tr, row[col.name] || '');
+                cell(tr, row[col.age] === null ? '' : String(row[col.age]));
+                cell(tr, row[col.contact] || '');
+
+                var badge = document.createElement('span');
+                badge.className = 'badge ' + badgeClass;
+                badge.textContent = plan;
+                cell(tr, null).appendChild(badge);
+                cell(tr, row[col.start_date]);
+                cell(tr, row[col.expiry_date]);
+
+                var active = row[col.active];
+                var statusCell = cell(tr, null, active ? 'status-active' : 'status-expired');
+                var icon = document.createElement('i');
+                icon.className = 'fas ' + (active ? 'fa-check-circle' : 'fa-times-circle');
+                statusCell.appendChild(icon);
+                statusCell.appendChild(document.createTextNode(active ? ' Active' : ' Expired'));
+
+                var actions = cell(tr, null);
+                var view = button('a', 'btn-info', 'fa-eye', 'View');
+                view.href = '/view_member/' + id;
+                var update = button('button', 'btn-secondary', 'fa-sync-alt', 'Update');
+                update.type = 'button';
+                update.setAttribute('data-row', index);
+                var remove = button('a', 'btn-danger', 'fa-trash-alt', 'Delete');
+                remove.href = '/delete_member/' + id;
+                actions.appendChild(view);
+                actions.appendChild(document.createTextNode(' '));
+                actions.appendChild(update);
+                actions.appendChild(document.createTextNode(' '));
+                actions.appendChild(remove);
+                return tr;
+            }
+
+            function render() {
+                pending = false;
+                var first = Math.max(0, Math.floor(viewport.scrollTop / ROW_HEIGHT) - OVERSCAN);
+                var last = Math.min(rows.length,
+                    Math.ceil((viewport.scrollTop + viewport.clientHeight) / ROW_HEIGHT) + OVERSCAN);
+                var key = first + ':' + last + ':' + rows.length;
+                if (key === shown) {
+                    return;
+                }
+                shown = key;
+
+                var fragment = document.createDocumentFragment();
+                fragment.appendChild(spacer(first * ROW_HEIGHT));
+                for (var index = first; index < last; index++) {
+                    fragment.appendChild(memberRow(index));
+                }
+                fragment.appendChild(spacer((rows.length - last) * ROW_HEIGHT));
+                tbody.textContent = '';
+                tbody.appendChild(fragment);
+            }
+
+            function schedule() {
+                if (!pending) {
+                    pending = true;
+                    window.requestAnimationFrame(render);
+                }
+            }
+
+            function showStatus() {
+                status.textContent = rows.length + ' members' + (done ? '' : ' (loading...)');
+            }
+
+            function load(cursor) {
+                var url = '/api/v1/member-table' + (cursor ? '?cursor=' + encodeURIComponent(cursor) : '');
+                fetch(url, {credentials: 'same-origin'})
+                    .then(function (response) {
+                        if (!response.ok) {
+                            throw new Error('HTTP ' + response.status);
+                        }
+                        return response.json();
+                    })
+                    .then(function (chunk) {
+                        chunk.columns.forEach(function (name, position) {
+                            col[name] = position;
+                        });
+                        for (var i = 0; i < chunk.rows.length; i++) {
+                            rows.push(chunk.rows[i]);
+                        }
+                        done = !chunk.next_cursor;
+                        showStatus();
+                        schedule();
+                        if (!done) {
+                            load(chunk.next_cursor);
+                        }
+                    })
+                    .catch(function (error) {
+                        status.textContent = 'Error loading members: ' + error.message;
+                    });
+            }
+
+            function openModal(index) {
+                var row = rows[index];
+                form.action = '/update_subscription/' + row[col._id];
+                document.getElementById('update-member').textContent = row[col.name] + ' (' + row[col._id] + ')';
+                document.getElementById('new_plan').value = row[col.plan_id];
+                document.getElementById('update_start_date').value = row[col.start_date];
+                document.getElementById('update_method').value = '';
+                modal.hidden = false;
+            }
+
+            function closeModal() {
+                modal.hidden = true;
+            }
+
+            viewport.addEventListener('scroll', schedule);
+            window.addEventListener('resize', schedule);
+            tbody.addEventListener('click', function (event) {
+                var target = event.target.closest('button[data-row]');
+                if (target) {
+                    openModal(Number(target.getAttribute('data-row')));
+                }
+            });
+            document.getElementById('update-cancel').addEventListener('click', closeModal);
+            modal.addEventListener('click', function (event) {
+                if (event.target === modal) {
+                    closeModal();
+                }
+            });
+            document.addEventListener('keydown', function (event) {
+                if (event.key === 'Escape') {
+                    closeModal();
+                }
+            });
+            load(null);
+        })();
+    </script>
 </body>
 </html>"""
 
@@ -886,194 +659,7 @@ def create_templates():
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Members by Plan</title>
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
-    <style>
-        :root {
-            --primary: #4361ee;
-            --secondary: #3f37c9;
-            --accent: #4895ef;
-            --danger: #f72585;
-            --success: #4cc9f0;
-            --light: #f8f9fa;
-            --dark: #212529;
-            --gray: #6c757d;
-            --light-gray: #e9ecef;
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        }
-        
-        body {
-            background: linear-gradient(rgba(0, 0, 0, 0.7), rgba(0, 0, 0, 0.7)), 
-                        url('https://vigyr.com/wp-content/uploads/2020/01/features-of-best-gym-management-systems-scaled.jpg');
-            background-size: cover;
-            background-position: center;
-            background-attachment: fixed;
-            min-height: 100vh;
-            color: var(--light);
-            line-height: 1.6;
-        }
-        
-        .container {
-            max-width: 1400px;
-            margin: 0 auto;
-            padding: 20px;
-        }
-        
-        header {
-            background: linear-gradient(to right, rgba(67, 97, 238, 0.9), rgba(63, 55, 201, 0.9));
-            color: white;
-            padding: 1.5rem 0;
-            margin-bottom: 2rem;
-            border-radius: 0 0 10px 10px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-            text-align: center;
-            position: relative;
-            overflow: hidden;
-        }
-        
-        header h1 {
-            font-size: 2.5rem;
-            margin-bottom: 0.5rem;
-            position: relative;
-            z-index: 1;
-            text-shadow: 1px 1px 3px rgba(0,0,0,0.5);
-        }
-        
-        .logout-btn {
-            position: absolute;
-            right: 20px;
-            top: 20px;
-            background: rgba(255,255,255,0.2);
-            border: none;
-            color: white;
-            padding: 8px 15px;
-            border-radius: 4px;
-            cursor: pointer;
-            transition: background 0.3s;
-        }
-        
-        .logout-btn:hover {
-            background: rgba(255,255,255,0.3);
-        }
-        
-        .card {
-            background: rgba(255, 255, 255, 0.95);
-            padding: 1.5rem;
-            margin-bottom: 2rem;
-            border-radius: 8px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-            transition: transform 0.3s ease, box-shadow 0.3s ease;
-        }
-        
-        .card h2 {
-            color: var(--primary);
-            margin-bottom: 1.5rem;
-            font-size: 1.5rem;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-        }
-        
-        table {
-            width: 100%;
-            border-collapse: collapse;
-            margin: 1.5rem 0;
-            box-shadow: 0 1px 3px rgba(0,0,0,0.2);
-        }
-        
-        table th {
-            background: linear-gradient(to right, var(--primary), var(--secondary));
-            color: white;
-            padding: 12px 15px;
-            text-align: left;
-            font-weight: 500;
-        }
-        
-        table td {
-            padding: 12px 15px;
-            border-bottom: 1px solid var(--light-gray);
-            color: var(--dark);
-        }
-        
-        table tr:nth-child(even) {
-            background-color: rgba(67, 97, 238, 0.1);
-        }
-        
-        table tr:hover {
-            background-color: rgba(67, 97, 238, 0.2);
-        }
-        
-        .btn {
-            display: inline-flex;
-            align-items: center;
-            justify-content: center;
-            gap: 8px;
-            background: linear-gradient(to right, var(--primary), var(--secondary));
-            color: white;
-            padding: 0.6rem 1.2rem;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            text-decoration: none;
-            font-size: 0.9rem;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            box-shadow: 0 2px 5px rgba(67, 97, 238, 0.4);
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 5px 15px rgba(67, 97, 238, 0.6);
-            color: white;
-        }
-        
-        .status-active {
-            color: #2ecc71;
-            font-weight: 600;
-        }
-        
-        .status-expired {
-            color: var(--danger);
-            font-weight: 600;
-        }
-        
-        .member-id {
-            font-family: monospace;
-            background-color: var(--light-gray);
-            padding: 2px 6px;
-            border-radius: 4px;
-            font-size: 0.9rem;
-        }
-        
-        @media (max-width: 768px) {
-            table {
-                display: block;
-                overflow-x: auto;
-                white-space: nowrap;
-            }
-            
-            .container {
-                padding: 15px;
-            }
-            
-            header h1 {
-                font-size: 2rem;
-            }
-            
-            .card {
-                padding: 1rem;
-            }
-            
-            .logout-btn {
-                position: static;
-                margin-top: 10px;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/members_by_plan.css') }}">
 </head>
 <body>
     <header>
@@ -1111,10 +697,10 @@ def create_templates():
                             <td>{{ member.name }}</td>
                             <td>{{ member.age }}</td>
                             <td>{{ member.contact }}</td>
-                            <td>{{ member.subscription.start_date.strftime('%Y-%m-%d') }}</td>
-                            <td>{{ member.subscription.expiry_date.strftime('%Y-%m-%d') }}</td>
-                            <td class="{% if member.subscription.expiry_date > current_date %}status-active{% else %}status-expired{% endif %}">
-                                {% if member.subscription.expiry_date > current_date %}
+                            <td>{{ member.dates.start }}</td>
+                            <td>{{ member.dates.expiry }}</td>
+                            <td class="{% if member.dates.active %}status-active{% else %}status-expired{% endif %}">
+                                {% if member.dates.active %}
                                     <i class="fas fa-check-circle"></i> Active
                                 {% else %}
                                     <i class="fas fa-times-circle"></i> Expired
@@ -1129,6 +715,18 @@ def create_templates():
                     {% endfor %}
                 </tbody>
             </table>
+            <form action="/migrate_plan/{{ plan.plan_id }}" method="POST" class="migrate-form"
+                  onsubmit="return confirm('Move every member of this plan to the selected plan? Unused days are converted at the price of the new plan.');">
+                <label for="new_plan">Move all members to</label>
+                <select id="new_plan" name="new_plan" required>
+                    {% for other in plans if other.plan_id != plan.plan_id %}
+                        <option value="{{ other.plan_id }}">{{ other.plan_name }}</option>
+                    {% endfor %}
+                </select>
+                <button type="submit" class="btn">
+                    <i class="fas fa-random"></i> Move Members
+                </button>
+            </form>
             <a href="/" class="btn" style="margin-top: 20px;">
                 <i class="fas fa-arrow-left"></i> Back to Dashboard
             </a>
@@ -1144,237 +742,7 @@ def create_templates():
     <meta name="viewport" content="width=device-width, initial-scale=1.0">
     <title>Member Details</title>
     <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
-    <style>
-        :root {
-            --primary: #4361ee;
-            --secondary: #3f37c9;
-            --accent: #4895ef;
-            --danger: #f72585;
-            --success: #4cc9f0;
-            --light: #f8f9fa;
-            --dark: #212529;
-            --gray: #6c757d;
-            --light-gray: #e9ecef;
-        }
-        
-        * {
-            margin: 0;
-            padding: 0;
-            box-sizing: border-box;
-            font-family: 'Segoe UI', Tahoma, Geneva, Verdana, sans-serif;
-        }
-        
-        body {
-            background: linear-gradient(rgba(0, 0, 0, 0.7), rgba(0, 0, 0, 0.7)), 
-                        url('https://vigyr.com/wp-content/uploads/2020/01/features-of-best-gym-management-systems-scaled.jpg');
-            background-size: cover;
-            background-position: center;
-            background-attachment: fixed;
-            min-height: 100vh;
-            color: var(--light);
-            line-height: 1.6;
-        }
-        
-        .container {
-            max-width: 800px;
-            margin: 0 auto;
-            padding: 20px;
-        }
-        
-        header {
-            background: linear-gradient(to right, rgba(67, 97, 238, 0.9), rgba(63, 55, 201, 0.9));
-            color: white;
-            padding: 1.5rem 0;
-            margin-bottom: 2rem;
-            border-radius: 0 0 10px 10px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-            text-align: center;
-            position: relative;
-            overflow: hidden;
-        }
-        
-        header h1 {
-            font-size: 2rem;
-            margin-bottom: 0.5rem;
-            position: relative;
-            z-index: 1;
-            text-shadow: 1px 1px 3px rgba(0,0,0,0.5);
-        }
-        
-        .logout-btn {
-            position: absolute;
-            right: 20px;
-            top: 20px;
-            background: rgba(255,255,255,0.2);
-            border: none;
-            color: white;
-            padding: 8px 15px;
-            border-radius: 4px;
-            cursor: pointer;
-            transition: background 0.3s;
-        }
-        
-        .logout-btn:hover {
-            background: rgba(255,255,255,0.3);
-        }
-        
-        .card {
-            background: rgba(255, 255, 255, 0.95);
-            padding: 2rem;
-            margin-bottom: 2rem;
-            border-radius: 8px;
-            box-shadow: 0 4px 6px rgba(0, 0, 0, 0.3);
-            position: relative;
-            overflow: hidden;
-        }
-        
-        .card::before {
-            content: '';
-            position: absolute;
-            top: 0;
-            left: 0;
-            width: 5px;
-            height: 100%;
-            background: linear-gradient(to bottom, var(--primary), var(--accent));
-        }
-        
-        .card h2 {
-            color: var(--primary);
-            margin-bottom: 1.5rem;
-            font-size: 1.8rem;
-            display: flex;
-            align-items: center;
-            gap: 10px;
-            border-bottom: 2px solid var(--light-gray);
-            padding-bottom: 10px;
-        }
-        
-        .member-info {
-            display: grid;
-            grid-template-columns: 1fr 1fr;
-            gap: 1.5rem;
-            margin-bottom: 2rem;
-        }
-        
-        .info-group {
-            margin-bottom: 1rem;
-        }
-        
-        .info-label {
-            font-weight: 600;
-            color: var(--dark);
-            margin-bottom: 0.3rem;
-            display: flex;
-            align-items: center;
-            gap: 8px;
-        }
-        
-        .info-value {
-            padding: 0.8rem;
-            background-color: var(--light-gray);
-            border-radius: 6px;
-            color: var(--dark);
-        }
-        
-        .status-active {
-            color: #2ecc71;
-            font-weight: 600;
-        }
-        
-        .status-expired {
-            color: var(--danger);
-            font-weight: 600;
-        }
-        
-        .btn {
-            display: inline-flex;
-            align-items: center;
-            justify-content: center;
-            gap: 8px;
-            background: linear-gradient(to right, var(--primary), var(--secondary));
-            color: white;
-            padding: 0.8rem 1.5rem;
-            border: none;
-            border-radius: 6px;
-            cursor: pointer;
-            text-decoration: none;
-            font-size: 1rem;
-            font-weight: 500;
-            transition: all 0.3s ease;
-            box-shadow: 0 4px 6px rgba(67, 97, 238, 0.3);
-        }
-        
-        .btn:hover {
-            transform: translateY(-2px);
-            box-shadow: 0 7px 15px rgba(67, 97, 238, 0.4);
-            color: white;
-        }
-        
-        .btn-print {
-            background: linear-gradient(to right, #6c757d, #5a6268);
-            margin-right: 10px;
-        }
-        
-        .btn-back {
-            background: linear-gradient(to right, #17a2b8, #138496);
-        }
-        
-        .print-only {
-            display: none;
-        }
-        
-        @media print {
-            body {
-                background: none;
-                color: var(--dark);
-            }
-            
-            header, .btn-container {
-                display: none;
-            }
-            
-            .card {
-                box-shadow: none;
-                background: none;
-                padding: 0;
-            }
-            
-            .print-only {
-                display: block;
-                text-align: center;
-                margin-bottom: 2rem;
-            }
-            
-            .print-only h2 {
-                color: var(--primary);
-                border-bottom: 2px solid var(--primary);
-                padding-bottom: 10px;
-            }
-            
-            .card::before {
-                display: none;
-            }
-        }
-        
-        @media (max-width: 768px) {
-            .member-info {
-                grid-template-columns: 1fr;
-            }
-            
-            .container {
-                padding: 15px;
-            }
-            
-            header h1 {
-                font-size: 1.8rem;
-            }
-            
-            .logout-btn {
-                position: static;
-                margin-top: 10px;
-            }
-        }
-    </style>
+    <link rel="stylesheet" href="{{ asset_url('css/view_member.css') }}">
 </head>
 <body>
     <header>
@@ -1399,8 +767,8 @@ def create_templates():
             
             <h2>
                 <i class="fas fa-user-circle"></i> {{ member.name }}
-                <span class="{% if member.subscription.expiry_date > current_date %}status-active{% else %}status-expired{% endif %}" style="font-size: 1rem; margin-left: 15px;">
-                    {% if member.subscription.expiry_date > current_date %}
+                <span class="{% if member.dates.active %}status-active{% else %}status-expired{% endif %}" style="font-size: 1rem; margin-left: 15px;">
+                    {% if member.dates.active %}
                         <i class="fas fa-check-circle"></i> Active
                     {% else %}
                         <i class="fas fa-times-circle"></i> Expired
@@ -1486,11 +854,7 @@ def create_templates():
                             <i class="fas fa-tag"></i> Plan:
                         </div>
                         <div class="info-value">
-                            {% for plan in plans %}
-                                {% if plan.plan_id == member.subscription.plan_id %}
-                                    {{ plan.plan_name }} ({{ plan.duration }} - Rs.{{ plan.price }})
-                                {% endif %}
-                            {% endfor %}
+                            {{ member.subscription.plan_name }} ({{ member.subscription.duration }} - Rs.{{ member.subscription.price }})
                         </div>
                     </div>
                     
@@ -1499,7 +863,7 @@ def create_templates():
                             <i class="fas fa-calendar-check"></i> Start Date:
                         </div>
                         <div class="info-value">
-                            {{ member.subscription.start_date.strftime('%Y-%m-%d') }}
+                            {{ member.dates.start }}
                         </div>
                     </div>
                 </div>
@@ -1510,8 +874,8 @@ def create_templates():
                             <i class="fas fa-calendar-times"></i> Expiry Date:
                         </div>
                         <div class="info-value">
-                            {{ member.subscription.expiry_date.strftime('%Y-%m-%d') }}
-                            ({{ (member.subscription.expiry_date - current_date).days }} days remaining)
+                            {{ member.dates.expiry }}
+                            ({{ member.dates.days_remaining }} days remaining)
                         </div>
                     </div>
                     
@@ -1520,17 +884,40 @@ def create_templates():
                             <i class="fas fa-clock"></i> Member Since:
                         </div>
                         <div class="info-value">
-                            {{ member.created_at.strftime('%Y-%m-%d') }}
-                            ({{ (current_date - member.created_at).days }} days)
+                            {{ member.dates.created }}
+                            ({{ member.dates.tenure_days }} days)
                         </div>
                     </div>
                 </div>
             </div>
             
+            {% if member.payments %}
+            <h2><i class="fas fa-receipt"></i> Payments</h2>
+            
+            <div class="member-info">
+                {% for payment in member.payments %}
+                    <div class="info-group">
+                        <div class="info-label">
+                            <i class="fas fa-calendar-day"></i> {{ payment.date.strftime('%Y-%m-%d') if payment.date else 'N/A' }}:
+                        </div>
+                        <div class="info-value">
+                            {{ payment.method or 'N/A' }}{% if payment.amount_due is defined %} - Rs.{{ '%.2f'|format(payment.amount_due) }}{% elif payment.price is not none %} - Rs.{{ payment.price }}{% endif %}{% if payment.plan_name %} ({{ payment.plan_name }}){% endif %}
+                        </div>
+                    </div>
+                {% endfor %}
+            </div>
+            {% endif %}
+            
             <div class="btn-container" style="margin-top: 2rem; text-align: center;">
                 <button onclick="window.print()" class="btn btn-print">
                     <i class="fas fa-print"></i> Print Membership
                 </button>
+                <a href="/member_history/{{ member._id }}" class="btn btn-print">
+                    <i class="fas fa-history"></i> History
+                </a>
+                <a href="/member_card/{{ member._id }}" class="btn btn-print">
+                    <i class="fas fa-id-card"></i> Membership Card
+                </a>
                 <a href="/" class="btn btn-back">
                     <i class="fas fa-arrow-left"></i> Back to Dashboard
                 </a>
@@ -1540,44 +927,798 @@ def create_templates():
 </body>
 </html>"""
 
-    with open('templates/login.html', 'w') as f:
-        f.write(login_html)
+    member_history_html = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Member History</title>
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+    <link rel="stylesheet" href="{{ asset_url('css/member_history.css') }}">
+</head>
+<body>
+    <header>
+        <div class="container">
+            <h1>
+                <i class="fas fa-history"></i> Member History
+            </h1>
+            <form action="/logout" method="POST">
+                <button type="submit" class="logout-btn">
+                    <i class="fas fa-sign-out-alt"></i> Logout
+                </button>
+            </form>
+        </div>
+    </header>
 
-    with open('templates/index.html', 'w') as f:
-        f.write(index_html)
+    <div class="container">
+        <div class="card">
+            <p>Member ID: <span class="member-id">{{ member_id }}</span></p>
+            {% if entries %}
+                <table>
+                    <thead>
+                        <tr>
+                            <th>Date</th>
+                            <th>Action</th>
+                            <th>Admin</th>
+                            <th>Changes</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {% for entry in entries %}
+                            <tr>
+                                <td>{{ entry.ts.strftime('%Y-%m-%d %H:%M:%S') }}</td>
+                                <td>{{ entry.action }}</td>
+                                <td>{{ entry.admin or 'N/A' }}</td>
+                                <td>
+                                    <ul class="change-list">
+                                        {% for change in entry.changes %}
+                                            <li>
+                                                <span class="change-field">{{ change.field }}</span>:
+                                                {% if change.before is not none %}<span class="change-before">{{ change.before }}</span>{% endif %}
+                                                {% if change.before is not none and change.after is not none %}&rarr;{% endif %}
+                                                {% if change.after is not none %}<span class="change-after">{{ change.after }}</span>{% endif %}
+                                            </li>
+                                        {% endfor %}
+                                    </ul>
+                                </td>
+                            </tr>
+                        {% endfor %}
+                    </tbody>
+                </table>
+            {% else %}
+                <p style="padding: 15px; background-color: var(--light-gray); border-radius: 6px; margin-top: 15px;">
+                    <i class="fas fa-check"></i> No changes recorded for this member.
+                </p>
+            {% endif %}
+            <h2 style="margin-top: 25px;"><i class="fas fa-exchange-alt"></i> Plan Periods</h2>
+            {% if periods %}
+                <table>
+                    <thead>
+                        <tr>
+                            <th>Date</th>
+                            <th>Reason</th>
+                            <th>Plan</th>
+                            <th>Period</th>
+                            <th>Replaced</th>
+                            <th>Credit</th>
+                            <th>Amount Due</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {% for period in periods %}
+                            <tr>
+                                <td>{{ period.created_at.strftime('%Y-%m-%d %H:%M:%S') }}</td>
+                                <td>{{ period.reason }}</td>
+                                <td>{{ period.plan_name or period.plan_id }}</td>
+                                <td>{{ period.start_date.strftime('%Y-%m-%d') }} &ndash; {{ period.expiry_date.strftime('%Y-%m-%d') }}</td>
+                                <td>
+                                    {% if period.previous %}
+                                        {{ period.previous.plan_name or period.previous.plan_id }}
+                                        {% if period.proration %}({{ period.proration.remaining_days }} days left){% endif %}
+                                    {% else %}
+                                        N/A
+                                    {% endif %}
+                                </td>
+                                <td>
+                                    {% if period.proration and period.proration.credit_applied %}
+                                        {{ '%.2f' % period.proration.credit_applied }}
+                                        {% if period.proration.bonus_days %}(+{{ period.proration.bonus_days }} days){% endif %}
+                                    {% else %}
+                                        &ndash;
+                                    {% endif %}
+                                </td>
+                                <td>{{ '%.2f' % period.amount_due if period.amount_due is not none else 'N/A' }}</td>
+                            </tr>
+                        {% endfor %}
+                    </tbody>
+                </table>
+            {% else %}
+                <p style="padding: 15px; background-color: var(--light-gray); border-radius: 6px; margin-top: 15px;">
+                    <i class="fas fa-check"></i> No plan changes recorded for this member.
+                </p>
+            {% endif %}
+            <a href="/" class="btn" style="margin-top: 20px;">
+                <i class="fas fa-arrow-left"></i> Back to Dashboard
+            </a>
+        </div>
+    </div>
+</body>
+</html>"""
 
-    with open('templates/members_by_plan.html', 'w') as f:
-        f.write(members_by_plan_html)
+    analytics_html = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Analytics</title>
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+    <link rel="stylesheet" href="{{ asset_url('css/analytics.css') }}">
+</head>
+<body>
+    <header>
+        <div class="container">
+            <h1>
+                <i class="fas fa-chart-line"></i> Analytics
+            </h1>
+            <form action="/logout" method="POST">
+                <button type="submit" class="logout-btn">
+                    <i class="fas fa-sign-out-alt"></i> Logout
+                </button>
+            </form>
+        </div>
+    </header>
 
-    with open('templates/view_member.html', 'w') as f:
-        f.write(view_member_html)
+    <div class="container">
+        <div class="card">
+            <h2><i class="fas fa-users"></i> Overview</h2>
+            <div class="summary">
+                <div class="stat"><strong>{{ report.members }}</strong> members in snapshot</div>
+                <div class="stat"><strong>{{ report.renewal_rate if report.renewal_rate is not none else 'N/A' }}{% if report.renewal_rate is not none %}%{% endif %}</strong> renewal rate (last 3 months)</div>
+                <div class="stat"><strong>{{ report.taken_at.strftime('%H:%M:%S') }}</strong> snapshot taken ({{ report.load_ms }}ms)</div>
+                <div class="stat"><strong>{{ report.compute_ms }}ms</strong> to compute reports</div>
+            </div>
+        </div>
 
-def login_required(f):
-    @wraps(f)
-    def decorated_function(*args, **kwargs):
-        if 'admin_logged_in' not in session:
-            flash('Please log in to access this page', 'danger')
-            return redirect(url_for('login', next=request.url))
-        return f(*args, **kwargs)
-    return decorated_function
+        <div class="card">
+            <h2><i class="fas fa-chart-pie"></i> Plan Mix (active members)</h2>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Plan</th>
+                        <th>Members</th>
+                        <th>Share</th>
+                        <th>Monthly Revenue</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {% for row in report.plan_mix %}
+                        <tr>
+                            <td>{{ row.plan_name }}</td>
+                            <td>{{ row.members }}</td>
+                            <td>{{ row.share if row.share is not none else 0 }}%</td>
+                            <td>${{ row.monthly_revenue }}</td>
+                        </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+        </div>
 
-@app.route('/login', methods=['GET', 'POST'])
-def login():
-    if request.method == 'POST':
-        username = request.form.get('username')
-        password = request.form.get('password')
-        
-        admin = admin_collection.find_one({"username": username})
-        if admin and check_password_hash(admin['password'], password):
-            session['admin_logged_in'] = True
-            session['admin_username'] = username
-            session['admin_full_name'] = admin.get('full_name', 'Admin')
-            
+        <div class="card">
+            <h2><i class="fas fa-user-minus"></i> Monthly Churn</h2>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Month</th>
+                        <th>Active at Start</th>
+                        <th>Lapsed</th>
+                        <th>Churn Rate</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {% for row in report.churn %}
+                        <tr>
+                            <td>{{ row.month }}</td>
+                            <td>{{ row.active }}</td>
+                            <td>{{ row.churned }}</td>
+                            <td>{% if row.rate is not none %}{{ row.rate }}%{% else %}<span class="muted">N/A</span>{% endif %}</td>
+                        </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+        </div>
+
+        <div class="card">
+            <h2><i class="fas fa-layer-group"></i> Cohort Retention</h2>
+            <p class="muted">Share of each sign-up month still subscribed at the start of month 1, 2, ... after joining.</p>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Cohort</th>
+                        <th>Members</th>
+                        {% for k in range(1, report.cohorts[0].retention|length + 1) %}
+                            <th>M{{ k }}</th>
+                        {% endfor %}
+                    </tr>
+                </thead>
+                <tbody>
+                    {% for row in report.cohorts %}
+                        <tr>
+                            <td>{{ row.cohort }}</td>
+                            <td>{{ row.size }}</td>
+                            {% for value in row.retention %}
+                                <td>{% if value is not none %}{{ value }}%{% endif %}</td>
+                            {% endfor %}
+                        </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+        </div>
+
+        <div class="card">
+            <h2><i class="fas fa-calendar-alt"></i> Projected Renewals</h2>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Month</th>
+                        <th>Expiring</th>
+                        <th>Expected Renewals</th>
+                        <th>Expected Revenue</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {% for row in report.forecast %}
+                        <tr>
+                            <td>{{ row.month }}</td>
+                            <td>{{ row.expiring }}</td>
+                            <td>{% if row.renewals is not none %}{{ row.renewals }}{% else %}<span class="muted">N/A</span>{% endif %}</td>
+                            <td>{% if row.revenue is not none %}${{ row.revenue }}{% else %}<span class="muted">N/A</span>{% endif %}</td>
+                        </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+            <a href="/" class="btn" style="margin-top: 20px;">
+                <i class="fas fa-arrow-left"></i> Back to Dashboard
+            </a>
+        </div>
+    </div>
+</body>
+</html>"""
+
+    profiles_html = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Slowest Routes &amp; Profiles</title>
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+    <link rel="stylesheet" href="{{ asset_url('css/profiles.css') }}">
+</head>
+<body>
+    <header>
+        <div class="container">
+            <h1>
+                <i class="fas fa-stopwatch"></i> Slowest Routes &amp; Profiles
+            </h1>
+            <form action="/logout" method="POST">
+                <button type="submit" class="logout-btn">
+                    <i class="fas fa-sign-out-alt"></i> Logout
+                </button>
+            </form>
+        </div>
+    </header>
+
+    <div class="container">
+        <div class="card">
+            <h2><i class="fas fa-hourglass-half"></i> Slowest Routes</h2>
+            <p class="muted">
+                Every request since this process started, ordered by the 95th percentile of the last 200 requests of each route.
+            </p>
+            {% if routes %}
+                <table>
+                    <thead>
+                        <tr>
+                            <th>Route</th>
+                            <th class="number">Requests</th>
+                            <th class="number">Average ms</th>
+                            <th class="number">p50 ms</th>
+                            <th class="number">p95 ms</th>
+                            <th class="number">Max ms</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {% for route in routes %}
+                            <tr>
+                                <td><span class="member-id">{{ route.route }}</span></td>
+                                <td class="number">{{ route.count }}</td>
+                                <td class="number">{{ route.avg_ms }}</td>
+                                <td class="number">{{ route.p50_ms }}</td>
+                                <td class="number">{{ route.p95_ms }}</td>
+                                <td class="number">{{ route.max_ms }}</td>
+                            </tr>
+                        {% endfor %}
+                    </tbody>
+                </table>
+            {% else %}
+                <p class="muted">No requests timed yet.</p>
+            {% endif %}
+        </div>
+
+        <div class="card">
+            <h2><i class="fas fa-fire"></i> Profiles</h2>
+            <p class="muted">
+                {% if profile_mode %}
+                    GYM_PROFILE is set: every request is profiled with {{ profile_mode }}.
+                {% else %}
+                    Profile a request by sending the <code>{{ profile_header }}: sample</code> or <code>{{ profile_header }}: cprofile</code> header,
+                    or by adding <code>?{{ profile_arg }}=sample</code> to a page address, for example
+                    <a href="/?{{ profile_arg }}=sample">the dashboard</a>.
+                {% endif %}
+                .folded files open in speedscope or flamegraph.pl; .prof files in snakeviz or flameprof.
+            </p>
+            <p class="legend">
+                <span><i class="breakdown mongo"></i>MongoDB round trips</span>
+                <span><i class="breakdown cursor"></i>Cursor iteration</span>
+                <span><i class="breakdown template"></i>Templates</span>
+                <span><i class="breakdown other"></i>Other</span>
+            </p>
+            {% if profiles %}
+                <table>
+                    <thead>
+                        <tr>
+                            <th>Started</th>
+                            <th>Route</th>
+                            <th>Mode</th>
+                            <th class="number">Total ms</th>
+                            <th>Breakdown</th>
+                            <th>Slowest parts</th>
+                            <th>Files</th>
+                        </tr>
+                    </thead>
+                    <tbody>
+                        {% for profile in profiles %}
+                            <tr>
+                                <td>{{ profile.started_at[:19].replace('T', ' ') }}</td>
+                                <td><span class="member-id">{{ profile.route }}</span> {{ profile.status }}</td>
+                                <td>{{ profile.mode }}</td>
+                                <td class="number">{{ profile.total_ms }}</td>
+                                <td>
+                                    <div class="breakdown" title="{% for category, ms in profile.categories.items() %}{{ category }} {{ ms }}ms {% endfor %}">
+                                        {% for category, ms in profile.categories.items() %}
+                                            <span class="{{ category }}" style="width: {{ (ms * 100 / profile.total_ms) if profile.total_ms else 0 }}%"></span>
+                                        {% endfor %}
+                                    </div>
+                                    <span class="muted">
+                                        {% for category, ms in profile.categories.items() %}{{ category }} {{ ms }}{% if not loop.last %}, {% endif %}{% endfor %}
+                                    </span>
+                                </td>
+                                <td class="muted">
+                                    {% for span in profile.spans[:3] %}
+                                        {{ span.category }}: {{ span.name }} {{ span.ms }}ms ({{ span.calls }}x)<br>
+                                    {% endfor %}
+                                    {% for line in (profile.template_lines or [])[:3] %}
+                                        {{ line.line }}: {{ line.samples }} samples<br>
+                                    {% endfor %}
+                                </td>
+                                <td>
+                                    {% if profile.file %}
+                                        <a href="/admin/profiles/{{ profile.file }}">{{ profile.file.rsplit('.', 1)[1] }}</a>
+                                    {% endif %}
+                                    <a href="/admin/profiles/{{ profile.name }}.json">json</a>
+                                </td>
+                            </tr>
+                        {% endfor %}
+                    </tbody>
+                </table>
+            {% else %}
+                <p class="muted">No saved profiles.</p>
+            {% endif %}
+        </div>
+
+        <a href="/" class="btn">
+            <i class="fas fa-arrow-left"></i> Back to Dashboard
+        </a>
+    </div>
+</body>
+</html>
+"""
+
+    member_card_html = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Membership Card</title>
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+    <link rel="stylesheet" href="{{ asset_url('css/member_card.css') }}">
+</head>
+<body>
+    <header>
+        <div class="container">
+            <h1>
+                <i class="fas fa-id-card"></i> Membership Card
+            </h1>
+            <form action="/logout" method="POST">
+                <button type="submit" class="logout-btn">
+                    <i class="fas fa-sign-out-alt"></i> Logout
+                </button>
+            </form>
+        </div>
+    </header>
+
+    <div class="container">
+        {% with messages = get_flashed_messages(with_categories=true) %}
+            {% if messages %}
+                {% for category, message in messages %}
+                    <div class="alert alert-{{ category }}">
+                        <i class="fas fa-{% if category == 'success' %}check-circle{% else %}exclamation-circle{% endif %}"></i>
+                        {{ message }}
+                    </div>
+                {% endfor %}
+            {% endif %}
+        {% endwith %}
+
+        <div class="membership-card">
+            <div class="card-top">
+                <strong><i class="fas fa-dumbbell"></i> {{ gym_name }}</strong>
+                <span>{{ member.subscription.plan_name or 'Member' }}</span>
+            </div>
+            <div class="card-body">
+                <div class="qr">
+                    {% if qr_svg %}
+                        {{ qr_svg | safe }}
+                    {% endif %}
+                </div>
+                <div>
+                    <div class="holder">{{ member.name }}</div>
+                    <div class="detail">Valid until {{ member.dates.expiry }}</div>
+                    <div class="detail">Issued {{ issued_at.strftime('%d %b %Y') }}</div>
+                    <div class="detail {% if member.dates.active %}status-active{% else %}status-expired{% endif %}">
+                        {% if member.dates.active %}Active{% else %}Expired{% endif %}
+                    </div>
+                </div>
+            </div>
+            <div class="token">{{ token }}</div>
+        </div>
+
+        <div class="actions">
+            <button onclick="window.print()" class="btn">
+                <i class="fas fa-print"></i> Print Card
+            </button>
+            <form action="/member_card/{{ member._id }}/revoke" method="POST"
+                  onsubmit="return confirm('Revoke every card printed so far for this member?');">
+                <button type="submit" class="btn btn-danger">
+                    <i class="fas fa-ban"></i> Report Lost Card
+                </button>
+            </form>
+            <a href="/view_member/{{ member._id }}" class="btn">
+                <i class="fas fa-arrow-left"></i> Back to Member
+            </a>
+        </div>
+    </div>
+</body>
+</html>
+"""
+
+    plans_html = """<!DOCTYPE html>
+<html lang="en">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>Membership Plans</title>
+    <link rel="stylesheet" href="https://cdnjs.cloudflare.com/ajax/libs/font-awesome/6.0.0/css/all.min.css">
+    <link rel="stylesheet" href="{{ asset_url('css/plans.css') }}">
+</head>
+<body>
+    <header>
+        <div class="container">
+            <h1>
+                <i class="fas fa-tags"></i> Membership Plans
+            </h1>
+            <form action="/logout" method="POST">
+                <button type="submit" class="logout-btn">
+                    <i class="fas fa-sign-out-alt"></i> Logout
+                </button>
+            </form>
+        </div>
+    </header>
+
+    <div class="container">
+        {% with messages = get_flashed_messages(with_categories=true) %}
+            {% if messages %}
+                {% for category, message in messages %}
+                    <div class="alert alert-{{ category }}">
+                        <i class="fas fa-{% if category == 'success' %}check-circle{% else %}exclamation-circle{% endif %}"></i>
+                        {{ message }}
+                    </div>
+                {% endfor %}
+            {% endif %}
+        {% endwith %}
+
+        <div class="card">
+            <h2><i class="fas fa-list"></i> Plans</h2>
+            <p style="color: var(--gray);">
+                Saving a plan adds a new version. Members keep the version they bought; new sales use the latest one.
+            </p>
+            <table>
+                <thead>
+                    <tr>
+                        <th>Plan</th>
+                        <th>Price</th>
+                        <th>Duration</th>
+                        <th>Version</th>
+                        <th>Status</th>
+                        <th>Change</th>
+                    </tr>
+                </thead>
+                <tbody>
+                    {% for plan in plans %}
+                        <tr>
+                            <td>
+                                <span class="badge {{ plan.display.badge }}">
+                                    <i class="fas fa-{{ plan.display.icon }}"></i> {{ plan.plan_name }}
+                                </span>
+                            </td>
+                            <td>{{ plan.price }}</td>
+                            <td>{{ plan.duration }} ({{ plan.duration_days }} days)</td>
+                            <td>{{ plan.version }}</td>
+                            <td class="{% if plan.retired %}status-expired{% else %}status-active{% endif %}">
+                                {% if plan.retired %}Retired{% else %}On sale{% endif %}
+                            </td>
+                            <td>
+                                <details>
+                                    <summary>Edit</summary>
+                                    <form action="/plans/{{ plan.plan_id }}" method="POST" class="plan-form">
+                                        <input type="hidden" name="version" value="{{ plan.version }}">
+                                        <div>
+                                            <label>Name</label>
+                                            <input type="text" name="plan_name" value="{{ plan.plan_name }}" required>
+                                        </div>
+                                        <div>
+                                            <label>Price</label>
+                                            <input type="number" name="price" value="{{ plan.price }}" min="0" step="0.01" required>
+                                        </div>
+                                        <div>
+                                            <label>Days</label>
+                                            <input type="number" name="duration_days" value="{{ plan.duration_days }}" min="1" required>
+                                        </div>
+                                        <div>
+                                            <label>Label</label>
+                                            <input type="text" name="duration" value="{{ plan.duration }}" placeholder="from days">
+                                        </div>
+                                        <div>
+                                            <label>Badge</label>
+                                            <select name="badge">
+                                                {% for badge in badge_classes %}
+                                                    <option value="{{ badge }}" {% if badge == plan.display.badge %}selected{% endif %}>{{ badge[6:] }}</option>
+                                                {% endfor %}
+                                            </select>
+                                        </div>
+                                        <div>
+                                            <label>Icon</label>
+                                            <input type="text" name="icon" value="{{ plan.display.icon }}" required>
+                                        </div>
+                                        <div>
+                                            <button type="submit" class="btn">
+                                                <i class="fas fa-save"></i> Save Version
+                                            </button>
+                                        </div>
+                                    </form>
+                                    <form action="/plans/{{ plan.plan_id }}/retire" method="POST" style="margin-top: 12px;">
+                                        <input type="hidden" name="version" value="{{ plan.version }}">
+                                        <input type="hidden" name="retired" value="{{ '0' if plan.retired else '1' }}">
+                                        <button type="submit" class="btn {% if not plan.retired %}btn-danger{% endif %}">
+                                            {% if plan.retired %}
+                                                <i class="fas fa-undo"></i> Put Back on Sale
+                                            {% else %}
+                                                <i class="fas fa-archive"></i> Retire
+                                            {% endif %}
+                                        </button>
+                                    </form>
+                                    <ul class="version-list">
+                                        {% for version in versions[plan.plan_id] %}
+                                            <li>
+                                                v{{ version.version }}: {{ version.plan_name }}, {{ version.price }} for {{ version.duration_days }} days{% if version.retired %}, retired{% endif %}
+                                                {% if version.created_at %}({{ version.created_at.strftime('%Y-%m-%d') }}{% if version.created_by %} by {{ version.created_by }}{% endif %}){% endif %}
+                                            </li>
+                                        {% endfor %}
+                                    </ul>
+                                </details>
+                            </td>
+                        </tr>
+                    {% endfor %}
+                </tbody>
+            </table>
+        </div>
+
+        <div class="card">
+            <h2><i class="fas fa-plus-circle"></i> Add Plan</h2>
+            <form action="/plans" method="POST" class="plan-form">
+                <div>
+                    <label>Name</label>
+                    <input type="text" name="plan_name" required>
+                </div>
+                <div>
+                    <label>Price</label>
+                    <input type="number" name="price" min="0" step="0.01" required>
+                </div>
+                <div>
+                    <label>Days</label>
+                    <input type="number" name="duration_days" min="1" required>
+                </div>
+                <div>
+                    <label>Label</label>
+                    <input type="text" name="duration" placeholder="from days">
+                </div>
+                <div>
+                    <label>Badge</label>
+                    <select name="badge">
+                        {% for badge in badge_classes %}
+                            <option value="{{ badge }}">{{ badge[6:] }}</option>
+                        {% endfor %}
+                    </select>
+                </div>
+                <div>
+                    <label>Icon</label>
+                    <input type="text" name="icon" value="tag" required>
+                </div>
+                <div>
+                    <button type="submit" class="btn">
+                        <i class="fas fa-plus"></i> Add Plan
+                    </button>
+                </div>
+            </form>
+        </div>
+
+        <a href="/" class="btn">
+            <i class="fas fa-arrow-left"></i> Back to Dashboard
+        </a>
+    </div>
+</body>
+</html>
+"""
+
+    with open('templates/login.html', 'w') as f:
+        f.write(login_html)
+
+    with open('templates/index.html', 'w') as f:
+        f.write(index_html)
+
+    with open('templates/members_by_plan.html', 'w') as f:
+        f.write(members_by_plan_html)
+
+    with open('templates/view_member.html', 'w') as f:
+        f.write(view_member_html)
+
+    with open('templates/member_history.html', 'w') as f:
+        f.write(member_history_html)
+
+    with open('templates/analytics.html', 'w') as f:
+        f.write(analytics_html)
+
+    with open('templates/plans.html', 'w') as f:
+        f.write(plans_html)
+
+    with open('templates/member_card.html', 'w') as f:
+        f.write(member_card_html)
+
+    with open('templates/profiles.html', 'w') as f:
+        f.write(profiles_html)
+
+def login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'admin_logged_in' not in session:
+            flash('Please log in to access this page', 'danger')
+            return redirect(url_for('login', next=request.url))
+        return f(*args, **kwargs)
+    return decorated_function
+
+def read_your_writes(f):
+    # Runs the view in a causally consistent session that starts after the
+    # admin's previous one. Its token travels in the session cookie, so the
+    # dashboard (and its member-table fetches) shown after a redirect
+    # includes the write even when a lagging secondary serves the lists.
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        with storage.causal_session(after=session.get('causal_token')) as token:
+            response = f(*args, **kwargs)
+            latest = token()
+        if latest is not None and latest != session.get('causal_token'):
+            session['causal_token'] = latest
+        return response
+    return decorated_function
+
+@app.after_request
+def compress(response):
+    # HTML and JSON over COMPRESS_MIN_SIZE, streamed pages included
+    return compress_response(response, request.headers.get('Accept-Encoding'))
+
+def route_name():
+    return f"{request.method} {request.url_rule.rule if request.url_rule else '<unmatched>'}"
+
+@app.before_request
+def start_request_profile():
+    g.request_started = time.perf_counter()
+    if request.endpoint in UNTIMED_ENDPOINTS:
+        return
+    mode = PROFILE_MODE
+    requested = request.headers.get(PROFILE_HEADER) or request.args.get(PROFILE_ARG)
+    if mode is None and requested and 'admin_logged_in' in session:
+        mode = profile_mode(requested)
+    if mode is not None:
+        request_profiler.start(route_name(), mode)
+
+@app.after_request
+def add_server_timing(response):
+    g.response_status = response.status_code
+    # A streamed page is torn down twice: when the view returns and when the stream ends
+    g.streaming = response.is_streamed
+    profile = current_profile()
+    if profile is not None:
+        response.headers['Server-Timing'] = profile.server_timing()
+    return response
+
+@app.teardown_request
+def finish_request_profile(exc):
+    if g.pop('streaming', False):
+        return
+    started = g.pop('request_started', None)
+    if started is None:
+        return
+    if request.endpoint not in UNTIMED_ENDPOINTS:
+        route_timings.record(route_name(), time.perf_counter() - started)
+    request_profiler.finish(g.get('response_status', 500))
+
+@app.route('/assets/<path:filename>')
+def asset(filename):
+    found = asset_manifest.get(filename)
+    if found is None:
+        abort(404)
+
+    # Weak ETag: the gzip, Brotli and plain bodies are the same stylesheet
+    if request.if_none_match.contains_weak(found.etag):
+        response = app.response_class(status=304)
+    else:
+        encoding = accepted_encoding(request.headers.get('Accept-Encoding'))
+        if encoding not in found.bodies:
+            encoding = None
+        response = app.response_class(found.bodies[encoding], mimetype=found.mimetype)
+        if encoding is not None:
+            response.headers['Content-Encoding'] = encoding
+    response.set_etag(found.etag, weak=True)
+    response.headers['Cache-Control'] = f'public, max-age={ASSET_MAX_AGE}, immutable'
+    response.vary.add('Accept-Encoding')
+    return response
+
+@app.route('/healthz')
+def healthz():
+    # Liveness only: the process answers requests
+    return api_response({"status": "ok"})
+
+@app.route('/readyz')
+def readyz():
+    # Ready once the warm-up has finished; 503 sends the load balancer elsewhere
+    state = warm_up.snapshot()
+    state["status"] = "ready" if state["ready"] else "warming_up"
+    return api_response(state, 200 if state["ready"] else 503)
+
+@app.route('/login', methods=['GET', 'POST'])
+def login():
+    if request.method == 'POST':
+        username = request.form.get('username')
+        password = request.form.get('password')
+        
+        admin = storage.find_admin(username)
+        if admin and check_password_hash(admin['password'], password):
+            session['admin_logged_in'] = True
+            session['admin_username'] = username
+            session['admin_full_name'] = admin.get('full_name', 'Admin')
+            session['branch_id'] = admin.get('branch_id', DEFAULT_BRANCH_ID)
+            
             # Update last login
-            admin_collection.update_one(
-                {"username": username},
-                {"$set": {"last_login": datetime.now()}}
-            )
+            last_login = (username, datetime.now())
+            if not write_queue.enqueue('admin', last_login):
+                storage.record_logins([last_login])
             
             flash('Login successful!', 'success')
             next_url = request.args.get('next')
@@ -1589,29 +1730,30 @@ def login():
 
 @app.route('/')
 @login_required
+@read_your_writes
 def dashboard():
     try:
-        members = list(members_collection.find().sort("name", ASCENDING))
-        plans = list(subscriptions_collection.find())
-        expired_members = list(members_collection.find(
-            {"subscription.expiry_date": {"$lt": datetime.now()}}
-        ).sort("subscription.expiry_date", ASCENDING))
+        now = datetime.now()
+        plans = plan_catalog.all()
+        expired_members = storage.expired_members(current_branch(), now)
         
+        # The member table is filled client-side from /api/v1/member-table
         return render_template('index.html', 
-                            members=members, 
                             plans=plans, 
-                            expired_members=expired_members,
-                            current_date=datetime.now())
+                            plan_badges=plan_catalog.badges(),
+                            expired_members=annotate_members(expired_members, now),
+                            current_date=now)
     except Exception as e:
         flash(f"Error loading data: {str(e)}", "danger")
         return render_template('index.html', 
-                            members=[], 
                             plans=[], 
+                            plan_badges={},
                             expired_members=[],
                             current_date=datetime.now())
 
 @app.route('/add_member', methods=['POST'])
 @login_required
+@read_your_writes
 def add_member():
     try:
         name = request.form.get('name')
@@ -1620,30 +1762,39 @@ def add_member():
         plan_id = int(request.form.get('plan'))
         method_payment=request.form.get('method of payment')
         start_date = datetime.strptime(request.form.get('start_date'), '%Y-%m-%d')
-        expiry_date = datetime.strptime(request.form.get('expiry_date'), '%Y-%m-%d')
+        expiry_date = parse_expiry_date()
         
-        # Validate dates
-        if expiry_date <= start_date:
+        plan = plan_catalog.get(plan_id)
+        if plan is None or plan.get("retired"):
+            flash("Plan not found or retired", "danger")
+            return redirect(url_for('dashboard'))
+        
+        # Expiry defaults to start + plan duration; name and price are kept as sold
+        subscription = subscription_for(plan, start_date, expiry_date)
+        if subscription["expiry_date"] <= start_date:
             flash("Expiry date must be after start date", "danger")
             return redirect(url_for('dashboard'))
+        subscription["method_payment"] = method_payment
         
         member_data = {
+            "branch_id": current_branch(),
             "name": name,
             "age": age,
             "contact": contact,
-            "subscription": {
-                "plan_id": plan_id,
-                "method_payment":method_payment,
-                "start_date": start_date,
-                "expiry_date": expiry_date,
-                "status": "active"
-            },
+            "subscription": subscription,
             "created_at": datetime.now(),
             "updated_at": datetime.now()
         }
+        # Digits-only contact, unique per branch
+        member_data.update(normalized_fields(member_data))
         
-        result = members_collection.insert_one(member_data)
-        flash(f"Member added successfully! Member ID: {result.inserted_id}", "success")
+        member_id = storage.insert_member(member_data)
+        record_audit('add_member', member_id, None, member_data)
+        record_period(member_id, subscription, 'purchase')
+        record_payment(member_id, subscription, start_date, method_payment)
+        flash(f"Member added successfully! Member ID: {member_id}", "success")
+    except DuplicateMemberError as e:
+        flash(f"{str(e)}. Update that member's subscription instead.", "warning")
     except ValueError as ve:
         flash(f"Invalid input: {str(ve)}", "danger")
     except Exception as e:
@@ -1651,31 +1802,57 @@ def add_member():
     
     return redirect(url_for('dashboard'))
 
+def parse_expiry_date():
+    # Optional on the forms; empty means "use the plan's duration"
+    value = request.form.get('expiry_date')
+    return datetime.strptime(value, '%Y-%m-%d') if value else None
+
 @app.route('/update_subscription/<member_id>', methods=['POST'])
 @login_required
+@read_your_writes
 def update_subscription(member_id):
     try:
         new_plan_id = int(request.form.get('new_plan'))
         start_date = datetime.strptime(request.form.get('start_date'), '%Y-%m-%d')
-        expiry_date = datetime.strptime(request.form.get('expiry_date'), '%Y-%m-%d')
+        expiry_date = parse_expiry_date()
         
-        # Validate dates
-        if expiry_date <= start_date:
-            flash("Expiry date must be after start date", "danger")
+        plan = plan_catalog.get(new_plan_id)
+        if plan is None or plan.get("retired"):
+            flash("Plan not found or retired", "danger")
             return redirect(url_for('dashboard'))
         
-        result = members_collection.update_one(
-            {"_id": ObjectId(member_id)},
-            {"$set": {
-                "subscription.plan_id": new_plan_id,
-                "subscription.start_date": start_date,
-                "subscription.expiry_date": expiry_date,
-                "updated_at": datetime.now()
-            }}
-        )
+        member = storage.get_member(current_branch(), ObjectId(member_id), fields=['subscription'])
+        if member is None:
+            flash("No changes made or member not found", "warning")
+            return redirect(url_for('dashboard'))
         
-        if result.modified_count > 0:
-            flash("Subscription updated successfully!", "success")
+        # The unused days of the plan version the member bought are credited towards the new one
+        current = member.get("subscription") or {}
+        old_plan = plan_catalog.version(current.get("plan_id"), current.get("plan_version"))
+        changes, proration = change_plan(current, old_plan, plan, start_date, expiry_date)
+        if changes["expiry_date"] <= start_date:
+            flash("Expiry date must be after start date", "danger")
+            return redirect(url_for('dashboard'))
+        before = storage.update_subscription(current_branch(), ObjectId(member_id), changes, datetime.now())
+        expiry_cache.invalidate(current_branch(), ObjectId(member_id))
+        member_cache.invalidate(ObjectId(member_id))
+        
+        if before is not None:
+            revoke_cards_if_shortened(before["_id"], current_branch(), before.get("subscription"), changes)
+            after = {"subscription": dict(before.get("subscription", {}), **changes)}
+            record_audit('update_subscription', before["_id"], before, after)
+            record_period(before["_id"], changes, 'change', previous=before.get("subscription"),
+                          proration=proration)
+            # Paid the way the member last paid unless the form says otherwise
+            method_payment = request.form.get('method of payment') or current.get("method_payment")
+            record_payment(before["_id"], changes, start_date, method_payment, proration["amount_due"])
+            message = f"Subscription updated successfully! Amount due: {proration['amount_due']:.2f}"
+            if proration["credit"]:
+                message += (f" after {proration['credit_applied']:.2f} credit for "
+                            f"{proration['remaining_days']} unused days")
+            if proration["bonus_days"]:
+                message += f", plus {proration['bonus_days']} extra days"
+            flash(message, "success")
         else:
             flash("No changes made or member not found", "warning")
     except Exception as e:
@@ -1685,10 +1862,16 @@ def update_subscription(member_id):
 
 @app.route('/delete_member/<member_id>')
 @login_required
+@read_your_writes
 def delete_member(member_id):
     try:
-        result = members_collection.delete_one({"_id": ObjectId(member_id)})
-        if result.deleted_count > 0:
+        deleted = storage.delete_member(current_branch(), ObjectId(member_id))
+        expiry_cache.invalidate(current_branch(), ObjectId(member_id))
+        member_cache.invalidate(ObjectId(member_id))
+        if deleted is not None:
+            card_revocations.revoke(deleted["_id"], current_branch(),
+                                    (deleted.get("subscription") or {}).get("expiry_date"), 'deleted')
+            record_audit('delete_member', deleted["_id"], deleted, None)
             flash("Member deleted successfully!", "success")
         else:
             flash("Member not found", "warning")
@@ -1697,74 +1880,280 @@ def delete_member(member_id):
     
     return redirect(url_for('dashboard'))
 
+DELETE_BATCH_SIZE = 1000
+
 @app.route('/delete_expired')
 @login_required
 def delete_expired():
     try:
-        result = members_collection.delete_many({"subscription.expiry_date": {"$lt": datetime.now()}})
-        flash(f"Deleted {result.deleted_count} expired memberships", "success")
+        # Repeated clicks within the same minute return the job already queued
+        key = f"delete_expired:{current_branch()}:{datetime.now():%Y-%m-%dT%H:%M}"
+        job = job_runner.submit('delete_expired', current_branch(),
+                                {"admin": session.get('admin_username')}, idempotency_key=key)
+        flash(f"Deleting expired memberships in the background (job {job['_id']})", "success")
     except Exception as e:
         flash(f"Error deleting expired members: {str(e)}", "danger")
     
     return redirect(url_for('dashboard'))
 
+def run_delete_expired(job, progress):
+    branch_id, admin = job["branch_id"], job["params"].get("admin")
+    # Read the documents first so each deletion can be audited with its full contents.
+    # A retry starts over with the members that are still there. The primary is
+    # asked so a renewal a secondary hasn't seen yet is never deleted.
+    expired_members = storage.expired_members(branch_id, datetime.now(), primary=True)
+    deleted_count = 0
+    progress(0, len(expired_members))
+    for start in range(0, len(expired_members), DELETE_BATCH_SIZE):
+        batch = expired_members[start:start + DELETE_BATCH_SIZE]
+        deleted_count += storage.delete_members(branch_id, [member["_id"] for member in batch])
+        for member in batch:
+            member_cache.invalidate(member["_id"])
+            write_audit(audit_entry('delete_expired', member["_id"], member, None,
+                                    admin=admin, branch_id=branch_id))
+        progress(start + len(batch), len(expired_members))
+    expiry_cache.clear()
+    return {"deleted": deleted_count}
+
+job_runner.register('delete_expired', run_delete_expired)
+
+@app.route('/migrate_plan/<plan_id>', methods=['POST'])
+@login_required
+def migrate_plan(plan_id):
+    try:
+        plan = plan_catalog.get(int(plan_id))
+        new_plan = plan_catalog.get(int(request.form.get('new_plan')))
+        if plan is None or new_plan is None or new_plan.get("retired"):
+            flash("Plan not found or retired", "danger")
+            return redirect(url_for('dashboard'))
+        if new_plan["plan_id"] == plan["plan_id"]:
+            flash("Choose a different plan to move the members to", "warning")
+            return redirect(url_for('dashboard'))
+        
+        # Repeated clicks within the same minute return the job already queued
+        key = f"migrate_plan:{current_branch()}:{plan['plan_id']}:{new_plan['plan_id']}:{datetime.now():%Y-%m-%dT%H:%M}"
+        job = job_runner.submit('migrate_plan', current_branch(), {
+            "from_plan_id": plan["plan_id"],
+            "to_plan_id": new_plan["plan_id"],
+            "effective_date": datetime.now(),
+            "admin": session.get('admin_username'),
+        }, idempotency_key=key)
+        flash(f"Moving {plan['plan_name']} members to {new_plan['plan_name']} in the background "
+              f"(job {job['_id']})", "success")
+    except Exception as e:
+        flash(f"Error moving members: {str(e)}", "danger")
+    
+    return redirect(url_for('dashboard'))
+
+def run_migrate_plan(job, progress):
+    branch_id, params = job["branch_id"], job["params"]
+    new_plan = plan_catalog.get(params["to_plan_id"])
+    if new_plan is None:
+        raise ValueError(f"Plan {params['to_plan_id']} not found")
+    done = 0
+    
+    def on_batch(changed):
+        nonlocal done
+        for member_id, before, after in changed:
+            if dict(before, **after) == before:
+                continue
+            expiry_cache.invalidate(branch_id, member_id)
+            member_cache.invalidate(member_id)
+            revoke_cards_if_shortened(member_id, branch_id, before, after)
+            # Keyed like the change records, so a retried batch logs nothing twice
+            write_audit(audit_entry('migrate_plan', member_id, {"subscription": before}, {"subscription": after},
+                                    admin=params.get("admin"), branch_id=branch_id,
+                                    change_id=f"migrate_plan:{job['_id']}:{member_id}"))
+        done += len(changed)
+        progress(done)
+    
+    # The job _id keys the change records, so a retry never records a member twice
+    migrated, skipped = migrate_members(storage, branch_id, params["from_plan_id"], plan_catalog, new_plan,
+                                        params["effective_date"], key=f"migrate_plan:{job['_id']}",
+                                        admin=params.get("admin"), on_batch=on_batch)
+    return {"migrated": migrated, "skipped_expired": skipped}
+
+job_runner.register('migrate_plan', run_migrate_plan)
+
+@app.route('/plans')
+@login_required
+def plans_page():
+    plans = plan_catalog.current()
+    return render_template('plans.html',
+                        plans=plans,
+                        versions={plan["plan_id"]: plan_catalog.versions(plan["plan_id"]) for plan in plans},
+                        badge_classes=BADGE_CLASSES)
+
+def plan_form_changes():
+    price = float(request.form.get('price'))
+    changes = {
+        "plan_name": request.form.get('plan_name', ''),
+        "price": int(price) if price.is_integer() else price,
+        "duration_days": int(request.form.get('duration_days')),
+        "display": {"badge": request.form.get('badge'), "icon": (request.form.get('icon') or '').strip()},
+    }
+    # An empty label is made from the number of days
+    duration = (request.form.get('duration') or '').strip()
+    if duration:
+        changes["duration"] = duration
+    return changes
+
+def save_plan_version(previous, changes):
+    # New versions are inserted, never updated, so members keep the terms they bought
+    plan = plan_version(previous, changes, admin=session.get('admin_username'))
+    try:
+        storage.insert_plan_version(plan)
+    finally:
+        plan_catalog.invalidate()
+    return plan
+
+def current_plan_version(plan_id):
+    plan = plan_catalog.get(plan_id)
+    if plan is None:
+        raise ValueError("Plan not found")
+    # The form was made from an older version; don't overwrite someone else's change
+    if plan["version"] != int(request.form.get('version')):
+        raise PlanVersionExistsError(plan_id, plan["version"])
+    return plan
+
+@app.route('/plans', methods=['POST'])
+@login_required
+def create_plan():
+    try:
+        plan_id = max((plan["plan_id"] for plan in plan_catalog.current()), default=0) + 1
+        plan = save_plan_version(None, dict(plan_form_changes(), plan_id=plan_id))
+        flash(f"Plan {plan['plan_name']} added", "success")
+    except PlanVersionExistsError as e:
+        flash(str(e), "warning")
+    except ValueError as ve:
+        flash(f"Invalid input: {str(ve)}", "danger")
+    except Exception as e:
+        flash(f"Error adding plan: {str(e)}", "danger")
+    
+    return redirect(url_for('plans_page'))
+
+@app.route('/plans/<plan_id>', methods=['POST'])
+@login_required
+def update_plan(plan_id):
+    try:
+        previous = current_plan_version(int(plan_id))
+        plan = save_plan_version(previous, plan_form_changes())
+        flash(f"Plan {plan['plan_name']} saved as version {plan['version']}", "success")
+    except PlanVersionExistsError as e:
+        plan_catalog.invalidate()
+        flash(str(e), "warning")
+    except ValueError as ve:
+        flash(f"Invalid input: {str(ve)}", "danger")
+    except Exception as e:
+        flash(f"Error saving plan: {str(e)}", "danger")
+    
+    return redirect(url_for('plans_page'))
+
+@app.route('/plans/<plan_id>/retire', methods=['POST'])
+@login_required
+def retire_plan(plan_id):
+    try:
+        previous = current_plan_version(int(plan_id))
+        retired = request.form.get('retired') == '1'
+        plan = save_plan_version(previous, {"retired": retired})
+        if retired:
+            flash(f"Plan {plan['plan_name']} retired. Its members keep it until they change plan; "
+                  f"use Move Members on its page to move them now.", "success")
+        else:
+            flash(f"Plan {plan['plan_name']} is on sale again", "success")
+    except PlanVersionExistsError as e:
+        plan_catalog.invalidate()
+        flash(str(e), "warning")
+    except ValueError as ve:
+        flash(f"Invalid input: {str(ve)}", "danger")
+    except Exception as e:
+        flash(f"Error changing plan: {str(e)}", "danger")
+    
+    return redirect(url_for('plans_page'))
+
 @app.route('/members_by_plan/<plan_id>')
 @login_required
+@read_your_writes
 def members_by_plan(plan_id):
     try:
-        members = list(members_collection.find(
-            {"subscription.plan_id": int(plan_id)}
-        ).sort("name", ASCENDING))
+        members = storage.list_members(current_branch(), plan_id=int(plan_id))
         
-        plan = subscriptions_collection.find_one({"plan_id": int(plan_id)})
+        plan = plan_catalog.get(int(plan_id))
         
         if not plan:
             flash("Plan not found", "danger")
             return redirect(url_for('dashboard'))
             
-        return render_template('members_by_plan.html', 
-                            members=members, 
+        now = datetime.now()
+        # Streamed, so long tables start rendering (and compressing) at once
+        return stream_template('members_by_plan.html', 
+                            members=annotate_members(members, now), 
                             plan=plan,
-                            current_date=datetime.now())
+                            plans=plan_catalog.all(),
+                            current_date=now)
     except Exception as e:
         flash(f"Error loading members: {str(e)}", "danger")
         return redirect(url_for('dashboard'))
     
+def load_member_details(branch_id, member_id):
+    # Profile fields and payments live in side collections; only the member page reads them
+    member = storage.get_member(branch_id, member_id)
+    if member is None:
+        return None
+    profile = storage.get_member_profile(branch_id, member_id) or {}
+    member.update((field, profile[field]) for field in PROFILE_FIELDS if field in profile)
+    member["payments"] = storage.member_payments(branch_id, member_id, PAYMENTS_LIMIT)
+    return member
+
+def get_cached_member(member_id):
+    branch_id = current_branch()
+    return member_cache.get(branch_id, member_id, lambda: load_member_details(branch_id, member_id))
+
 @app.route('/view_member/<member_id>')
 @login_required
 def view_member(member_id):
     try:
-        member = members_collection.find_one({"_id": ObjectId(member_id)})
+        member = get_cached_member(ObjectId(member_id))
         if not member:
             flash("Member not found", "danger")
             return redirect(url_for('dashboard'))
         
-        plans = list(subscriptions_collection.find())
-        
+        now = datetime.now()
         return render_template('view_member.html',
-                            member=member,
-                            plans=plans,
-                            current_date=datetime.now())
+                            member=annotate_member(member, now),
+                            current_date=now)
     except Exception as e:
         flash(f"Error loading member details: {str(e)}", "danger")
         return redirect(url_for('dashboard'))
 
+@app.route('/member_history/<member_id>')
+@login_required
+def view_member_history(member_id):
+    try:
+        entries = storage.member_history(current_branch(), ObjectId(member_id), HISTORY_LIMIT)
+        periods = storage.subscription_periods(current_branch(), ObjectId(member_id), PERIODS_LIMIT)
+        return render_template('member_history.html',
+                            member_id=member_id,
+                            entries=entries,
+                            periods=periods)
+    except Exception as e:
+        flash(f"Error loading member history: {str(e)}", "danger")
+        return redirect(url_for('dashboard'))
+
 @app.route('/print_member/<member_id>')
 @login_required
 def print_member(member_id):
     try:
-        member = members_collection.find_one({"_id": ObjectId(member_id)})
+        member = get_cached_member(ObjectId(member_id))
         if not member:
             flash("Member not found", "danger")
             return redirect(url_for('dashboard'))
         
-        plans = list(subscriptions_collection.find())
-        
         # Generate PDF or print-friendly HTML
+        now = datetime.now()
         rendered = render_template('view_member.html',
-                                 member=member,
-                                 plans=plans,
-                                 current_date=datetime.now())
+                                 member=annotate_member(member, now),
+                                 current_date=now)
         
         response = make_response(rendered)
         response.headers['Content-Type'] = 'application/pdf'
@@ -1774,6 +2163,86 @@ def print_member(member_id):
         flash(f"Error generating print view: {str(e)}", "danger")
         return redirect(url_for('dashboard'))
 
+@app.route('/admin/profiles')
+@login_required
+def profiles_page():
+    return render_template('profiles.html',
+                           routes=route_timings.slowest(),
+                           profiles=request_profiler.store.recent(),
+                           profile_mode=PROFILE_MODE,
+                           profile_header=PROFILE_HEADER,
+                           profile_arg=PROFILE_ARG)
+
+@app.route('/admin/profiles/<filename>')
+@login_required
+def profile_file(filename):
+    if not request_profiler.store.has(filename):
+        abort(404)
+    return send_from_directory(request_profiler.store.directory, filename, as_attachment=True)
+
+def revoke_cards_if_shortened(member_id, branch_id, before, after):
+    # Cards printed before the change still show the later expiry date
+    old_expiry, new_expiry = (before or {}).get("expiry_date"), after.get("expiry_date")
+    if old_expiry is not None and new_expiry is not None and new_expiry < old_expiry:
+        card_revocations.revoke(member_id, branch_id, old_expiry, 'expiry_shortened')
+
+@app.route('/member_card/<member_id>')
+@login_required
+def member_card(member_id):
+    try:
+        member = get_cached_member(ObjectId(member_id))
+        if not member:
+            flash("Member not found", "danger")
+            return redirect(url_for('dashboard'))
+        expiry_date = (member.get("subscription") or {}).get("expiry_date")
+        if expiry_date is None:
+            flash("Member has no subscription to put on a card", "warning")
+            return redirect(url_for('view_member', member_id=member_id))
+
+        now = datetime.now()
+        issued_at = card_revocations.issue_time(member["_id"], now)
+        token = sign_card(card_key, member["_id"], expiry_date, issued_at)
+        return render_template('member_card.html',
+                               member=annotate_member(member, now),
+                               token=token,
+                               qr_svg=card_qr_svg(token),
+                               issued_at=issued_at,
+                               gym_name=GYM_NAME)
+    except Exception as e:
+        flash(f"Error loading membership card: {str(e)}", "danger")
+        return redirect(url_for('dashboard'))
+
+@app.route('/member_card/<member_id>/revoke', methods=['POST'])
+@login_required
+def revoke_member_card(member_id):
+    try:
+        member = storage.get_member(current_branch(), ObjectId(member_id), fields=['subscription'])
+        if member is None:
+            flash("Member not found", "danger")
+            return redirect(url_for('dashboard'))
+        card_revocations.revoke(member["_id"], current_branch(),
+                                (member.get("subscription") or {}).get("expiry_date"), 'lost')
+        record_audit('revoke_card', member["_id"], None, None)
+        flash("Earlier cards are revoked. Print this new card for the member.", "success")
+    except Exception as e:
+        flash(f"Error revoking card: {str(e)}", "danger")
+    return redirect(url_for('member_card', member_id=member_id))
+
+@app.route('/analytics')
+@login_required
+def analytics_page():
+    if analytics is None:
+        flash("Analytics needs NumPy (pip install numpy)", "danger")
+        return redirect(url_for('dashboard'))
+    try:
+        snapshot = snapshot_cache.get(current_branch())
+        # Retired plans still have members, so they count towards the mix and renewals
+        report = analytics.build_report(snapshot, plan_catalog.current())
+        return render_template('analytics.html', report=report)
+    except Exception as e:
+        flash(f"Error loading analytics: {str(e)}", "danger")
+        return redirect(url_for('dashboard'))
+
 @app.route('/logout', methods=['GET', 'POST'])
 @login_required
 def logout():
@@ -1781,9 +2250,401 @@ def logout():
     flash('You have been logged out', 'success')
     return redirect(url_for('login'))
 
+# JSON API (v1)
+API_DEFAULT_LIMIT = 50
+API_MAX_LIMIT = 500
+
+# Dashboard table chunks: one array per member instead of one object, so
+# field names are sent once per chunk rather than once per row
+TABLE_CHUNK_SIZE = 1000
+TABLE_MAX_CHUNK_SIZE = 5000
+MEMBER_TABLE_COLUMNS = ["_id", "name", "age", "contact", "plan_id", "plan_name",
+                        "start_date", "expiry_date", "active"]
+MEMBER_TABLE_FIELDS = ["name", "age", "contact", "subscription.plan_id", "subscription.plan_name",
+                       "subscription.start_date", "subscription.expiry_date"]
+
+# Fields clients may request through ?fields=; _id is always returned. Profile
+# fields are kept in member_profiles and only served for a single member
+MEMBER_API_FIELDS = {
+    "name", "age", "gender", "contact", "email", "address",
+    "emergency_contact", "health_notes", "created_at", "updated_at",
+    "subscription", "subscription.plan_id", "subscription.start_date",
+    "subscription.expiry_date", "subscription.status",
+    "subscription.method_payment",
+}
+
+def json_default(value):
+    if isinstance(value, ObjectId):
+        return str(value)
+    if isinstance(value, datetime):
+        return value.isoformat()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+def api_response(payload, status=200):
+    body = json.dumps(payload, default=json_default, separators=(',', ':'))
+    return app.response_class(body, status=status, mimetype='application/json')
+
+def api_error(message, status):
+    return api_response({"error": message}, status)
+
+def api_login_required(f):
+    @wraps(f)
+    def decorated_function(*args, **kwargs):
+        if 'admin_logged_in' not in session:
+            return api_error("Authentication required", 401)
+        return f(*args, **kwargs)
+    return decorated_function
+
+def parse_fields(raw, allowed=MEMBER_API_FIELDS):
+    if not raw:
+        return None
+    fields = [field.strip() for field in raw.split(',') if field.strip()]
+    unknown = [field for field in fields if field not in allowed]
+    if unknown:
+        raise ValueError(f"Unknown fields: {', '.join(unknown)}")
+    # MongoDB rejects a projection of both a field and one of its sub-fields (path collision)
+    overlapping = [field for field in fields if any(field.startswith(other + '.') for other in fields)]
+    if overlapping:
+        raise ValueError(f"Fields already included by their parent: {', '.join(overlapping)}")
+    return fields
+
+def encode_cursor(member):
+    raw = json.dumps([member.get("name"), str(member["_id"])], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    name, member_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    return name, ObjectId(member_id)
+
+@app.route('/api/v1/members')
+@api_login_required
+@read_your_writes
+def api_members():
+    try:
+        limit = min(max(int(request.args.get('limit', API_DEFAULT_LIMIT)), 1), API_MAX_LIMIT)
+        fields = parse_fields(request.args.get('fields'), MEMBER_API_FIELDS - set(PROFILE_FIELDS))
+
+        plan_id = int(request.args['plan_id']) if request.args.get('plan_id') else None
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError, InvalidId) as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+
+    # "name" is always fetched so the next cursor can be built from the page
+    projection = fields + ["name"] if fields is not None else None
+
+    try:
+        members = storage.list_members(current_branch(), plan_id=plan_id, after=after,
+                                       limit=limit + 1, fields=projection)
+    except PyMongoError as e:
+        return api_error(f"Error loading members: {str(e)}", 503)
+
+    has_more = len(members) > limit
+    members = members[:limit]
+    next_cursor = encode_cursor(members[-1]) if has_more else None
+
+    if fields is not None and "name" not in fields:
+        for member in members:
+            member.pop("name", None)
+
+    return api_response({"data": members, "next_cursor": next_cursor})
+
+@app.route('/api/v1/member-table')
+@api_login_required
+@read_your_writes
+def api_member_table():
+    try:
+        limit = min(max(int(request.args.get('limit', TABLE_CHUNK_SIZE)), 1), TABLE_MAX_CHUNK_SIZE)
+        cursor = request.args.get('cursor')
+        after = decode_cursor(cursor) if cursor else None
+    except (ValueError, TypeError, InvalidId) as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+
+    try:
+        members = storage.list_members(current_branch(), after=after, limit=limit + 1,
+                                       fields=MEMBER_TABLE_FIELDS)
+    except PyMongoError as e:
+        return api_error(f"Error loading members: {str(e)}", 503)
+
+    has_more = len(members) > limit
+    members = annotate_members(members[:limit])
+    rows = []
+    for member in members:
+        subscription = member.get("subscription") or {}
+        dates = member["dates"]
+        rows.append([member["_id"], member.get("name"), member.get("age"), member.get("contact"),
+                     subscription.get("plan_id"), subscription.get("plan_name"),
+                     dates["start"], dates["expiry"], dates["active"]])
+
+    return api_response({
+        "columns": MEMBER_TABLE_COLUMNS,
+        "rows": rows,
+        "next_cursor": encode_cursor(members[-1]) if has_more else None,
+    })
+
+@app.route('/api/v1/members/<member_id>')
+@api_login_required
+def api_member(member_id):
+    try:
+        fields = parse_fields(request.args.get('fields'))
+        object_id = ObjectId(member_id)
+    except (ValueError, InvalidId) as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+
+    profile_fields = [field for field in PROFILE_FIELDS if fields is None or field in fields]
+    # ["_id"] rather than an empty projection, which MongoDB reads as "every field"
+    member_fields = [field for field in fields if field not in PROFILE_FIELDS] or ["_id"] if fields is not None else None
+    try:
+        member = storage.get_member(current_branch(), object_id, member_fields)
+        if member and profile_fields:
+            profile = storage.get_member_profile(current_branch(), object_id) or {}
+            member.update((field, profile[field]) for field in profile_fields if field in profile)
+    except PyMongoError as e:
+        return api_error(f"Error loading member: {str(e)}", 503)
+
+    if not member:
+        return api_error("Member not found", 404)
+    return api_response({"data": member})
+
+@app.route('/api/v1/plans')
+@api_login_required
+def api_plans():
+    try:
+        plans = [{key: value for key, value in plan.items() if key != '_id'}
+                 for plan in plan_catalog.all()]
+    except PyMongoError as e:
+        return api_error(f"Error loading plans: {str(e)}", 503)
+    return api_response({"data": plans})
+
+# Check-ins
+expiry_cache = ExpiryCache(lambda branch_id, member_id: storage.get_member_expiry(branch_id, member_id))
+
+@app.route('/checkin/<member_id>', methods=['POST'])
+@api_login_required
+def checkin(member_id):
+    try:
+        object_id = ObjectId(member_id)
+    except InvalidId:
+        return api_error("Invalid member ID", 400)
+
+    try:
+        expiry_date = expiry_cache.get(current_branch(), object_id)
+        if expiry_date is None:
+            return api_error("Member not found", 404)
+
+        now = datetime.now()
+        if expiry_date <= now:
+            return api_response({"error": "Membership expired", "expiry_date": expiry_date}, 403)
+
+        if not write_queue.enqueue('checkins', (current_branch(), object_id, now)):
+            storage.checkins.record(current_branch(), object_id, now)
+    except PyMongoError as e:
+        return api_error(f"Error recording check-in: {str(e)}", 503)
+
+    return api_response({"member_id": object_id, "ts": now, "expiry_date": expiry_date}, 201)
+
+@app.route('/verify', methods=['GET', 'POST'])
+@api_login_required
+def verify():
+    # Signature, expiry and the in-memory revocations only: no database read
+    token = request.args.get('token')
+    if token is None and request.is_json:
+        token = (request.get_json(silent=True) or {}).get('token')
+    if not token:
+        return api_error("token is required", 400)
+    return api_response({"data": verify_card(card_key, token, card_revocations)})
+
+@app.route('/api/v1/members/<member_id>/checkins')
+@api_login_required
+def api_member_checkins(member_id):
+    try:
+        object_id = ObjectId(member_id)
+        limit = min(max(int(request.args.get('limit', API_DEFAULT_LIMIT)), 1), API_MAX_LIMIT)
+    except (ValueError, InvalidId) as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+
+    try:
+        if expiry_cache.get(current_branch(), object_id) is None:
+            return api_error("Member not found", 404)
+        checkins = storage.checkins.member_checkins(current_branch(), object_id, limit)
+    except PyMongoError as e:
+        return api_error(f"Error loading check-ins: {str(e)}", 503)
+    return api_response({"data": checkins})
+
+@app.route('/api/v1/members/<member_id>/periods')
+@api_login_required
+def api_member_periods(member_id):
+    try:
+        object_id = ObjectId(member_id)
+        limit = min(max(int(request.args.get('limit', PERIODS_LIMIT)), 1), API_MAX_LIMIT)
+    except (ValueError, InvalidId) as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+
+    try:
+        periods = storage.subscription_periods(current_branch(), object_id, limit)
+    except PyMongoError as e:
+        return api_error(f"Error loading subscription periods: {str(e)}", 503)
+    return api_response({"data": periods})
+
+@app.route('/api/v1/members/<member_id>/payments')
+@api_login_required
+def api_member_payments(member_id):
+    try:
+        object_id = ObjectId(member_id)
+        limit = min(max(int(request.args.get('limit', PAYMENTS_LIMIT)), 1), API_MAX_LIMIT)
+    except (ValueError, InvalidId) as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+
+    try:
+        payments = storage.member_payments(current_branch(), object_id, limit)
+    except PyMongoError as e:
+        return api_error(f"Error loading payments: {str(e)}", 503)
+    return api_response({"data": payments})
+
+@app.route('/api/v1/notifications')
+@api_login_required
+def api_notifications():
+    try:
+        limit = min(max(int(request.args.get('limit', NOTIFICATIONS_LIMIT)), 1), API_MAX_LIMIT)
+    except ValueError as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+
+    try:
+        notifications = storage.recent_notifications(current_branch(), limit)
+    except PyMongoError as e:
+        return api_error(f"Error loading notifications: {str(e)}", 503)
+    return api_response({"data": notifications})
+
+@app.route('/api/v1/occupancy')
+@api_login_required
+def api_occupancy():
+    try:
+        day = request.args.get('date') or datetime.now().strftime('%Y-%m-%d')
+        start = datetime.strptime(day, '%Y-%m-%d')
+    except ValueError as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+
+    try:
+        occupancy = storage.checkins.hourly_occupancy(current_branch(), start, start + timedelta(days=1))
+    except PyMongoError as e:
+        return api_error(f"Error loading occupancy: {str(e)}", 503)
+    return api_response({"date": start, "data": occupancy})
+
+@app.route('/api/v1/stats/write-queue')
+@api_login_required
+def api_write_queue_stats():
+    return api_response({"data": write_queue.snapshot()})
+
+@app.route('/api/v1/stats/member-cache')
+@api_login_required
+def api_member_cache_stats():
+    return api_response({"data": member_cache.snapshot()})
+
+@app.route('/api/v1/jobs')
+@api_login_required
+def api_jobs():
+    try:
+        limit = min(max(int(request.args.get('limit', API_DEFAULT_LIMIT)), 1), API_MAX_LIMIT)
+    except ValueError as e:
+        return api_error(f"Invalid request: {str(e)}", 400)
+    try:
+        jobs = storage.list_jobs(current_branch(), limit)
+    except PyMongoError as e:
+        return api_error(f"Error loading jobs: {str(e)}", 503)
+    return api_response({"data": jobs})
+
+@app.route('/api/v1/jobs/<job_id>')
+@api_login_required
+def api_job(job_id):
+    try:
+        job = storage.get_job(ObjectId(job_id))
+    except InvalidId:
+        return api_error("Invalid job id", 400)
+    except PyMongoError as e:
+        return api_error(f"Error loading job: {str(e)}", 503)
+    if job is None or job.get("branch_id") != current_branch():
+        return api_error("Job not found", 404)
+    return api_response({"data": job})
+
+@app.route('/api/v1/stats/jobs')
+@api_login_required
+def api_job_stats():
+    return api_response({"data": job_runner.stats})
+
+@app.route('/api/v1/stats/sweeper')
+@api_login_required
+def api_sweeper_stats():
+    return api_response({"data": status_sweeper.snapshot()})
+
+@app.route('/api/v1/stats/routes')
+@api_login_required
+def api_route_stats():
+    return api_response({"data": {"routes": route_timings.slowest(), "profiler": request_profiler.stats}})
+
+@app.route('/api/v1/stats/cards')
+@api_login_required
+def api_card_stats():
+    return api_response({"data": card_revocations.snapshot()})
+
+@app.route('/api/v1/stats/notifications')
+@api_login_required
+def api_notification_stats():
+    return api_response({"data": notification_dispatcher.snapshot()})
+
+@app.route('/api/v1/stats/query-plans')
+@api_login_required
+def api_query_plan_stats():
+    report = storage.query_plan_report()
+    if report is None:
+        return api_error("Query plan checks are off; start with GYM_EXPLAIN_QUERIES=1", 404)
+    return api_response({"data": report})
+
+def invalidate_members(member_ids):
+    for member_id in member_ids:
+        member_cache.invalidate(member_id)
+
 # Initialize data and templates
+def compile_templates():
+    # The environment caches compiled templates, so no request has to compile one
+    names = app.jinja_env.list_templates(extensions=['html'])
+    for name in names:
+        app.jinja_env.get_template(name)
+    return len(names)
+
 initialize_sample_data()
 create_templates()
 
+# Connects, fills the pool, loads the plan catalog and compiles templates; /readyz waits for it
+warm_up = WarmUp([
+    ('database_ping', storage.ping),
+    ('connection_pool', storage.open_connections),
+    ('plan_catalog', lambda: len(plan_catalog.all())),
+    ('templates', compile_templates),
+])
+warm_up.start()
+atexit.register(warm_up.close)
+backfill_in_background(storage, plan_catalog, on_batch=invalidate_members)
+normalize_in_background(storage, on_batch=invalidate_members)
+split_in_background(storage, on_batch=invalidate_members)
+job_runner.start()
+atexit.register(job_runner.close)
+
+# Moves lapsed subscriptions to status "expired" every GYM_SWEEP_INTERVAL_SECONDS
+status_sweeper = StatusSweeper(storage, on_expired=invalidate_members)
+status_sweeper.start()
+atexit.register(status_sweeper.close)
+
+# Reloads card revocations recorded by other processes every GYM_CARD_REVOCATION_REFRESH_SECONDS
+card_revocations.start()
+atexit.register(card_revocations.close)
+
+# Emails or texts members whose subscription ends within GYM_NOTIFY_WINDOWS days
+notification_dispatcher = NotificationDispatcher(storage, create_transports())
+# Nothing to send until a transport is configured (GYM_NOTIFY_*_TRANSPORT)
+if notification_dispatcher.transports:
+    notification_dispatcher.start()
+    atexit.register(notification_dispatcher.close)
+
 if __name__ == '__main__':
     app.run(debug=True, host='0.0.0.0', port=5000)
\ No newline at end of file
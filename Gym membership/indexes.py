@@ -0,0 +1,233 @@
+"""Declared MongoDB indexes, startup reconciliation and an explain() advisor.
+
+Every index the app needs is listed in INDEXES together with the query
+shapes it serves. At startup the declared indexes are diffed against
+list_indexes() and missing ones are built from a background thread; extra
+indexes are only reported. At deploy time the same diff can be run by hand:
+
+    python indexes.py            # show missing / extra / conflicting indexes
+    python indexes.py --apply    # build missing indexes
+    python indexes.py --apply --drop-extra
+"""
+import argparse
+import logging
+import os
+import sys
+import threading
+from collections import namedtuple
+
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError, PyMongoError
+
+from audit import AUDIT_COLLECTION, AUDIT_RETENTION_DAYS
+from member_details import PAYMENTS_COLLECTION, PROFILES_COLLECTION
+from cards import CARD_REVOCATIONS_COLLECTION
+from notifications import NOTIFICATIONS_COLLECTION
+from proration import PERIODS_COLLECTION
+
+logger = logging.getLogger(__name__)
+
+# Dev mode: explain() every member query and flag COLLSCAN / in-memory SORT
+EXPLAIN_QUERIES = os.environ.get('GYM_EXPLAIN_QUERIES') == '1'
+
+IndexSpec = namedtuple('IndexSpec', 'collection keys options serves')
+
+INDEXES = [
+    IndexSpec('members', [("branch_id", ASCENDING), ("name", ASCENDING), ("_id", ASCENDING)], {},
+              "dashboard, /api/v1/members: {branch_id} sorted by (name, _id), keyset pages"),
+    IndexSpec('members', [("branch_id", ASCENDING), ("subscription.plan_id", ASCENDING),
+                          ("name", ASCENDING), ("_id", ASCENDING)], {},
+              "members_by_plan, /api/v1/members?plan_id: {branch_id, plan_id} sorted by (name, _id)"),
+    IndexSpec('members', [("branch_id", ASCENDING), ("subscription.expiry_date", ASCENDING), ("_id", ASCENDING)], {},
+              "dashboard expired list, delete_expired: {branch_id, expiry_date < now} sorted by expiry; "
+              "status sweeper: expiry_date window sorted by (expiry_date, _id), keyset batches"),
+    IndexSpec('members', [("branch_id", ASCENDING), ("_id", ASCENDING)], {},
+              "member_snapshot: {branch_id}; shard key candidate {branch_id, _id}"),
+    IndexSpec('members', [("branch_id", ASCENDING), ("contact_normalized", ASCENDING)],
+              {"unique": True, "partialFilterExpression": {"contact_normalized": {"$type": "string"}}},
+              "add_member: one member per contact number and branch (members without a number are exempt)"),
+    IndexSpec('subscriptions', [("plan_id", ASCENDING), ("version", ASCENDING)], {"unique": True},
+              "plan catalog: every version sorted by (plan_id, version); one document per plan version"),
+    IndexSpec('admin', [("username", ASCENDING)], {"unique": True},
+              "login: {username}"),
+    IndexSpec(AUDIT_COLLECTION, [("member_id", ASCENDING), ("ts", DESCENDING)], {},
+              "member_history: {member_id} sorted by ts desc"),
+    IndexSpec(AUDIT_COLLECTION, [("change_id", ASCENDING)],
+              {"unique": True, "partialFilterExpression": {"change_id": {"$exists": True}}},
+              "migrate_plan: one audit entry per member and job, so retried batches log nothing twice"),
+    IndexSpec(PERIODS_COLLECTION, [("member_id", ASCENDING), ("created_at", DESCENDING)], {},
+              "member_history, /api/v1/members/<id>/periods: {member_id} sorted by created_at desc"),
+    IndexSpec(PERIODS_COLLECTION, [("change_id", ASCENDING)], {"unique": True},
+              "proration: one period per change, so retried migration batches record nothing twice"),
+    IndexSpec(PROFILES_COLLECTION, [("member_id", ASCENDING)], {"unique": True},
+              "view_member: {member_id}; one profile per member"),
+    IndexSpec(PAYMENTS_COLLECTION, [("member_id", ASCENDING), ("date", DESCENDING)], {},
+              "view_member, /api/v1/members/<id>/payments: {member_id} sorted by date desc"),
+    IndexSpec(PAYMENTS_COLLECTION, [("payment_id", ASCENDING)], {"unique": True},
+              "member split: one document per payment, so retried batches record nothing twice"),
+    IndexSpec(NOTIFICATIONS_COLLECTION, [("key", ASCENDING)], {"unique": True},
+              "notification dispatcher: one notice per (member, window, expiry date), even across processes"),
+    IndexSpec(NOTIFICATIONS_COLLECTION, [("branch_id", ASCENDING), ("created_at", DESCENDING)], {},
+              "/api/v1/notifications: {branch_id} sorted by created_at desc"),
+    IndexSpec(CARD_REVOCATIONS_COLLECTION, [("member_id", ASCENDING)], {"unique": True},
+              "card revocations: one entry per member, extended by later revocations"),
+    IndexSpec(CARD_REVOCATIONS_COLLECTION, [("updated_at", ASCENDING)], {},
+              "card revocation refresh: {updated_at: {$gte}} sorted by updated_at"),
+    IndexSpec('jobs', [("status", ASCENDING), ("run_after", ASCENDING)], {},
+              "job workers: claim the oldest queued job, or a running one with an expired lease"),
+    IndexSpec('jobs', [("idempotency_key", ASCENDING)],
+              {"unique": True, "partialFilterExpression": {"idempotency_key": {"$exists": True}}},
+              "submit: one job per idempotency key"),
+    IndexSpec('jobs', [("branch_id", ASCENDING), ("created_at", DESCENDING)], {},
+              "/api/v1/jobs: {branch_id} sorted by created_at desc"),
+    IndexSpec(AUDIT_COLLECTION, [("ts", ASCENDING)],
+              {"expireAfterSeconds": AUDIT_RETENTION_DAYS * 24 * 3600},
+              "TTL expiry of audit entries"),
+]
+
+# Options that change what an index does; anything else (name, v, ...) is ignored
+COMPARED_OPTIONS = ('unique', 'expireAfterSeconds', 'partialFilterExpression', 'sparse')
+
+
+def _key(keys):
+    # Servers may report 1 as 1.0; special index types ("2dsphere") stay strings
+    return tuple((field, int(direction) if isinstance(direction, (int, float)) else direction)
+                 for field, direction in keys)
+
+
+def diff_indexes(db, specs=INDEXES):
+    """Compare declared indexes with the server.
+
+    Returns (missing, conflicting, extra): missing and conflicting are lists
+    of IndexSpec, extra a list of (collection, index name) pairs.
+    """
+    missing, conflicting, extra = [], [], []
+    for collection in sorted({spec.collection for spec in specs}):
+        existing = {}
+        for index in db[collection].list_indexes():
+            existing[_key(index["key"].items())] = index
+
+        declared = set()
+        for spec in (spec for spec in specs if spec.collection == collection):
+            key = _key(spec.keys)
+            declared.add(key)
+            index = existing.get(key)
+            if index is None:
+                missing.append(spec)
+            elif any(index.get(option) != spec.options.get(option) for option in COMPARED_OPTIONS):
+                conflicting.append(spec)
+
+        for key, index in existing.items():
+            if key not in declared and index["name"] != '_id_':
+                extra.append((collection, index["name"]))
+    return missing, conflicting, extra
+
+
+def build_indexes(db, specs):
+    for spec in specs:
+        logger.info("Building index %s %s", spec.collection, spec.keys)
+        try:
+            db[spec.collection].create_index(spec.keys, **spec.options)
+        except DuplicateKeyError:
+            # A unique index over existing duplicates; the other indexes still get built
+            logger.error("Index %s %s not built: existing documents violate it", spec.collection, spec.keys)
+
+
+def reconcile_indexes(db, specs=INDEXES, drop_extra=False):
+    missing, conflicting, extra = diff_indexes(db, specs)
+    for spec in conflicting:
+        logger.warning("Index %s %s exists with different options; rebuild it by hand",
+                       spec.collection, spec.keys)
+    for collection, name in extra:
+        if drop_extra:
+            logger.info("Dropping index %s.%s", collection, name)
+            db[collection].drop_index(name)
+        else:
+            logger.warning("Index %s.%s is not declared in indexes.py", collection, name)
+    build_indexes(db, missing)
+    return missing, conflicting, extra
+
+
+def reconcile_in_background(db, specs=INDEXES):
+    """Start reconciliation without delaying startup."""
+    def run():
+        try:
+            reconcile_indexes(db, specs)
+        except PyMongoError:
+            logger.exception("Index reconciliation failed")
+
+    thread = threading.Thread(target=run, name='index-reconcile', daemon=True)
+    thread.start()
+    return thread
+
+
+def plan_stages(plan):
+    """Yield every stage name in an explain() plan tree."""
+    yield plan.get("stage")
+    for child in ([plan["inputStage"]] if "inputStage" in plan else []) + plan.get("inputStages", []):
+        yield from plan_stages(child)
+
+
+class QueryAdvisor:
+    """Collects explain() findings per query shape (dev mode only)."""
+
+    def __init__(self):
+        self.findings = {}
+        self._lock = threading.Lock()
+
+    def check(self, shape, cursor):
+        try:
+            explain = cursor.explain()
+        except PyMongoError:
+            logger.exception("explain() failed for %s", shape)
+            return
+
+        winning = explain.get("queryPlanner", {}).get("winningPlan", {})
+        # Slot-based engine (MongoDB 6.0+) nests the classic tree under queryPlan
+        stages = set(plan_stages(winning.get("queryPlan", winning)))
+        problems = sorted(stages & {"COLLSCAN", "SORT"})
+
+        with self._lock:
+            finding = self.findings.setdefault(shape, {"runs": 0, "problems": [], "stages": []})
+            finding["runs"] += 1
+            finding["problems"] = problems
+            finding["stages"] = sorted(stage for stage in stages if stage)
+        if problems:
+            logger.warning("Query %s uses %s", shape, ', '.join(problems))
+
+    def report(self):
+        with self._lock:
+            return [dict(finding, shape=shape) for shape, finding in sorted(self.findings.items())]
+
+
+def main():
+    from storage import MONGO_URI
+    from pymongo import MongoClient
+
+    parser = argparse.ArgumentParser(description="Diff declared MongoDB indexes against the server")
+    parser.add_argument('--uri', default=MONGO_URI)
+    parser.add_argument('--db', default='GymDB')
+    parser.add_argument('--apply', action='store_true', help='build missing indexes')
+    parser.add_argument('--drop-extra', action='store_true', help='drop undeclared indexes (with --apply)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    db = MongoClient(args.uri)[args.db]
+    missing, conflicting, extra = diff_indexes(db)
+
+    for spec in missing:
+        print(f"missing     {spec.collection} {spec.keys} {spec.options or ''}  <- {spec.serves}")
+    for spec in conflicting:
+        print(f"conflicting {spec.collection} {spec.keys} {spec.options}")
+    for collection, name in extra:
+        print(f"extra       {collection}.{name}")
+    if not (missing or conflicting or extra):
+        print("All declared indexes are present")
+
+    if args.apply:
+        reconcile_indexes(db, drop_extra=args.drop_extra)
+    return 1 if (missing or conflicting) and not args.apply else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,151 @@
+"""Background jobs for long-running admin actions.
+
+Jobs are stored through the storage backend (the "jobs" collection on
+MongoDB), so they survive restarts and any app process can pick them up. Each
+process runs a small pool of worker threads that claim jobs one at a time.
+Claiming is atomic, so a job runs in one worker only. A claimed job holds a
+lease; if its process dies, the job is picked up again once the lease runs
+out. Handlers report progress, which also renews the lease.
+
+A handler is called as handler(job, progress) and returns a result dict.
+progress(done, total) records how far it got. A handler that raises is
+retried with exponential backoff until max_attempts is reached. Handlers
+must therefore be safe to run again after a partial run.
+"""
+import logging
+import os
+import threading
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+JOB_WORKERS = int(os.environ.get('GYM_JOB_WORKERS', 2))
+POLL_INTERVAL = 1.0  # seconds an idle worker waits before looking for jobs again
+LEASE_SECONDS = 300
+MAX_ATTEMPTS = 3
+RETRY_DELAY_SECONDS = 10  # doubled after every failed attempt
+
+
+class JobRunner:
+    """Submits jobs and runs them on a pool of worker threads."""
+
+    def __init__(self, store, workers=JOB_WORKERS, poll_interval=POLL_INTERVAL):
+        self.store = store
+        self.workers = workers
+        self.poll_interval = poll_interval
+        self._handlers = {}
+        self._threads = []
+        self._stop = threading.Event()
+        self._wake = threading.Event()
+        self.stats = {"submitted": 0, "claimed": 0, "succeeded": 0, "retried": 0, "failed": 0}
+
+    def register(self, job_type, handler):
+        self._handlers[job_type] = handler
+
+    def submit(self, job_type, branch_id, params=None, idempotency_key=None, max_attempts=MAX_ATTEMPTS):
+        """Queue a job and return it.
+
+        If a job with the same idempotency_key was already submitted, that
+        job is returned instead and nothing new is queued.
+        """
+        if job_type not in self._handlers:
+            raise KeyError(f"Unknown job type: {job_type}")
+
+        now = datetime.now()
+        job = {
+            "type": job_type,
+            "branch_id": branch_id,
+            "params": params or {},
+            "status": "queued",
+            "attempts": 0,
+            "max_attempts": max_attempts,
+            "progress": {"done": 0, "total": None},
+            "result": None,
+            "error": None,
+            "created_at": now,
+            "run_after": now,
+            "started_at": None,
+            "finished_at": None,
+            "lease_until": None,
+        }
+        if idempotency_key is not None:
+            job["idempotency_key"] = idempotency_key
+
+        job = self.store.insert_job(job)
+        self.stats["submitted"] += 1
+        self._wake.set()
+        return job
+
+    def start(self):
+        if self._threads:
+            return
+        for number in range(self.workers):
+            thread = threading.Thread(target=self._run, name=f'job-worker-{number}', daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    def close(self, timeout=10):
+        """Stop claiming jobs and wait for the running ones to finish."""
+        self._stop.set()
+        self._wake.set()
+        for thread in self._threads:
+            thread.join(timeout=timeout)
+
+    def _run(self):
+        while not self._stop.is_set():
+            job = self._claim()
+            if job is None:
+                self._wake.wait(self.poll_interval)
+                self._wake.clear()
+                continue
+            self._execute(job)
+
+    def _claim(self):
+        now = datetime.now()
+        try:
+            job = self.store.claim_job(list(self._handlers), now, now + timedelta(seconds=LEASE_SECONDS))
+        except Exception:
+            logger.exception("Claiming a job failed")
+            return None
+        if job is not None:
+            self.stats["claimed"] += 1
+        return job
+
+    def _execute(self, job):
+        def progress(done, total=None):
+            self.store.update_job(job["_id"], {
+                "progress": {"done": done, "total": total},
+                "lease_until": datetime.now() + timedelta(seconds=LEASE_SECONDS),
+            })
+
+        try:
+            result = self._handlers[job["type"]](job, progress)
+        except Exception as e:
+            logger.exception("Job %s (%s) failed on attempt %d", job["_id"], job["type"], job["attempts"])
+            if job["attempts"] < job["max_attempts"]:
+                delay = RETRY_DELAY_SECONDS * 2 ** (job["attempts"] - 1)
+                self.store.update_job(job["_id"], {
+                    "status": "queued",
+                    "error": str(e),
+                    "run_after": datetime.now() + timedelta(seconds=delay),
+                    "lease_until": None,
+                })
+                self.stats["retried"] += 1
+            else:
+                self.store.update_job(job["_id"], {
+                    "status": "failed",
+                    "error": str(e),
+                    "finished_at": datetime.now(),
+                    "lease_until": None,
+                })
+                self.stats["failed"] += 1
+            return
+
+        self.store.update_job(job["_id"], {
+            "status": "done",
+            "result": result,
+            "error": None,
+            "finished_at": datetime.now(),
+            "lease_until": None,
+        })
+        self.stats["succeeded"] += 1
@@ -0,0 +1,108 @@
+import logging
+import os
+from collections import OrderedDict
+from threading import Lock
+
+logger = logging.getLogger(__name__)
+
+MEMBER_CACHE_SIZE = int(os.environ.get('GYM_MEMBER_CACHE_SIZE', 1024))
+# local: invalidated by this process's writes only (single process)
+# version: every hit is checked against the stored updated_at (multi-process)
+# changestream: invalidated by a MongoDB change stream (multi-process, replica set)
+MEMBER_CACHE_MODE = os.environ.get('GYM_MEMBER_CACHE_MODE', 'local')
+
+
+class MemberCache:
+    """Bounded LRU cache of member documents keyed by _id.
+
+    Documents are shared with the callers and must be treated as read-only.
+    If version_loader is set, a hit is only served when the cached
+    updated_at still matches the stored one. A document loaded on a miss is
+    only stored if the member was not invalidated while it was loading.
+    """
+
+    def __init__(self, capacity=MEMBER_CACHE_SIZE, version_loader=None):
+        self.capacity = capacity
+        self.version_loader = version_loader
+        self._entries = OrderedDict()
+        # member_id -> generation of the load in flight; invalidate() drops it
+        self._loading = {}
+        self._generation = 0
+        self._lock = Lock()
+        self.stats = {"hits": 0, "misses": 0, "stale": 0, "evictions": 0, "invalidations": 0}
+
+    def get(self, branch_id, member_id, loader):
+        with self._lock:
+            member = self._entries.get(member_id)
+            if member is not None:
+                self._entries.move_to_end(member_id)
+
+        if member is not None and member.get("branch_id") == branch_id:
+            if (self.version_loader is None
+                    or self.version_loader(branch_id, member_id) == member.get("updated_at")):
+                self.stats["hits"] += 1
+                return member
+            self.stats["stale"] += 1
+
+        self.stats["misses"] += 1
+        with self._lock:
+            self._generation += 1
+            generation = self._loading[member_id] = self._generation
+        member = None
+        try:
+            member = loader()
+        finally:
+            with self._lock:
+                if self._loading.get(member_id) == generation:
+                    del self._loading[member_id]
+                    if member is not None:
+                        self._store(member)
+        return member
+
+    def put(self, member):
+        with self._lock:
+            self._store(member)
+
+    def _store(self, member):
+        self._entries[member["_id"]] = member
+        self._entries.move_to_end(member["_id"])
+        while len(self._entries) > self.capacity:
+            self._entries.popitem(last=False)
+            self.stats["evictions"] += 1
+
+    def invalidate(self, member_id):
+        with self._lock:
+            self._loading.pop(member_id, None)
+            if self._entries.pop(member_id, None) is not None:
+                self.stats["invalidations"] += 1
+
+    def clear(self):
+        with self._lock:
+            self.stats["invalidations"] += len(self._entries)
+            self._entries.clear()
+            self._loading.clear()
+
+    def snapshot(self):
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return dict(
+            self.stats,
+            size=len(self._entries),
+            capacity=self.capacity,
+            hit_ratio=self.stats["hits"] / lookups if lookups else 0.0,
+        )
+
+
+def attach_invalidation(cache, storage, mode=MEMBER_CACHE_MODE):
+    """Keep the cache coherent with writes made by other processes."""
+    def use_version_check():
+        logger.warning("Member cache falling back to updated_at version checks")
+        cache.clear()
+        cache.version_loader = storage.get_member_version
+
+    if mode == 'version':
+        cache.version_loader = storage.get_member_version
+    elif mode == 'changestream':
+        if not storage.watch_members(cache.invalidate, on_error=use_version_check):
+            use_version_check()
+    elif mode != 'local':
+        raise ValueError(f"Unknown member cache mode: {mode}")
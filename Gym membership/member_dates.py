@@ -0,0 +1,51 @@
+"""Ready-to-print date fields for member lists and detail pages.
+
+Templates used to do the date arithmetic and strftime() for every row in
+Jinja. The routes now pass members through annotate_members() once, and the
+templates only print member.dates.*.
+"""
+from datetime import datetime
+
+DATE_FORMAT = '%Y-%m-%d'
+
+
+def annotate_members(members, now=None):
+    """Return shallow copies of members with a "dates" dict of derived fields.
+
+    Copies are returned because cached member documents are shared and must
+    not be modified. Formatted dates are memoized per calendar day, since most
+    members share a handful of start and expiry dates.
+    """
+    now = now or datetime.now()
+    formatted = {}
+
+    def fmt(value):
+        if value is None:
+            return ''
+        day = value.date() if isinstance(value, datetime) else value
+        text = formatted.get(day)
+        if text is None:
+            text = formatted[day] = day.strftime(DATE_FORMAT)
+        return text
+
+    rows = []
+    for member in members:
+        subscription = member.get("subscription") or {}
+        expiry = subscription.get("expiry_date")
+        created = member.get("created_at")
+        active = expiry is not None and expiry > now
+        rows.append(dict(member, dates={
+            "start": fmt(subscription.get("start_date")),
+            "expiry": fmt(expiry),
+            "created": fmt(created),
+            "active": active,
+            # Same floor semantics as the old (a - b).days template expressions
+            "days_remaining": (expiry - now).days if expiry is not None else None,
+            "days_expired": (now - expiry).days if expiry is not None else None,
+            "tenure_days": (now - created).days if created is not None else None,
+        }))
+    return rows
+
+
+def annotate_member(member, now=None):
+    return annotate_members([member], now)[0]
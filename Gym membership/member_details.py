@@ -0,0 +1,181 @@
+"""Cold member data kept out of the members collection.
+
+Every dashboard page, sort, sweep and report reads member documents, so a
+member holds only small, fixed-size fields: name, age, contact, email, the
+current subscription and timestamps. Data that only the member page shows
+lives in side collections keyed by member_id:
+
+- member_profiles: one document per member with address, emergency_contact
+  and health_notes, which are free text of any length.
+- payments: one document per payment. A renewal adds a document here
+  instead of growing an array inside the member.
+
+Only view_member and print_member load them. Members stored before the
+split still embed these fields (subscription.payments and the profile
+fields). A background migration moves them out, SPLIT_BATCH_SIZE members
+at a time in _id order. Each payment gets a payment_id, and a payment whose
+payment_id is already recorded is skipped, so a batch that stopped halfway
+can be run again.
+
+The size report measures the BSON size of every member as stored and as it
+would be after the split:
+
+    python member_details.py            # report only
+    python member_details.py --apply    # move the fields, then report again
+"""
+import argparse
+import logging
+import sys
+import threading
+
+import bson
+
+logger = logging.getLogger(__name__)
+
+PROFILES_COLLECTION = 'member_profiles'
+PAYMENTS_COLLECTION = 'payments'
+PROFILE_FIELDS = ('address', 'emergency_contact', 'health_notes')
+SPLIT_BATCH_SIZE = 1000
+PAYMENTS_LIMIT = 50
+
+
+def payment_record(member_id, branch_id, payment, payment_id):
+    """The payments document for one payment of a member."""
+    record = dict(payment)
+    record.update(payment_id=payment_id, member_id=member_id, branch_id=branch_id)
+    return record
+
+
+def split_member(member):
+    """(member, profile, payments) with the cold fields taken out of member.
+
+    profile is None if the member had no profile fields. Embedded payments
+    get a payment_id from the member's _id and their position, so splitting
+    the same document twice gives the same payments.
+    """
+    hot = {field: value for field, value in member.items() if field not in PROFILE_FIELDS}
+    profile = {field: member[field] for field in PROFILE_FIELDS if field in member}
+    payments = []
+    subscription = member.get("subscription")
+    if subscription and "payments" in subscription:
+        hot["subscription"] = {field: value for field, value in subscription.items() if field != "payments"}
+        payments = [payment_record(member["_id"], member.get("branch_id"), payment, f"{member['_id']}:{position}")
+                    for position, payment in enumerate(subscription["payments"] or [])]
+    return hot, profile or None, payments
+
+
+def document_size(document):
+    """Size of a document in bytes as MongoDB stores it (BSON)."""
+    return len(bson.encode(document))
+
+
+def split_members(storage, batch_size=SPLIT_BATCH_SIZE, on_batch=None):
+    """Move the cold fields of every member that still embeds them.
+
+    Each batch stores the profiles and payments first and then removes the
+    fields from the members, so an interrupted run leaves nothing behind
+    that the next run does not pick up. on_batch is called with the _ids
+    changed in each batch. Returns the number of members changed.
+    """
+    after, moved = None, 0
+    while True:
+        members = storage.members_with_cold_fields(after, batch_size)
+        if not members:
+            return moved
+
+        moves = []
+        for member in members:
+            _, profile, payments = split_member(member)
+            moves.append((member["_id"], member.get("branch_id"), profile, payments))
+        moved += storage.move_cold_fields(moves)
+        if on_batch is not None:
+            on_batch([member["_id"] for member in members])
+        after = members[-1]["_id"]
+
+
+def split_in_background(storage, on_batch=None):
+    def run():
+        try:
+            moved = split_members(storage, on_batch=on_batch)
+            if moved:
+                logger.info("Moved profile fields and payments of %d members to side collections", moved)
+        except Exception:
+            logger.exception("Member split failed")
+
+    thread = threading.Thread(target=run, name='member-split', daemon=True)
+    thread.start()
+    return thread
+
+
+def _sizes(members, total):
+    return {
+        "avg_document_bytes": round(total / members) if members else 0,
+        "working_set_bytes": total,
+    }
+
+
+def size_report(storage, batch_size=SPLIT_BATCH_SIZE):
+    """Member document sizes as stored and as they would be after the split.
+
+    Walks every branch's members by (name, _id) on the primary. The working
+    set estimate is the bytes of all member documents, which every list,
+    sort and sweep touches; the side collections are read one member at a
+    time and are reported separately as cold_bytes. Index sizes do not
+    change with the split and are left out.
+    """
+    members = stored = hot = cold = 0
+    for branch_id in storage.list_branches():
+        after = None
+        while True:
+            page = storage.list_members(branch_id, after=after, limit=batch_size, primary=True)
+            if not page:
+                break
+            for member in page:
+                member_part, profile, payments = split_member(member)
+                members += 1
+                stored += document_size(member)
+                hot += document_size(member_part)
+                cold += sum(document_size(document) for document in payments + ([profile] if profile else []))
+            after = (page[-1].get("name"), page[-1]["_id"])
+    return {
+        "members": members,
+        "stored": _sizes(members, stored),
+        "split": dict(_sizes(members, hot), cold_bytes=cold),
+    }
+
+
+def _print_sizes(title, sizes):
+    print(f"{title:24} {sizes['avg_document_bytes']:>8,} bytes per member   "
+          f"{sizes['working_set_bytes'] / 1e6:>10.2f} MB working set")
+
+
+def main():
+    from storage import create_storage
+
+    parser = argparse.ArgumentParser(description="Report member document sizes and move cold fields out")
+    parser.add_argument('--apply', action='store_true', help='move profile fields and payments out')
+    parser.add_argument('--batch-size', type=int, default=SPLIT_BATCH_SIZE)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    storage = create_storage()
+    storage.ensure_indexes()
+    before = size_report(storage, args.batch_size)
+    print(f"{before['members']} members")
+    _print_sizes("Before", before["stored"])
+    if not args.apply:
+        _print_sizes("After (projected)", before["split"])
+        if before["split"]["cold_bytes"]:
+            print(f"{before['split']['cold_bytes'] / 1e6:.2f} MB would move to side collections; "
+                  f"run with --apply to move it")
+        return 0
+
+    moved = split_members(storage, args.batch_size)
+    after = size_report(storage, args.batch_size)
+    _print_sizes("After", after["stored"])
+    print(f"Moved the profile fields and payments of {moved} members")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,648 @@
+from bisect import bisect_left, bisect_right, insort
+from heapq import nsmallest
+from datetime import datetime
+from functools import total_ordering
+from threading import RLock
+
+from bson.objectid import ObjectId
+
+from dedupe import normalize_contact
+from member_details import PROFILE_FIELDS
+from storage import DuplicateMemberError, PlanVersionExistsError, Storage, clone, project
+
+
+@total_ordering
+class _Top:
+    """Sorts after every other value; used as an open upper bound in index keys."""
+
+    def __eq__(self, other):
+        return isinstance(other, _Top)
+
+    def __gt__(self, other):
+        return not isinstance(other, _Top)
+
+    def __hash__(self):
+        return 0
+
+TOP = _Top()
+
+
+class SortedIndex:
+    """Secondary index kept as a sorted list of key tuples ending in _id."""
+
+    def __init__(self, key):
+        self.key = key
+        self._keys = []
+
+    def add(self, document):
+        insort(self._keys, self.key(document))
+
+    def remove(self, document):
+        key = self.key(document)
+        position = bisect_left(self._keys, key)
+        if position < len(self._keys) and self._keys[position] == key:
+            del self._keys[position]
+
+    def scan(self, low, high, exclusive_low=False, limit=None):
+        """_id values of the keys between low and high, in index order."""
+        start = bisect_right(self._keys, low) if exclusive_low else bisect_left(self._keys, low)
+        end = bisect_left(self._keys, high)
+        if limit is not None:
+            end = min(end, start + limit)
+        return [key[-1] for key in self._keys[start:end]]
+
+    def __len__(self):
+        return len(self._keys)
+
+
+def _branch(member):
+    return member.get("branch_id") or ''
+
+
+def _name(member):
+    return member.get("name") or ''
+
+
+def _subscription(member):
+    return member.get("subscription") or {}
+
+
+def _contact_key(member):
+    contact = member.get("contact_normalized")
+    return (_branch(member), contact) if isinstance(contact, str) else None
+
+
+class MemoryCheckinStore:
+    """In-process counterpart of checkins.CheckinStore."""
+
+    bucketed = False
+
+    def __init__(self):
+        self._events = {}  # branch_id -> [(ts, member_id)], sorted by ts
+        self._by_member = {}  # (branch_id, member_id) -> [ts]
+        self._lock = RLock()
+
+    def ensure_collection(self, bucketed=None):
+        pass
+
+    def record(self, branch_id, member_id, ts=None):
+        self.record_many([(branch_id, member_id, ts or datetime.now())])
+
+    def record_many(self, checkins):
+        with self._lock:
+            for branch_id, member_id, ts in checkins:
+                insort(self._events.setdefault(branch_id, []), (ts, member_id))
+                insort(self._by_member.setdefault((branch_id, member_id), []), ts)
+
+    def reassign(self, member_ids, new_member_id):
+        with self._lock:
+            member_ids = set(member_ids)
+            for branch_id, events in self._events.items():
+                self._events[branch_id] = sorted((ts, new_member_id if member_id in member_ids else member_id)
+                                                 for ts, member_id in events)
+            for branch_id, member_id in [key for key in self._by_member if key[1] in member_ids]:
+                for ts in self._by_member.pop((branch_id, member_id)):
+                    insort(self._by_member.setdefault((branch_id, new_member_id), []), ts)
+
+    def member_checkins(self, branch_id, member_id, limit=50):
+        with self._lock:
+            timestamps = self._by_member.get((branch_id, member_id), [])[-limit:]
+        return [{"ts": ts} for ts in reversed(timestamps)]
+
+    def hourly_occupancy(self, branch_id, start, end):
+        with self._lock:
+            events = self._events.get(branch_id, [])
+            events = events[bisect_left(events, (start,)):bisect_left(events, (end,))]
+
+        hours = {}
+        for ts, member_id in events:
+            hour = ts.replace(minute=0, second=0, microsecond=0)
+            hours.setdefault(hour, []).append(member_id)
+        return [
+            {"hour": hour, "checkins": len(members), "unique_members": len(set(members))}
+            for hour, members in sorted(hours.items())
+        ]
+
+
+class MemoryStorage(Storage):
+    """Everything held in process memory, for tests, benchmarks and demos.
+
+    Members are kept in a dict by _id plus sorted secondary indexes on name,
+    subscription.expiry_date and subscription.plan_id (each led by branch_id
+    like the MongoDB indexes), so listing pages are range scans rather than
+    full sorts. A dict on (branch_id, contact_normalized) plays the unique
+    index. Returned documents are copies; nothing is persisted.
+    """
+
+    def __init__(self):
+        self._lock = RLock()
+        self._members = {}
+        self._plans = {}
+        self._admins = {}
+        self._audit = {}
+        self._audit_change_ids = set()
+        self._periods = {}  # member_id -> periods in insertion order
+        self._change_ids = set()
+        self._profiles = {}  # member_id -> profile
+        self._payments = {}  # member_id -> payments in insertion order
+        self._payment_ids = set()
+        self._notifications = {}  # key -> ledger entry
+        self._card_revocations = {}  # member_id -> revocation
+        self._jobs = {}
+        self._leases = {}
+        # Missing values get a sortable stand-in so mixed documents never
+        # compare None against a str, datetime or int
+        self._by_name = SortedIndex(lambda m: (_branch(m), _name(m), m["_id"]))
+        self._by_expiry = SortedIndex(lambda m: (
+            _branch(m), _subscription(m).get("expiry_date") or datetime.max, m["_id"]
+        ))
+        self._by_plan = SortedIndex(lambda m: (
+            _branch(m), _subscription(m).get("plan_id") or 0, _name(m), m["_id"]
+        ))
+        self._indexes = (self._by_name, self._by_expiry, self._by_plan)
+        self._by_contact = {}
+        self.checkins = MemoryCheckinStore()
+
+    def ensure_indexes(self):
+        pass
+
+    def ping(self):
+        pass
+
+    def count_plans(self):
+        return len(self._plans)
+
+    def insert_plans(self, plans):
+        with self._lock:
+            for plan in plans:
+                plan.setdefault("_id", ObjectId())
+                self._plans[(plan["plan_id"], plan.get("version", 1))] = clone(plan)
+
+    def list_plans(self):
+        with self._lock:
+            return [clone(plan) for _, plan in sorted(self._plans.items())]
+
+    def get_plan(self, plan_id):
+        with self._lock:
+            versions = [key for key in self._plans if key[0] == plan_id]
+            return clone(self._plans[max(versions)]) if versions else None
+
+    def insert_plan_version(self, plan):
+        with self._lock:
+            key = (plan["plan_id"], plan["version"])
+            if key in self._plans:
+                raise PlanVersionExistsError(*key)
+            plan.setdefault("_id", ObjectId())
+            self._plans[key] = clone(plan)
+
+    def count_admins(self):
+        return len(self._admins)
+
+    def insert_admin(self, admin):
+        with self._lock:
+            admin.setdefault("_id", ObjectId())
+            self._admins[admin["username"]] = clone(admin)
+
+    def find_admin(self, username):
+        admin = self._admins.get(username)
+        return clone(admin) if admin else None
+
+    def record_logins(self, logins):
+        with self._lock:
+            for username, ts in logins:
+                if username in self._admins:
+                    self._admins[username]["last_login"] = ts
+
+    def count_members(self):
+        return len(self._members)
+
+    def insert_members(self, members):
+        with self._lock:
+            for member in members:
+                self.insert_member(member)
+
+    def assign_default_branch(self, branch_id):
+        with self._lock:
+            for member in list(self._members.values()):
+                if "branch_id" not in member:
+                    self._unindex(member)
+                    member["branch_id"] = branch_id
+                    self._index(member)
+            for admin in self._admins.values():
+                admin.setdefault("branch_id", branch_id)
+
+    def _index(self, member):
+        for index in self._indexes:
+            index.add(member)
+        key = _contact_key(member)
+        if key is not None:
+            self._by_contact[key] = member["_id"]
+
+    def _unindex(self, member):
+        for index in self._indexes:
+            index.remove(member)
+        key = _contact_key(member)
+        if key is not None and self._by_contact.get(key) == member["_id"]:
+            del self._by_contact[key]
+
+    def insert_member(self, member):
+        with self._lock:
+            key = _contact_key(member)
+            if key is not None and key in self._by_contact:
+                raise DuplicateMemberError(self._by_contact[key])
+            member.setdefault("_id", ObjectId())
+            stored = clone(member)
+            self._members[stored["_id"]] = stored
+            self._index(stored)
+            return stored["_id"]
+
+    def list_members(self, branch_id, plan_id=None, after=None, limit=None, fields=None, primary=False):
+        with self._lock:
+            if plan_id is None:
+                index, prefix = self._by_name, (branch_id,)
+            else:
+                index, prefix = self._by_plan, (branch_id, plan_id)
+
+            if after is not None:
+                last_name, last_id = after
+                ids = index.scan(prefix + (last_name or '', last_id), prefix + (TOP,),
+                                 exclusive_low=True, limit=limit)
+            else:
+                ids = index.scan(prefix, prefix + (TOP,), limit=limit)
+            return [project(self._members[member_id], fields) for member_id in ids]
+
+    def get_members(self, branch_id, member_ids):
+        with self._lock:
+            members = (self._members.get(member_id) for member_id in member_ids)
+            return [clone(member) for member in members
+                    if member is not None and member.get("branch_id") == branch_id]
+
+    def expired_members(self, branch_id, now, primary=False):
+        with self._lock:
+            ids = self._by_expiry.scan((branch_id,), (branch_id, now))
+            return [clone(self._members[member_id]) for member_id in ids]
+
+    def member_snapshot(self, branch_id, batch_size):
+        with self._lock:
+            rows = []
+            for member_id in self._by_name.scan((branch_id,), (branch_id, TOP)):
+                member = self._members[member_id]
+                subscription = member.get("subscription") or {}
+                rows.append((subscription.get("plan_id"), subscription.get("start_date"),
+                             subscription.get("expiry_date"), member.get("created_at")))
+        for start in range(0, len(rows), batch_size):
+            yield rows[start:start + batch_size]
+
+    def get_member(self, branch_id, member_id, fields=None):
+        with self._lock:
+            member = self._members.get(member_id)
+            if member is None or member.get("branch_id") != branch_id:
+                return None
+            return project(member, fields)
+
+    def get_member_expiry(self, branch_id, member_id):
+        member = self._members.get(member_id)
+        if member is None or member.get("branch_id") != branch_id:
+            return None
+        return _subscription(member).get("expiry_date")
+
+    def get_member_version(self, branch_id, member_id):
+        member = self._members.get(member_id)
+        if member is None or member.get("branch_id") != branch_id:
+            return None
+        return member.get("updated_at")
+
+    def change_subscriptions(self, branch_id, changes, updated_at):
+        changed = []
+        with self._lock:
+            for member_id, plan_id, expiry_date, subscription in changes:
+                member = self._members.get(member_id)
+                if (member is None or member.get("branch_id") != branch_id
+                        or _subscription(member).get("plan_id") != plan_id
+                        or _subscription(member).get("expiry_date") != expiry_date):
+                    continue
+                self._unindex(member)
+                member.setdefault("subscription", {}).update(clone(subscription))
+                member["updated_at"] = updated_at
+                self._index(member)
+                changed.append(member_id)
+        return changed
+
+    def update_subscription(self, branch_id, member_id, subscription, updated_at):
+        with self._lock:
+            member = self._members.get(member_id)
+            if member is None or member.get("branch_id") != branch_id:
+                return None
+
+            before = {"_id": member_id, "subscription": clone(_subscription(member))}
+            self._unindex(member)
+            member.setdefault("subscription", {}).update(clone(subscription))
+            member["updated_at"] = updated_at
+            self._index(member)
+            return before
+
+    def delete_member(self, branch_id, member_id):
+        with self._lock:
+            member = self._members.get(member_id)
+            if member is None or member.get("branch_id") != branch_id:
+                return None
+            self._unindex(member)
+            self._profiles.pop(member_id, None)
+            for payment in self._payments.pop(member_id, []):
+                self._payment_ids.discard(payment["payment_id"])
+            return self._members.pop(member_id)
+
+    def delete_members(self, branch_id, member_ids):
+        with self._lock:
+            return sum(1 for member_id in member_ids
+                       if self.delete_member(branch_id, member_id) is not None)
+
+    def list_branches(self):
+        with self._lock:
+            return sorted({member.get("branch_id") for member in self._members.values()}, key=str)
+
+    def members_expiring_between(self, branch_id, low, high, after, limit):
+        with self._lock:
+            if after is not None:
+                start, exclusive = (branch_id,) + tuple(after), True
+            else:
+                start, exclusive = (branch_id, low, TOP) if low is not None else (branch_id,), False
+            ids = self._by_expiry.scan(start, (branch_id, high, TOP), exclusive_low=exclusive, limit=limit)
+            rows = []
+            for member_id in ids:
+                subscription = _subscription(self._members[member_id])
+                rows.append((subscription.get("expiry_date"), member_id, subscription.get("status")))
+            return rows
+
+    def mark_expired(self, branch_id, member_ids, updated_at):
+        updated = 0
+        with self._lock:
+            for member_id in member_ids:
+                member = self._members.get(member_id)
+                if member is None or member.get("branch_id") != branch_id:
+                    continue
+                subscription = member.setdefault("subscription", {})
+                # status is not an index key, so no reindexing
+                if subscription.get("status") != "expired":
+                    subscription["status"] = "expired"
+                    member["updated_at"] = updated_at
+                    updated += 1
+        return updated
+
+    def members_without_plan_fields(self, after, limit):
+        with self._lock:
+            ids = nsmallest(limit, (member_id for member_id, member in self._members.items()
+                                    if "plan_name" not in _subscription(member)
+                                    and (after is None or member_id > after)))
+            return [(member_id, _subscription(self._members[member_id]).get("plan_id")) for member_id in ids]
+
+    def set_plan_fields(self, updates):
+        updated = 0
+        with self._lock:
+            for member_id, plan_id, fields in updates:
+                subscription = _subscription(self._members.get(member_id, {}))
+                # plan_id and plan_name are not index keys, so no reindexing
+                if subscription.get("plan_id") == plan_id and "plan_name" not in subscription:
+                    subscription.update(clone(fields))
+                    updated += 1
+        return updated
+
+    def members_without_normalized_fields(self, after, limit):
+        with self._lock:
+            ids = nsmallest(limit, (member_id for member_id, member in self._members.items()
+                                    if "contact_normalized" not in member
+                                    and (after is None or member_id > after)))
+            return [(member_id, self._members[member_id].get("contact"), self._members[member_id].get("email"))
+                    for member_id in ids]
+
+    def set_normalized_fields(self, updates):
+        updated = 0
+        with self._lock:
+            for member_id, fields in updates:
+                member = self._members.get(member_id)
+                if member is None or "contact_normalized" in member:
+                    continue
+                key = _contact_key(dict(member, **fields))
+                if key is not None and key in self._by_contact:
+                    continue
+                member.update(fields)
+                if key is not None:
+                    self._by_contact[key] = member_id
+                updated += 1
+        return updated
+
+    def duplicate_contact_groups(self):
+        with self._lock:
+            groups = {}
+            for member_id, member in sorted(self._members.items()):
+                contact = normalize_contact(member.get("contact"))
+                if contact is not None:
+                    groups.setdefault((member.get("branch_id"), contact), []).append(member_id)
+        for (branch_id, contact), member_ids in groups.items():
+            if len(member_ids) > 1:
+                yield branch_id, contact, member_ids
+
+    def merge_members(self, branch_id, merged, duplicate_ids):
+        with self._lock:
+            for member_id in duplicate_ids:
+                if (self._members.get(member_id) or {}).get("branch_id") != branch_id:
+                    continue
+                for payment in self._payments.pop(member_id, []):
+                    payment["member_id"] = merged["_id"]
+                    self._payments.setdefault(merged["_id"], []).append(payment)
+            deleted = self.delete_members(branch_id, duplicate_ids)
+            self.checkins.reassign(duplicate_ids, merged["_id"])
+            member = self._members.get(merged["_id"])
+            if member is not None and member.get("branch_id") == branch_id:
+                self._unindex(member)
+                stored = clone(merged)
+                self._members[stored["_id"]] = stored
+                self._index(stored)
+            return deleted
+
+    def insert_job(self, job):
+        with self._lock:
+            key = job.get("idempotency_key")
+            if key is not None:
+                for existing in self._jobs.values():
+                    if existing.get("idempotency_key") == key:
+                        return clone(existing)
+            job.setdefault("_id", ObjectId())
+            self._jobs[job["_id"]] = clone(job)
+            return job
+
+    def claim_job(self, types, now, lease_until):
+        with self._lock:
+            runnable = [job for job in self._jobs.values() if job["type"] in types and (
+                (job["status"] == "queued" and job["run_after"] <= now)
+                or (job["status"] == "running" and job["lease_until"] < now))]
+            if not runnable:
+                return None
+            job = min(runnable, key=lambda job: job["run_after"])
+            job.update(status="running", started_at=now, lease_until=lease_until, attempts=job["attempts"] + 1)
+            return clone(job)
+
+    def update_job(self, job_id, changes):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.update(clone(changes))
+            return clone(job)
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return clone(job) if job is not None else None
+
+    def list_jobs(self, branch_id, limit):
+        with self._lock:
+            jobs = [job for job in self._jobs.values() if job.get("branch_id") == branch_id]
+            jobs.sort(key=lambda job: job["created_at"], reverse=True)
+            return [clone(job) for job in jobs[:limit]]
+
+    def acquire_lease(self, name, owner, now, until):
+        with self._lock:
+            lease = self._leases.setdefault(name, {"_id": name, "owner": None, "until": None, "state": None})
+            if lease["owner"] != owner and lease["until"] is not None and lease["until"] >= now:
+                return None
+            lease.update(owner=owner, until=until)
+            return clone(lease)
+
+    def release_lease(self, name, owner, state):
+        with self._lock:
+            lease = self._leases.get(name)
+            if lease is not None and lease["owner"] == owner:
+                lease.update(state=clone(state), until=None)
+
+    def insert_audit_entries(self, entries):
+        with self._lock:
+            for entry in entries:
+                if "change_id" in entry:
+                    if entry["change_id"] in self._audit_change_ids:
+                        continue
+                    self._audit_change_ids.add(entry["change_id"])
+                self._audit.setdefault(entry["member_id"], []).append(clone(entry))
+
+    def member_history(self, branch_id, member_id, limit):
+        with self._lock:
+            entries = [entry for entry in self._audit.get(member_id, [])
+                       if entry.get("branch_id") == branch_id]
+        entries.sort(key=lambda entry: entry["ts"], reverse=True)
+        return [clone(entry) for entry in entries[:limit]]
+
+    def insert_subscription_periods(self, periods):
+        with self._lock:
+            for period in periods:
+                if period["change_id"] in self._change_ids:
+                    continue
+                period.setdefault("_id", ObjectId())
+                self._change_ids.add(period["change_id"])
+                self._periods.setdefault(period["member_id"], []).append(clone(period))
+
+    def subscription_periods(self, branch_id, member_id, limit):
+        with self._lock:
+            periods = [period for period in self._periods.get(member_id, [])
+                       if period.get("branch_id") == branch_id]
+        periods.sort(key=lambda period: period["created_at"], reverse=True)
+        return [clone(period) for period in periods[:limit]]
+
+    def delete_subscription_periods(self, change_ids):
+        change_ids = set(change_ids)
+        with self._lock:
+            self._change_ids -= change_ids
+            for member_id, periods in self._periods.items():
+                self._periods[member_id] = [period for period in periods if period["change_id"] not in change_ids]
+
+    def members_with_cold_fields(self, after, limit):
+        with self._lock:
+            ids = nsmallest(limit, (member_id for member_id, member in self._members.items()
+                                    if (any(field in member for field in PROFILE_FIELDS)
+                                        or "payments" in _subscription(member))
+                                    and (after is None or member_id > after)))
+            return [clone(self._members[member_id]) for member_id in ids]
+
+    def move_cold_fields(self, moves):
+        changed = 0
+        with self._lock:
+            for member_id, branch_id, profile, payments in moves:
+                if profile:
+                    stored = self._profiles.setdefault(member_id, {"_id": ObjectId(), "member_id": member_id})
+                    stored.update(clone(profile), branch_id=branch_id)
+                self.insert_payments(payments)
+                member = self._members.get(member_id)
+                if member is None:
+                    continue
+                # None of these are index keys, so no reindexing
+                removed = [member.pop(field) for field in PROFILE_FIELDS if field in member]
+                if "payments" in _subscription(member):
+                    removed.append(member["subscription"].pop("payments"))
+                if removed:
+                    changed += 1
+        return changed
+
+    def get_member_profile(self, branch_id, member_id):
+        with self._lock:
+            profile = self._profiles.get(member_id)
+            if profile is None or profile.get("branch_id") != branch_id:
+                return None
+            return clone(profile)
+
+    def insert_payments(self, payments):
+        with self._lock:
+            for payment in payments:
+                if payment["payment_id"] in self._payment_ids:
+                    continue
+                payment.setdefault("_id", ObjectId())
+                self._payment_ids.add(payment["payment_id"])
+                self._payments.setdefault(payment["member_id"], []).append(clone(payment))
+
+    def member_payments(self, branch_id, member_id, limit):
+        with self._lock:
+            payments = [payment for payment in self._payments.get(member_id, [])
+                        if payment.get("branch_id") == branch_id]
+        payments.sort(key=lambda payment: payment.get("date") or datetime.min, reverse=True)
+        return [clone(payment) for payment in payments[:limit]]
+
+    def claim_notifications(self, entries):
+        claimed = []
+        with self._lock:
+            for entry in entries:
+                if entry["key"] in self._notifications:
+                    continue
+                entry.setdefault("_id", ObjectId())
+                self._notifications[entry["key"]] = clone(entry)
+                claimed.append(entry["key"])
+        return claimed
+
+    def mark_notifications_sent(self, keys, sent_at):
+        with self._lock:
+            for key in keys:
+                if key in self._notifications:
+                    self._notifications[key].update(status="sent", sent_at=sent_at)
+
+    def release_notifications(self, keys):
+        with self._lock:
+            for key in keys:
+                self._notifications.pop(key, None)
+
+    def revoke_cards(self, member_id, branch_id, revoked_before, expires_at, reason, updated_at):
+        with self._lock:
+            revocation = self._card_revocations.setdefault(
+                member_id, {"_id": ObjectId(), "member_id": member_id,
+                            "revoked_before": revoked_before, "expires_at": expires_at})
+            revocation.update(revoked_before=max(revocation["revoked_before"], revoked_before),
+                              expires_at=max(revocation["expires_at"], expires_at),
+                              branch_id=branch_id, reason=reason, updated_at=updated_at)
+
+    def card_revocations(self, since):
+        with self._lock:
+            revocations = [clone(revocation) for revocation in self._card_revocations.values()
+                           if since is None or revocation["updated_at"] >= since]
+        return sorted(revocations, key=lambda revocation: revocation["updated_at"])
+
+    def recent_notifications(self, branch_id, limit):
+        with self._lock:
+            entries = [entry for entry in self._notifications.values() if entry.get("branch_id") == branch_id]
+        entries.sort(key=lambda entry: entry["created_at"], reverse=True)
+        return [clone(entry) for entry in entries[:limit]]
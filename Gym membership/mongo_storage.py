@@ -0,0 +1,586 @@
+import base64
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+import bson
+from bson.raw_bson import RawBSONDocument
+from bson.timestamp import Timestamp
+from pymongo import MongoClient, ASCENDING, DESCENDING, UpdateOne, ReturnDocument
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
+from pymongo.read_preferences import (Nearest, PrimaryPreferred, ReadPreference, Secondary,
+                                      SecondaryPreferred)
+
+from audit import AUDIT_COLLECTION
+from cards import CARD_REVOCATIONS_COLLECTION
+from checkins import CheckinStore
+from indexes import EXPLAIN_QUERIES, QueryAdvisor, reconcile_in_background
+from member_details import PAYMENTS_COLLECTION, PROFILE_FIELDS, PROFILES_COLLECTION
+from notifications import NOTIFICATIONS_COLLECTION
+from profiling import timed_cursor
+from proration import PERIODS_COLLECTION
+from storage import DuplicateMemberError, PlanVersionExistsError, Storage
+
+logger = logging.getLogger(__name__)
+
+
+def projection_for(fields):
+    return {field: 1 for field in fields} if fields is not None else None
+
+
+READ_PREFERENCES = {
+    'primaryPreferred': PrimaryPreferred,
+    'secondary': Secondary,
+    'secondaryPreferred': SecondaryPreferred,
+    'nearest': Nearest,
+}
+
+
+def read_preference_for(name, max_staleness=-1):
+    """pymongo read preference for a mode name; max_staleness -1 means no bound."""
+    if name == 'primary':
+        return ReadPreference.PRIMARY
+    if name not in READ_PREFERENCES:
+        raise ValueError(f"Unknown read preference: {name}")
+    return READ_PREFERENCES[name](max_staleness=max_staleness)
+
+
+def causal_token(session):
+    """What a later session needs to read after this one's operations."""
+    if session.operation_time is None:
+        # Standalone servers report no operation time; reads are always current there
+        return None
+    cluster_time = session.cluster_time
+    return {
+        "cluster_time": base64.b64encode(bson.encode(cluster_time)).decode() if cluster_time else None,
+        "operation_time": [session.operation_time.time, session.operation_time.inc],
+    }
+
+
+class MongoStorage(Storage):
+    """MongoDB backend.
+
+    Writes and single-member reads go to the primary. Lists, reports and
+    analytics (list_members, expired_members, member_snapshot, occupancy)
+    go through report_db, which uses read_preference with a max-staleness
+    bound, so a replica set can serve them from its secondaries. Inside
+    causal_session() every operation runs in that session, so a page read
+    after a write sees the write even if a secondary answers.
+    """
+
+    def __init__(self, uri, database='GymDB', read_preference='primary', max_staleness=-1,
+                 **client_options):
+        self.client = MongoClient(uri, **client_options)
+        self.db = self.client[database]
+        self.report_db = self.client.get_database(
+            database, read_preference=read_preference_for(read_preference, max_staleness))
+        self.report_members = self.report_db['members']
+        self._local = threading.local()
+        self.members = self.db['members']
+        self.subscriptions = self.db['subscriptions']
+        self.admins = self.db['admin']
+        self.audit = self.db[AUDIT_COLLECTION]
+        self.periods = self.db[PERIODS_COLLECTION]
+        self.profiles = self.db[PROFILES_COLLECTION]
+        self.payments = self.db[PAYMENTS_COLLECTION]
+        self.notifications = self.db[NOTIFICATIONS_COLLECTION]
+        self.card_revocations_collection = self.db[CARD_REVOCATIONS_COLLECTION]
+        self.jobs = self.db['jobs']
+        self.leases = self.db['leases']
+        self.checkins = CheckinStore(self.db, report_db=self.report_db)
+        self.advisor = QueryAdvisor() if EXPLAIN_QUERIES else None
+
+    def ensure_indexes(self):
+        # Plans stored before versioning become version 1
+        self.subscriptions.update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+        # Declared in indexes.py; missing ones are built without blocking startup
+        self.checkins.ensure_collection()
+        reconcile_in_background(self.db)
+
+    def ping(self):
+        self.db.command('ping')
+
+    def open_connections(self):
+        # The driver keeps minPoolSize connections open but fills the pool in the
+        # background; pings started together make it open them now
+        count = self.client.options.pool_options.min_pool_size
+        if count:
+            barrier = threading.Barrier(count)
+
+            def ping():
+                barrier.wait()
+                self.db.command('ping')
+
+            with ThreadPoolExecutor(max_workers=count, thread_name_prefix='warm-up') as pool:
+                for future in [pool.submit(ping) for _ in range(count)]:
+                    future.result()
+        # Reads routed to secondaries use those servers' pools
+        self.report_db.command('ping', read_preference=self.report_db.read_preference)
+        return count
+
+    def _session(self):
+        return getattr(self._local, 'session', None)
+
+    @contextmanager
+    def causal_session(self, after=None):
+        with self.client.start_session(causal_consistency=True) as session:
+            if after:
+                if after.get("cluster_time"):
+                    # Raw, so the signature goes back to the server byte for byte
+                    session.advance_cluster_time(RawBSONDocument(base64.b64decode(after["cluster_time"])))
+                session.advance_operation_time(Timestamp(*after["operation_time"]))
+            previous = self._session()
+            self._local.session = session
+            try:
+                yield lambda: causal_token(session)
+            finally:
+                self._local.session = previous
+
+    def _find(self, shape, collection, query, projection=None, sort=None, limit=None):
+        cursor = collection.find(query, projection, session=self._session())
+        if sort:
+            cursor = cursor.sort(sort)
+        if limit:
+            cursor = cursor.limit(limit)
+        if self.advisor is not None:
+            self.advisor.check(shape, cursor.clone())
+        return timed_cursor(shape, cursor)
+
+    def _find_one(self, shape, collection, query, projection=None):
+        return next(self._find(shape, collection, query, projection, limit=1), None)
+
+    def insert_job(self, job):
+        try:
+            self.jobs.insert_one(job)
+        except DuplicateKeyError:
+            return self.jobs.find_one({"idempotency_key": job["idempotency_key"]})
+        return job
+
+    def claim_job(self, types, now, lease_until):
+        return self.jobs.find_one_and_update(
+            {"type": {"$in": types}, "$or": [
+                {"status": "queued", "run_after": {"$lte": now}},
+                {"status": "running", "lease_until": {"$lt": now}},
+            ]},
+            {"$set": {"status": "running", "started_at": now, "lease_until": lease_until},
+             "$inc": {"attempts": 1}},
+            sort=[("run_after", ASCENDING)],
+            return_document=ReturnDocument.AFTER
+        )
+
+    def update_job(self, job_id, changes):
+        return self.jobs.find_one_and_update({"_id": job_id}, {"$set": changes},
+                                             return_document=ReturnDocument.AFTER)
+
+    def get_job(self, job_id):
+        return self.jobs.find_one({"_id": job_id})
+
+    def list_jobs(self, branch_id, limit):
+        return list(self._find('list_jobs', self.jobs, {"branch_id": branch_id},
+                               sort=[("created_at", DESCENDING)], limit=limit))
+
+    def acquire_lease(self, name, owner, now, until):
+        try:
+            return self.leases.find_one_and_update(
+                {"_id": name, "$or": [{"until": None}, {"until": {"$lt": now}}, {"owner": owner}]},
+                {"$set": {"owner": owner, "until": until}},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # The lease exists and someone else holds it, so the upsert tried to insert
+            return None
+
+    def release_lease(self, name, owner, state):
+        self.leases.update_one({"_id": name, "owner": owner}, {"$set": {"state": state, "until": None}})
+
+    def query_plan_report(self):
+        return self.advisor.report() if self.advisor is not None else None
+
+    def count_plans(self):
+        return self.subscriptions.count_documents({})
+
+    def insert_plans(self, plans):
+        self.subscriptions.insert_many(plans)
+
+    def list_plans(self):
+        return list(self.subscriptions.find().sort([("plan_id", ASCENDING), ("version", ASCENDING)]))
+
+    def get_plan(self, plan_id):
+        return self.subscriptions.find_one({"plan_id": plan_id}, sort=[("version", DESCENDING)])
+
+    def insert_plan_version(self, plan):
+        try:
+            self.subscriptions.insert_one(plan)
+        except DuplicateKeyError:
+            raise PlanVersionExistsError(plan["plan_id"], plan["version"])
+
+    def count_admins(self):
+        return self.admins.count_documents({})
+
+    def insert_admin(self, admin):
+        self.admins.insert_one(admin)
+
+    def find_admin(self, username):
+        return self.admins.find_one({"username": username})
+
+    def record_logins(self, logins):
+        if logins:
+            self.admins.bulk_write([
+                UpdateOne({"username": username}, {"$set": {"last_login": ts}})
+                for username, ts in logins
+            ], ordered=False)
+
+    def count_members(self):
+        return self.members.count_documents({})
+
+    def insert_members(self, members):
+        self.members.insert_many(members)
+
+    def assign_default_branch(self, branch_id):
+        self.members.update_many({"branch_id": {"$exists": False}}, {"$set": {"branch_id": branch_id}})
+        self.admins.update_many({"branch_id": {"$exists": False}}, {"$set": {"branch_id": branch_id}})
+
+    def insert_member(self, member):
+        try:
+            return self.members.insert_one(member, session=self._session()).inserted_id
+        except DuplicateKeyError:
+            existing = self.members.find_one({"branch_id": member.get("branch_id"),
+                                              "contact_normalized": member.get("contact_normalized")}, {"_id": 1},
+                                             session=self._session())
+            if existing is None:
+                raise
+            raise DuplicateMemberError(existing["_id"])
+
+    def get_members(self, branch_id, member_ids):
+        return list(self._find('get_members', self.members,
+                               {"branch_id": branch_id, "_id": {"$in": list(member_ids)}}))
+
+    def list_members(self, branch_id, plan_id=None, after=None, limit=None, fields=None, primary=False):
+        query = {"branch_id": branch_id}
+        if plan_id is not None:
+            query["subscription.plan_id"] = plan_id
+        if after is not None:
+            last_name, last_id = after
+            query["$or"] = [
+                {"name": {"$gt": last_name}},
+                {"name": last_name, "_id": {"$gt": last_id}}
+            ]
+
+        shape = 'list_members' if plan_id is None else 'list_members_by_plan'
+        collection = self.members if primary else self.report_members
+        return list(self._find(shape, collection, query, projection_for(fields),
+                               sort=[("name", ASCENDING), ("_id", ASCENDING)], limit=limit))
+
+    def expired_members(self, branch_id, now, primary=False):
+        collection = self.members if primary else self.report_members
+        return list(self._find('expired_members', collection,
+                               {"branch_id": branch_id, "subscription.expiry_date": {"$lt": now}},
+                               sort=[("subscription.expiry_date", ASCENDING)]))
+
+    def member_snapshot(self, branch_id, batch_size):
+        cursor = self._find('member_snapshot', self.report_members, {"branch_id": branch_id},
+                            {"_id": 0, "subscription.plan_id": 1, "subscription.start_date": 1,
+                             "subscription.expiry_date": 1, "created_at": 1})
+        rows = []
+        for member in cursor.batch_size(batch_size):
+            subscription = member.get("subscription") or {}
+            rows.append((subscription.get("plan_id"), subscription.get("start_date"),
+                         subscription.get("expiry_date"), member.get("created_at")))
+            if len(rows) == batch_size:
+                yield rows
+                rows = []
+        if rows:
+            yield rows
+
+    def get_member(self, branch_id, member_id, fields=None):
+        return self._find_one('get_member', self.members,
+                              {"branch_id": branch_id, "_id": member_id}, projection_for(fields))
+
+    def get_member_expiry(self, branch_id, member_id):
+        member = self._find_one('get_member_expiry', self.members,
+                                {"branch_id": branch_id, "_id": member_id}, {"subscription.expiry_date": 1})
+        return member["subscription"]["expiry_date"] if member else None
+
+    def get_member_version(self, branch_id, member_id):
+        member = self._find_one('get_member_version', self.members,
+                                {"branch_id": branch_id, "_id": member_id}, {"updated_at": 1})
+        return member.get("updated_at") if member else None
+
+    def watch_members(self, on_change, on_error):
+        # Change streams need a replica set (a single-node one is enough)
+        pipeline = [{"$match": {"operationType": {"$in": ["update", "replace", "delete"]}}}]
+
+        def listen():
+            try:
+                with self.members.watch(pipeline) as stream:
+                    for change in stream:
+                        on_change(change["documentKey"]["_id"])
+            except PyMongoError:
+                logger.exception("Members change stream stopped")
+                on_error()
+
+        threading.Thread(target=listen, name='members-change-stream', daemon=True).start()
+        return True
+
+    def update_subscription(self, branch_id, member_id, subscription, updated_at):
+        update = {f"subscription.{field}": value for field, value in subscription.items()}
+        update["updated_at"] = updated_at
+        return self.members.find_one_and_update(
+            {"branch_id": branch_id, "_id": member_id},
+            {"$set": update},
+            projection={"subscription": 1},
+            return_document=ReturnDocument.BEFORE,
+            session=self._session()
+        )
+
+    def change_subscriptions(self, branch_id, changes, updated_at):
+        if not changes:
+            return []
+        result = self.members.bulk_write([
+            UpdateOne({"branch_id": branch_id, "_id": member_id, "subscription.plan_id": plan_id,
+                       "subscription.expiry_date": expiry_date},
+                      {"$set": dict({f"subscription.{field}": value for field, value in subscription.items()},
+                                    updated_at=updated_at)})
+            for member_id, plan_id, expiry_date, subscription in changes
+        ], ordered=False, session=self._session())
+        member_ids = [member_id for member_id, _, _, _ in changes]
+        if result.matched_count == len(changes):
+            return member_ids
+        # A bulk write doesn't say which updates matched; the ones made here carry
+        # this updated_at (stored to the millisecond) and the plan written
+        updated_at = updated_at.replace(microsecond=updated_at.microsecond // 1000 * 1000)
+        plans = {member_id: subscription.get("plan_id") for member_id, _, _, subscription in changes}
+        members = self.members.find({"branch_id": branch_id, "_id": {"$in": member_ids}, "updated_at": updated_at},
+                                    {"subscription.plan_id": 1}, session=self._session())
+        return [member["_id"] for member in members
+                if member.get("subscription", {}).get("plan_id") == plans[member["_id"]]]
+
+    def _delete_cold_fields(self, branch_id, member_ids):
+        query = {"branch_id": branch_id, "member_id": {"$in": list(member_ids)}}
+        self.profiles.delete_many(query, session=self._session())
+        self.payments.delete_many(query, session=self._session())
+
+    def delete_member(self, branch_id, member_id):
+        member = self.members.find_one_and_delete({"branch_id": branch_id, "_id": member_id},
+                                                  session=self._session())
+        if member is not None:
+            self._delete_cold_fields(branch_id, [member_id])
+        return member
+
+    def delete_members(self, branch_id, member_ids):
+        member_ids = list(member_ids)
+        result = self.members.delete_many({"branch_id": branch_id, "_id": {"$in": member_ids}},
+                                          session=self._session())
+        self._delete_cold_fields(branch_id, member_ids)
+        return result.deleted_count
+
+    def list_branches(self):
+        return self.members.distinct("branch_id")
+
+    def members_expiring_between(self, branch_id, low, high, after, limit):
+        query = {"branch_id": branch_id, "subscription.expiry_date": {"$lte": high}}
+        if low is not None:
+            query["subscription.expiry_date"]["$gt"] = low
+        if after is not None:
+            last_expiry, last_id = after
+            query["$or"] = [
+                {"subscription.expiry_date": {"$gt": last_expiry}},
+                {"subscription.expiry_date": last_expiry, "_id": {"$gt": last_id}}
+            ]
+        cursor = self._find('members_expiring_between', self.members, query,
+                            {"subscription.expiry_date": 1, "subscription.status": 1},
+                            sort=[("subscription.expiry_date", ASCENDING), ("_id", ASCENDING)], limit=limit)
+        return [(member["subscription"]["expiry_date"], member["_id"], member["subscription"].get("status"))
+                for member in cursor]
+
+    def mark_expired(self, branch_id, member_ids, updated_at):
+        result = self.members.update_many(
+            {"branch_id": branch_id, "_id": {"$in": list(member_ids)}, "subscription.status": {"$ne": "expired"}},
+            {"$set": {"subscription.status": "expired", "updated_at": updated_at}}
+        )
+        return result.modified_count
+
+    def members_without_plan_fields(self, after, limit):
+        query = {"subscription.plan_name": {"$exists": False}}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        cursor = self._find('members_without_plan_fields', self.members, query, {"subscription.plan_id": 1},
+                            sort=[("_id", ASCENDING)], limit=limit)
+        return [(member["_id"], (member.get("subscription") or {}).get("plan_id")) for member in cursor]
+
+    def set_plan_fields(self, updates):
+        if not updates:
+            return 0
+        result = self.members.bulk_write([
+            UpdateOne({"_id": member_id, "subscription.plan_id": plan_id,
+                       "subscription.plan_name": {"$exists": False}},
+                      {"$set": {f"subscription.{field}": value for field, value in fields.items()}})
+            for member_id, plan_id, fields in updates
+        ], ordered=False)
+        return result.modified_count
+
+    def members_without_normalized_fields(self, after, limit):
+        query = {"contact_normalized": {"$exists": False}}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        cursor = self._find('members_without_normalized_fields', self.members, query, {"contact": 1, "email": 1},
+                            sort=[("_id", ASCENDING)], limit=limit)
+        return [(member["_id"], member.get("contact"), member.get("email")) for member in cursor]
+
+    def set_normalized_fields(self, updates):
+        if not updates:
+            return 0
+        try:
+            result = self.members.bulk_write([
+                UpdateOne({"_id": member_id, "contact_normalized": {"$exists": False}}, {"$set": fields})
+                for member_id, fields in updates
+            ], ordered=False)
+        except BulkWriteError as e:
+            # Members whose contact is taken fail on the unique index; the rest are written
+            return e.details["nModified"]
+        return result.modified_count
+
+    def duplicate_contact_groups(self):
+        # Digits of the raw contact, computed in the $group key so members the
+        # normalization backfill skipped are grouped too
+        digits = {"$reduce": {
+            "input": {"$regexFindAll": {"input": "$contact", "regex": "[0-9]"}},
+            "initialValue": "",
+            "in": {"$concat": ["$$value", "$$this.match"]}
+        }}
+        pipeline = [
+            {"$match": {"contact": {"$type": "string"}}},
+            {"$group": {"_id": {"branch_id": "$branch_id", "contact": digits},
+                        "ids": {"$push": "$_id"}, "count": {"$sum": 1}}},
+            {"$match": {"count": {"$gt": 1}, "_id.contact": {"$ne": ""}}},
+        ]
+        for group in self.members.aggregate(pipeline, allowDiskUse=True):
+            yield group["_id"]["branch_id"], group["_id"]["contact"], group["ids"]
+
+    def merge_members(self, branch_id, merged, duplicate_ids):
+        # contact_normalized goes back on last: until the duplicates are
+        # deleted, one of them may still hold it in the unique index
+        document = {field: value for field, value in merged.items() if field != "contact_normalized"}
+        self.members.replace_one({"_id": merged["_id"], "branch_id": branch_id}, document)
+        self.checkins.reassign(duplicate_ids, merged["_id"])
+        self.payments.update_many({"branch_id": branch_id, "member_id": {"$in": list(duplicate_ids)}},
+                                  {"$set": {"member_id": merged["_id"]}})
+        result = self.members.delete_many({"branch_id": branch_id, "_id": {"$in": list(duplicate_ids)}})
+        self.profiles.delete_many({"branch_id": branch_id, "member_id": {"$in": list(duplicate_ids)}})
+        try:
+            self.members.update_one({"_id": merged["_id"]},
+                                    {"$set": {"contact_normalized": merged.get("contact_normalized")}})
+        except DuplicateKeyError:
+            # A member with the same number was added meanwhile; the next run merges it
+            logger.warning("Member %s shares its contact with a new member", merged["_id"])
+        return result.deleted_count
+
+    def insert_audit_entries(self, entries):
+        try:
+            self.audit.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # Already recorded by an earlier attempt (unique change_id)
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    def member_history(self, branch_id, member_id, limit):
+        return list(self._find('member_history', self.audit,
+                               {"member_id": member_id, "branch_id": branch_id},
+                               sort=[("ts", DESCENDING)], limit=limit))
+
+    def insert_subscription_periods(self, periods):
+        if not periods:
+            return
+        try:
+            self.periods.insert_many(periods, ordered=False, session=self._session())
+        except BulkWriteError as e:
+            # Already recorded by an earlier attempt (unique change_id)
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    def subscription_periods(self, branch_id, member_id, limit):
+        return list(self._find('subscription_periods', self.periods,
+                               {"member_id": member_id, "branch_id": branch_id},
+                               sort=[("created_at", DESCENDING)], limit=limit))
+
+    def delete_subscription_periods(self, change_ids):
+        if change_ids:
+            self.periods.delete_many({"change_id": {"$in": list(change_ids)}}, session=self._session())
+
+    def members_with_cold_fields(self, after, limit):
+        query = {"$or": [{field: {"$exists": True}} for field in PROFILE_FIELDS + ("subscription.payments",)]}
+        if after is not None:
+            query["_id"] = {"$gt": after}
+        return list(self._find('members_with_cold_fields', self.members, query,
+                               sort=[("_id", ASCENDING)], limit=limit))
+
+    def move_cold_fields(self, moves):
+        if not moves:
+            return 0
+        profiles = [UpdateOne({"member_id": member_id}, {"$set": dict(profile, branch_id=branch_id)}, upsert=True)
+                    for member_id, branch_id, profile, _ in moves if profile]
+        if profiles:
+            self.profiles.bulk_write(profiles, ordered=False)
+        self.insert_payments([payment for _, _, _, payments in moves for payment in payments])
+
+        unset = {field: "" for field in PROFILE_FIELDS + ("subscription.payments",)}
+        result = self.members.bulk_write([UpdateOne({"_id": member_id}, {"$unset": unset})
+                                          for member_id, _, _, _ in moves], ordered=False)
+        return result.modified_count
+
+    def get_member_profile(self, branch_id, member_id):
+        return self._find_one('get_member_profile', self.profiles,
+                              {"member_id": member_id, "branch_id": branch_id})
+
+    def insert_payments(self, payments):
+        if not payments:
+            return
+        try:
+            self.payments.insert_many(payments, ordered=False, session=self._session())
+        except BulkWriteError as e:
+            # Already recorded by an earlier attempt (unique payment_id)
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+
+    def member_payments(self, branch_id, member_id, limit):
+        return list(self._find('member_payments', self.payments,
+                               {"member_id": member_id, "branch_id": branch_id},
+                               sort=[("date", DESCENDING)], limit=limit))
+
+    def claim_notifications(self, entries):
+        if not entries:
+            return []
+        try:
+            self.notifications.insert_many(entries, ordered=False)
+        except BulkWriteError as e:
+            # Keys claimed before (unique key) are skipped; anything else is an error
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+            taken = {error["index"] for error in e.details["writeErrors"]}
+            return [entry["key"] for position, entry in enumerate(entries) if position not in taken]
+        return [entry["key"] for entry in entries]
+
+    def mark_notifications_sent(self, keys, sent_at):
+        self.notifications.update_many({"key": {"$in": list(keys)}},
+                                       {"$set": {"status": "sent", "sent_at": sent_at}})
+
+    def release_notifications(self, keys):
+        self.notifications.delete_many({"key": {"$in": list(keys)}})
+
+    def recent_notifications(self, branch_id, limit):
+        return list(self._find('recent_notifications', self.notifications, {"branch_id": branch_id},
+                               sort=[("created_at", DESCENDING)], limit=limit))
+
+    def revoke_cards(self, member_id, branch_id, revoked_before, expires_at, reason, updated_at):
+        self.card_revocations_collection.update_one(
+            {"member_id": member_id},
+            {"$max": {"revoked_before": revoked_before, "expires_at": expires_at},
+             "$set": {"branch_id": branch_id, "reason": reason, "updated_at": updated_at}},
+            upsert=True)
+
+    def card_revocations(self, since):
+        query = {"updated_at": {"$gte": since}} if since is not None else {}
+        return list(self._find('card_revocations', self.card_revocations_collection, query,
+                               sort=[("updated_at", ASCENDING)]))
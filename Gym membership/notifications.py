@@ -0,0 +1,459 @@
+"""Expiry reminders sent to members by email or SMS.
+
+Every GYM_NOTIFY_INTERVAL_SECONDS the dispatcher looks for members whose
+subscription ends within one of the notice windows (GYM_NOTIFY_WINDOWS,
+default 7, 3 and 1 days). Each window is a band ending where the next smaller
+one starts, so a member with 5 days left gets the 7-day notice and a member
+added with 2 days left only gets the 3-day one. Per branch and band this is a
+range scan on the (branch_id, subscription.expiry_date, _id) index, read in
+keyset batches like the status sweeper's.
+
+A member gets email if it has an email address and an email transport is
+configured, otherwise SMS to its contact number. Messages are rendered from
+the Jinja templates below and sent through a transport per channel:
+
+- smtp: one SMTP connection per batch (GYM_SMTP_*)
+- sms: one HTTP request per batch to an SMS gateway (GYM_SMS_*)
+- file: one JSON line per message in GYM_NOTIFY_OUTBOX, for local testing
+- fake: kept in memory, for tests
+
+Both channels are off unless a transport is chosen, and the app only starts
+the dispatcher when one is. The file transport is never a default: it
+writes member contact details to disk and spends their ledger claims.
+
+Batches are sent from a thread pool, and each transport has its own rate
+limit (messages per second), shared by all the threads.
+
+Before a batch is sent, its messages are claimed in the notifications
+ledger under the key (member, window, expiry date). A key already in the
+ledger is not sent again, so no member gets the same notice twice, even
+with several app processes. A renewal changes the expiry date and starts
+the notices over. Messages a transport fails to send are released from the
+ledger and retried on the next run. A process that dies after claiming a
+batch and before sending it loses that batch: a missed reminder is
+preferred over a duplicate one. Like the sweeper, only the process holding
+the dispatcher lease does a run.
+"""
+import json
+import logging
+import math
+import os
+import smtplib
+import socket
+import threading
+import time
+import urllib.request
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from email.message import EmailMessage
+
+from jinja2 import Environment
+
+logger = logging.getLogger(__name__)
+
+NOTIFICATIONS_COLLECTION = 'notifications'
+NOTIFY_WINDOWS_DAYS = sorted({int(days) for days in os.environ.get('GYM_NOTIFY_WINDOWS', '7,3,1').split(',')
+                              if days.strip()}, reverse=True)
+NOTIFY_INTERVAL_SECONDS = int(os.environ.get('GYM_NOTIFY_INTERVAL_SECONDS', 3600))
+NOTIFY_WORKERS = int(os.environ.get('GYM_NOTIFY_WORKERS', 4))
+NOTIFY_BATCH_SIZE = 100
+# smtp, file, fake or off
+EMAIL_TRANSPORT = os.environ.get('GYM_NOTIFY_EMAIL_TRANSPORT', 'off')
+# sms, file, fake or off
+SMS_TRANSPORT = os.environ.get('GYM_NOTIFY_SMS_TRANSPORT', 'off')
+EMAIL_RATE = float(os.environ.get('GYM_NOTIFY_EMAIL_RATE', 10))  # messages per second
+SMS_RATE = float(os.environ.get('GYM_NOTIFY_SMS_RATE', 5))
+OUTBOX_PATH = os.environ.get('GYM_NOTIFY_OUTBOX', 'notifications.jsonl')
+GYM_NAME = os.environ.get('GYM_NAME', 'the gym')
+LEASE_NAME = 'notification-dispatcher'
+LEASE_SECONDS = 300
+HISTORY_SIZE = 20
+NOTIFICATIONS_LIMIT = 100
+
+_templates = Environment(trim_blocks=True, keep_trailing_newline=True)
+EMAIL_SUBJECT = _templates.from_string(
+    "Your {{ plan_name or 'membership' }} at {{ gym }} ends in {{ days }} day{{ 's' if days != 1 }}")
+EMAIL_BODY = _templates.from_string("""Hi {{ name }},
+
+Your {{ plan_name or 'membership' }} at {{ gym }} expires on {{ expiry_date.strftime('%d %B %Y') }}, {{ days }} day{{ 's' if days != 1 }} from now.
+Renew at the front desk to keep training without a break.
+
+See you soon,
+{{ gym }}
+""")
+SMS_BODY = _templates.from_string(
+    "Hi {{ name }}, your {{ plan_name or 'membership' }} at {{ gym }} expires on "
+    "{{ expiry_date.strftime('%d %b') }} ({{ days }} day{{ 's' if days != 1 }}). Renew at the front desk.")
+
+
+def notice_bands(windows=NOTIFY_WINDOWS_DAYS):
+    """(window, low_days, high_days) per window, largest first, so that the
+    bands (low_days, high_days] do not overlap."""
+    windows = sorted(windows, reverse=True)
+    return [(days, windows[position + 1] if position + 1 < len(windows) else 0, days)
+            for position, days in enumerate(windows)]
+
+
+def notification_key(member_id, window, expiry_date):
+    return f"{member_id}:{window}:{expiry_date.isoformat()}"
+
+
+def render_message(member, channel, window, now, gym=GYM_NAME):
+    """(to, subject, body) for a member's reminder on channel ("email" or
+    "sms"), or None if the member has no address for it."""
+    subscription = member.get("subscription") or {}
+    expiry_date = subscription["expiry_date"]
+    context = {
+        "name": member.get("name") or 'there',
+        "plan_name": subscription.get("plan_name"),
+        "expiry_date": expiry_date,
+        "days": max(math.ceil((expiry_date - now).total_seconds() / 86400), 1),
+        "window": window,
+        "gym": gym,
+    }
+    if channel == 'email':
+        if not member.get("email"):
+            return None
+        return member["email"], EMAIL_SUBJECT.render(context), EMAIL_BODY.render(context)
+    if not member.get("contact"):
+        return None
+    return member["contact"], None, SMS_BODY.render(context)
+
+
+class RateLimiter:
+    """Token bucket shared by the threads sending through one transport.
+
+    rate is messages per second; 0 or None means unlimited. A batch larger
+    than the bucket is let through once the bucket is full and leaves it
+    in debt, so the long-run rate still holds.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate or 0, 1)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        if not self.rate:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                needed = min(tokens, self.burst)
+                if self._tokens >= needed:
+                    self._tokens -= tokens
+                    return
+                wait = (needed - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class Transport:
+    """Sends messages of one channel. send() gets a batch of message dicts
+    (to, subject, body, key) and returns one error string or None per
+    message, in order.
+
+    A rate-limited transport gets batches of at most one second's worth of
+    messages, so a batch never goes out faster than the rate.
+    """
+
+    name = None
+    channel = None
+
+    def __init__(self, rate=None):
+        self.limiter = RateLimiter(rate)
+        self.batch_size = min(NOTIFY_BATCH_SIZE, max(int(rate), 1)) if rate else NOTIFY_BATCH_SIZE
+
+    def send(self, messages):
+        raise NotImplementedError
+
+
+class SmtpTransport(Transport):
+    name = 'smtp'
+    channel = 'email'
+
+    def __init__(self, host, port=587, username=None, password=None, sender=None, starttls=True, rate=EMAIL_RATE):
+        super().__init__(rate)
+        self.host = host
+        self.port = port
+        self.username = username
+        self.password = password
+        self.sender = sender or username
+        self.starttls = starttls
+
+    def send(self, messages):
+        errors = []
+        # One connection for the whole batch
+        with smtplib.SMTP(self.host, self.port, timeout=30) as smtp:
+            if self.starttls:
+                smtp.starttls()
+            if self.username:
+                smtp.login(self.username, self.password)
+            for message in messages:
+                email = EmailMessage()
+                email['From'] = self.sender
+                email['To'] = message['to']
+                email['Subject'] = message['subject']
+                email.set_content(message['body'])
+                try:
+                    smtp.send_message(email)
+                    errors.append(None)
+                except (smtplib.SMTPServerDisconnected, OSError) as e:
+                    # The rest of the batch was not sent; the ones before it were
+                    errors += [str(e)] * (len(messages) - len(errors))
+                    break
+                except smtplib.SMTPException as e:
+                    errors.append(str(e))
+        return errors
+
+
+class SmsGatewayTransport(Transport):
+    """POSTs {"from", "messages": [{"to", "text", "reference"}]} to an HTTP
+    SMS gateway and expects {"results": [{"error": ...}, ...]} back, in the
+    same order (a response without results means all were accepted).
+    Messages past the end of a shorter results list count as failed."""
+
+    name = 'sms'
+    channel = 'sms'
+
+    def __init__(self, url, api_key=None, sender=None, rate=SMS_RATE):
+        super().__init__(rate)
+        self.url = url
+        self.api_key = api_key
+        self.sender = sender
+
+    def send(self, messages):
+        payload = {"from": self.sender, "messages": [
+            {"to": message['to'], "text": message['body'], "reference": message['key']} for message in messages
+        ]}
+        request = urllib.request.Request(self.url, data=json.dumps(payload).encode(), method='POST',
+                                         headers={"Content-Type": "application/json"})
+        if self.api_key:
+            request.add_header("Authorization", f"Bearer {self.api_key}")
+        with urllib.request.urlopen(request, timeout=30) as response:
+            body = response.read()
+        results = (json.loads(body) if body else {}).get("results")
+        if not results:
+            return [None] * len(messages)
+        errors = [result.get("error") for result in results[:len(messages)]]
+        return errors + ["no result from SMS gateway"] * (len(messages) - len(errors))
+
+
+class FileTransport(Transport):
+    """Appends each message as a JSON line to a local file."""
+
+    name = 'file'
+    _lock = threading.Lock()
+
+    def __init__(self, channel, path=OUTBOX_PATH, rate=None):
+        super().__init__(rate)
+        self.channel = channel
+        self.path = path
+
+    def send(self, messages):
+        lines = [json.dumps(dict(message, channel=self.channel, sent_at=datetime.now().isoformat())) + '\n'
+                 for message in messages]
+        with self._lock, open(self.path, 'a', encoding='utf-8') as outbox:
+            outbox.writelines(lines)
+        return [None] * len(messages)
+
+
+class FakeTransport(Transport):
+    """Keeps sent messages in memory. Messages to an address in fail_to
+    fail."""
+
+    name = 'fake'
+
+    def __init__(self, channel, rate=None, fail_to=()):
+        super().__init__(rate)
+        self.channel = channel
+        self.fail_to = set(fail_to)
+        self.sent = []
+        self._lock = threading.Lock()
+
+    def send(self, messages):
+        errors = []
+        with self._lock:
+            for message in messages:
+                if message['to'] in self.fail_to:
+                    errors.append("rejected by fake transport")
+                else:
+                    self.sent.append(message)
+                    errors.append(None)
+        return errors
+
+
+def create_transports(email=EMAIL_TRANSPORT, sms=SMS_TRANSPORT):
+    """{channel: transport} from the GYM_NOTIFY_* settings."""
+    transports = {}
+    if email == 'smtp':
+        transports['email'] = SmtpTransport(
+            os.environ.get('GYM_SMTP_HOST', 'localhost'), int(os.environ.get('GYM_SMTP_PORT', 587)),
+            os.environ.get('GYM_SMTP_USER'), os.environ.get('GYM_SMTP_PASSWORD'),
+            os.environ.get('GYM_SMTP_FROM'), os.environ.get('GYM_SMTP_STARTTLS', '1') == '1')
+    elif email in ('file', 'fake'):
+        transports['email'] = FileTransport('email', rate=EMAIL_RATE) if email == 'file' else FakeTransport('email')
+    elif email != 'off':
+        raise ValueError(f"Unknown email transport: {email}")
+
+    if sms == 'sms':
+        transports['sms'] = SmsGatewayTransport(os.environ['GYM_SMS_GATEWAY_URL'], os.environ.get('GYM_SMS_API_KEY'),
+                                                os.environ.get('GYM_SMS_FROM'))
+    elif sms in ('file', 'fake'):
+        transports['sms'] = FileTransport('sms', rate=SMS_RATE) if sms == 'file' else FakeTransport('sms')
+    elif sms != 'off':
+        raise ValueError(f"Unknown SMS transport: {sms}")
+    return transports
+
+
+class NotificationDispatcher:
+    def __init__(self, storage, transports, windows=NOTIFY_WINDOWS_DAYS, interval=NOTIFY_INTERVAL_SECONDS,
+                 batch_size=NOTIFY_BATCH_SIZE, workers=NOTIFY_WORKERS):
+        self.storage = storage
+        self.transports = transports
+        self.bands = notice_bands(windows)
+        self.interval = interval
+        self.batch_size = batch_size
+        self.workers = workers
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.runs = deque(maxlen=HISTORY_SIZE)
+        self.stats = {"completed": 0, "skipped": 0, "failed": 0, "sent": 0, "send_errors": 0, "no_address": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, now=None):
+        """Send the reminders due at now. Returns the run's counts, or None
+        if another process holds the lease."""
+        now = now or datetime.now()
+        lease = self.storage.acquire_lease(LEASE_NAME, self.owner, now, now + timedelta(seconds=LEASE_SECONDS))
+        if lease is None:
+            self.stats["skipped"] += 1
+            return None
+
+        started = time.perf_counter()
+        run = {"owner": self.owner, "at": now, "sent": 0, "send_errors": 0, "already_sent": 0, "no_address": 0,
+               "by_window": {str(window): 0 for window, _, _ in self.bands},
+               "by_transport": {transport.name + ':' + channel: 0 for channel, transport in self.transports.items()}}
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix='notify') as pool:
+                futures = []
+                for branch_id in self.storage.list_branches():
+                    for window, low_days, high_days in self.bands:
+                        futures += self._dispatch_band(pool, branch_id, window, now + timedelta(days=low_days),
+                                                       now + timedelta(days=high_days), now, run)
+                        # Keep the lease while a large backlog goes out
+                        self.storage.acquire_lease(LEASE_NAME, self.owner, datetime.now(),
+                                                   datetime.now() + timedelta(seconds=LEASE_SECONDS))
+                for future in futures:
+                    self._record(run, *future.result())
+        finally:
+            self.storage.release_lease(LEASE_NAME, self.owner, {"last_run": run})
+
+        run["duration_ms"] = round((time.perf_counter() - started) * 1000, 1)
+        self.runs.append(run)
+        self.stats["completed"] += 1
+        self.stats["sent"] += run["sent"]
+        self.stats["send_errors"] += run["send_errors"]
+        self.stats["no_address"] += run["no_address"]
+        if run["sent"] or run["send_errors"]:
+            logger.info("Sent %d expiry reminders (%d failed) in %.0fms",
+                        run["sent"], run["send_errors"], run["duration_ms"])
+        return run
+
+    def _dispatch_band(self, pool, branch_id, window, low, high, now, run):
+        futures, after = [], None
+        while True:
+            rows = self.storage.members_expiring_between(branch_id, low, high, after, self.batch_size)
+            if not rows:
+                return futures
+            after = rows[-1][:2]
+
+            member_ids = [member_id for _, member_id, status in rows if status != "expired"]
+            by_channel = {}
+            for member in self.storage.get_members(branch_id, member_ids):
+                message = self._message(member, branch_id, window, now)
+                if message is None:
+                    run["no_address"] += 1
+                    continue
+                by_channel.setdefault(message["channel"], []).append(message)
+
+            for channel, messages in by_channel.items():
+                claimed = set(self.storage.claim_notifications([self._ledger_entry(message) for message in messages]))
+                run["already_sent"] += len(messages) - len(claimed)
+                messages = [message for message in messages if message["key"] in claimed]
+                transport = self.transports[channel]
+                for start in range(0, len(messages), transport.batch_size):
+                    futures.append(pool.submit(self._send, transport, window, messages[start:start + transport.batch_size]))
+
+    def _message(self, member, branch_id, window, now):
+        for channel in ('email', 'sms'):
+            if channel not in self.transports:
+                continue
+            rendered = render_message(member, channel, window, now)
+            if rendered is not None:
+                to, subject, body = rendered
+                expiry_date = member["subscription"]["expiry_date"]
+                return {"key": notification_key(member["_id"], window, expiry_date), "member_id": member["_id"],
+                        "branch_id": branch_id, "window_days": window, "expiry_date": expiry_date,
+                        "channel": channel, "to": to, "subject": subject, "body": body}
+        return None
+
+    def _ledger_entry(self, message):
+        entry = {field: message[field] for field in ('key', 'member_id', 'branch_id', 'window_days',
+                                                      'expiry_date', 'channel', 'to')}
+        entry.update(transport=self.transports[message["channel"]].name, status='sending', created_at=datetime.now())
+        return entry
+
+    def _send(self, transport, window, messages):
+        transport.limiter.acquire(len(messages))
+        payload = [{field: message[field] for field in ('key', 'to', 'subject', 'body')} for message in messages]
+        try:
+            errors = transport.send(payload)
+        except Exception as e:
+            logger.exception("%s transport failed to send %d messages", transport.name, len(messages))
+            errors = [str(e)] * len(messages)
+
+        sent = [message["key"] for message, error in zip(messages, errors) if error is None]
+        failed = [message["key"] for message, error in zip(messages, errors) if error is not None]
+        if sent:
+            self.storage.mark_notifications_sent(sent, datetime.now())
+        if failed:
+            # Released, so the next run tries them again
+            self.storage.release_notifications(failed)
+        return transport, window, len(sent), len(failed)
+
+    def _record(self, run, transport, window, sent, failed):
+        run["sent"] += sent
+        run["send_errors"] += failed
+        run["by_window"][str(window)] += sent
+        run["by_transport"][transport.name + ':' + transport.channel] += sent
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='notification-dispatcher', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("Notification run failed")
+            self._stop.wait(self.interval)
+
+    def snapshot(self):
+        return dict(self.stats, interval_seconds=self.interval,
+                    windows_days=[window for window, _, _ in self.bands],
+                    transports={channel: {"transport": transport.name, "rate_per_second": transport.limiter.rate}
+                                for channel, transport in self.transports.items()},
+                    runs=list(self.runs))
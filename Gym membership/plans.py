@@ -0,0 +1,210 @@
+"""Cached plan catalog and the plan fields copied into every subscription.
+
+A subscription carries the plan's name, price and duration as they were at
+purchase time. List pages can then print them without looking the plan up,
+and the price stays historically correct if the plan changes later. Members
+created before this was introduced are filled in by a background backfill.
+
+Plans are versioned. Editing or retiring a plan adds a new version; existing
+versions never change, and a subscription records the version it was sold
+at (plan_version). Each version also carries its display metadata (badge
+class and icon), so templates style plans without knowing their names.
+"""
+import logging
+import os
+import re
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+PLAN_CACHE_SECONDS = int(os.environ.get('GYM_PLAN_CACHE_SECONDS', 300))
+BACKFILL_BATCH_SIZE = 1000
+
+# Plan fields denormalized into member["subscription"]
+PLAN_FIELDS = ('plan_name', 'price', 'duration')
+
+# Badge classes defined in index.css; icons are Font Awesome names without "fa-"
+BADGE_CLASSES = ('badge-primary', 'badge-success', 'badge-danger', 'badge-secondary')
+ICON_PATTERN = re.compile(r'^[a-z0-9-]+$')
+DEFAULT_DISPLAY = {"badge": "badge-secondary", "icon": "tag"}
+# How the templates styled the seeded plans before display metadata existed
+LEGACY_DISPLAY = {
+    "Premium": {"badge": "badge-primary", "icon": "crown"},
+    "Standard": {"badge": "badge-success", "icon": "star"},
+}
+
+CatalogState = namedtuple('CatalogState', 'active current by_id versions')
+
+
+def plan_display(plan):
+    display = dict(DEFAULT_DISPLAY, **LEGACY_DISPLAY.get(plan.get("plan_name"), {}))
+    display.update(plan.get("display") or {})
+    return display
+
+
+class PlanCatalog:
+    """All plan versions, loaded at most once per ttl seconds.
+
+    get() returns the current (latest) version of a plan and version() the
+    one a subscription was sold at. Retired plans stay available to get()
+    for the members still on them, but all() leaves them out.
+    """
+
+    def __init__(self, loader, ttl=PLAN_CACHE_SECONDS):
+        self.loader = loader
+        self.ttl = ttl
+        self._state = None
+        self._loaded_at = 0.0
+        self._lock = threading.Lock()
+
+    def _load(self):
+        current, versions = {}, {}
+        for plan in self.loader():
+            # Plans stored before versioning are version 1
+            plan.setdefault("version", 1)
+            plan["display"] = plan_display(plan)
+            versions[(plan["plan_id"], plan["version"])] = plan
+            if plan["plan_id"] not in current or plan["version"] > current[plan["plan_id"]]["version"]:
+                current[plan["plan_id"]] = plan
+        plans = sorted(current.values(), key=lambda plan: plan["plan_id"])
+        active = [plan for plan in plans if not plan.get("retired")]
+        return CatalogState(active, plans, current, versions)
+
+    def _current(self):
+        with self._lock:
+            if self._state is None or time.monotonic() - self._loaded_at >= self.ttl:
+                self._state = self._load()
+                self._loaded_at = time.monotonic()
+            return self._state
+
+    def all(self):
+        """Current versions of the plans on sale."""
+        return self._current().active
+
+    def current(self):
+        """Current versions of every plan, retired ones included."""
+        return self._current().current
+
+    def get(self, plan_id):
+        return self._current().by_id.get(plan_id)
+
+    def version(self, plan_id, version):
+        """The given version of a plan; subscriptions without one were sold at version 1."""
+        state = self._current()
+        return state.versions.get((plan_id, version or 1)) or state.by_id.get(plan_id)
+
+    def versions(self, plan_id):
+        """Every version of a plan, newest first."""
+        versions = [plan for (version_plan_id, _), plan in self._current().versions.items()
+                    if version_plan_id == plan_id]
+        return sorted(versions, key=lambda plan: plan["version"], reverse=True)
+
+    def badges(self):
+        """plan_id -> badge class, for pages that style plans client-side."""
+        return {plan["plan_id"]: plan["display"]["badge"] for plan in self.current()}
+
+    def invalidate(self):
+        with self._lock:
+            self._state = None
+
+
+def duration_label(days):
+    for unit_days, unit in ((365, "Year"), (30, "Month"), (7, "Week")):
+        if days % unit_days == 0:
+            count = days // unit_days
+            return f"{count} {unit}{'s' if count > 1 else ''}"
+    return f"{days} Day{'s' if days > 1 else ''}"
+
+
+def plan_version(previous, changes, admin=None, now=None):
+    """A new plan version: previous (None for a new plan) with changes applied.
+
+    changes may hold plan_name, price, duration_days, duration, display and
+    retired. plan_id must be in changes for a new plan. Raises ValueError
+    if the result is not a valid plan.
+    """
+    plan = {key: value for key, value in (previous or {}).items() if key != '_id'}
+    plan.update(changes)
+    plan["version"] = previous["version"] + 1 if previous else 1
+    plan["created_at"] = now or datetime.now()
+    plan["created_by"] = admin
+
+    if not (plan.get("plan_name") or '').strip():
+        raise ValueError("Plan name is required")
+    plan["plan_name"] = plan["plan_name"].strip()
+    if not isinstance(plan.get("price"), (int, float)) or plan["price"] < 0:
+        raise ValueError("Price must be zero or more")
+    if not isinstance(plan.get("duration_days"), int) or plan["duration_days"] < 1:
+        raise ValueError("Duration must be at least one day")
+    if not plan.get("duration") or "duration_days" in changes and "duration" not in changes:
+        plan["duration"] = duration_label(plan["duration_days"])
+
+    display = plan_display(plan)
+    if display["badge"] not in BADGE_CLASSES:
+        raise ValueError(f"Badge must be one of {', '.join(BADGE_CLASSES)}")
+    if not ICON_PATTERN.match(display["icon"]):
+        raise ValueError("Icon must be a Font Awesome icon name such as crown or star")
+    plan["display"] = display
+    plan["retired"] = bool(plan.get("retired"))
+    return plan
+
+
+def plan_fields(plan):
+    return {field: plan.get(field) for field in PLAN_FIELDS}
+
+
+def subscription_for(plan, start_date, expiry_date=None):
+    """Subscription fields for buying plan on start_date.
+
+    Without an explicit expiry_date the subscription runs for the plan's
+    duration_days. A subscription that has already ended (back-dated entry)
+    starts out expired, since the status sweeper only looks at expiry dates
+    after its last run.
+    """
+    if expiry_date is None:
+        expiry_date = start_date + timedelta(days=plan["duration_days"])
+    status = "active" if expiry_date > datetime.now() else "expired"
+    return dict(plan_id=plan["plan_id"], plan_version=plan.get("version", 1), start_date=start_date,
+                expiry_date=expiry_date, status=status, **plan_fields(plan))
+
+
+def backfill_plan_fields(storage, catalog, batch_size=BACKFILL_BATCH_SIZE, on_batch=None):
+    """Copy the current plan fields into subscriptions that lack them.
+
+    Walks the members in _id order, batch_size at a time, so each batch is a
+    short indexed read and one bulk write. on_batch is called with the _ids
+    updated in each batch. Returns the number of members updated.
+    """
+    after, updated = None, 0
+    while True:
+        rows = storage.members_without_plan_fields(after, batch_size)
+        if not rows:
+            return updated
+
+        updates = []
+        for member_id, plan_id in rows:
+            plan = catalog.get(plan_id)
+            if plan is not None:
+                updates.append((member_id, plan_id, plan_fields(plan)))
+        if updates:
+            updated += storage.set_plan_fields(updates)
+            if on_batch is not None:
+                on_batch([member_id for member_id, _, _ in updates])
+        after = rows[-1][0]
+
+
+def backfill_in_background(storage, catalog, on_batch=None):
+    def run():
+        try:
+            updated = backfill_plan_fields(storage, catalog, on_batch=on_batch)
+            if updated:
+                logger.info("Copied plan name and price into %d subscriptions", updated)
+        except Exception:
+            logger.exception("Plan field backfill failed")
+
+    thread = threading.Thread(target=run, name='plan-backfill', daemon=True)
+    thread.start()
+    return thread
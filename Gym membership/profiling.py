@@ -0,0 +1,462 @@
+"""Opt-in request profiling and per-route timings.
+
+Profiling is off unless GYM_PROFILE is set, which profiles every request, or
+a logged-in admin asks for one request with the X-Gym-Profile header (or
+?_profile= from a browser). The value picks the profiler:
+
+- cprofile (or 1): cProfile of the request, saved as a .prof file (pstats).
+  Open it with snakeviz, or make a flame graph with flameprof.
+- sample: the request's thread is sampled every GYM_PROFILE_SAMPLE_MS and
+  the stacks are saved in the collapsed format (.folded) that flamegraph.pl
+  and speedscope read. Template frames are named by template line, so a slow
+  loop shows up as index.html:212 rather than as Jinja's generated code.
+
+Every profiled request also gets a time breakdown:
+
+- mongo: round trips to the server, per command (PyMongo command monitoring)
+- cursor: iterating cursors from MongoStorage._find, without their getMore
+  round trips. This is BSON decoding plus the code that consumes the cursor.
+- template: rendering, per template and block
+- other: everything else (the view, storage code, Flask)
+
+The times are exclusive: cursor iteration inside a template loop counts as
+cursor, not template. The breakdown is saved next to the profile (.json).
+It is also sent in a Server-Timing header, which browser dev tools show; for
+a streamed page that header only covers the time until the first chunk.
+
+Request durations of every route are kept whether profiled or not. The
+slowest routes and the saved profiles are listed on /admin/profiles.
+"""
+import cProfile
+import json
+import logging
+import os
+import pstats
+import re
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+from jinja2 import Template
+from pymongo import monitoring
+
+logger = logging.getLogger(__name__)
+
+PROFILE_HEADER = 'X-Gym-Profile'
+PROFILE_ARG = '_profile'
+PROFILE_DIR = os.environ.get('GYM_PROFILE_DIR', 'profiles')
+PROFILE_KEEP = int(os.environ.get('GYM_PROFILE_KEEP', 50))
+SAMPLE_INTERVAL_MS = float(os.environ.get('GYM_PROFILE_SAMPLE_MS', 2))
+ROUTE_SAMPLES = 200
+PROFILES_LIMIT = 50
+TOP_ENTRIES = 25
+
+_local = threading.local()
+# cProfile can only profile one request at a time on Python 3.12+
+_cprofile_lock = threading.Lock()
+
+
+def profile_mode(value):
+    """'cprofile', 'sample' or None for a GYM_PROFILE or header value."""
+    value = (value or '').strip().lower()
+    if value in ('1', 'true', 'yes', 'cprofile'):
+        return 'cprofile'
+    if value == 'sample':
+        return 'sample'
+    return None
+
+
+PROFILE_MODE = profile_mode(os.environ.get('GYM_PROFILE'))
+
+
+def current():
+    """The profile of the request running on this thread, or None."""
+    return getattr(_local, 'profile', None)
+
+
+class RequestProfile:
+    """Exclusive time per (category, name) of one request.
+
+    Timed sections nest: push() when one starts, pop() when it ends. Time
+    spent in a nested section counts for it and not for the outer one.
+    """
+
+    def __init__(self, route, mode):
+        self.route = route
+        self.mode = mode
+        self.started_at = datetime.now()
+        self.status = None
+        self.duration = None
+        self.spans = {}
+        self.name = None
+        self.profiler = None
+        self.sampler = None
+        self._stack = []
+        self._started = time.perf_counter()
+
+    def push(self):
+        self._stack.append([time.perf_counter(), 0.0])
+
+    def pop(self, category, name):
+        started, nested = self._stack.pop()
+        elapsed = time.perf_counter() - started
+        span = self.spans.setdefault((category, name), [0, 0.0])
+        span[0] += 1
+        span[1] += elapsed - nested
+        if self._stack:
+            self._stack[-1][1] += elapsed
+
+    def elapsed(self):
+        return self.duration if self.duration is not None else time.perf_counter() - self._started
+
+    def categories(self):
+        """Milliseconds per category; other is what no span covers."""
+        totals = {"mongo": 0.0, "cursor": 0.0, "template": 0.0}
+        for (category, _), (_, seconds) in self.spans.items():
+            totals[category] = totals.get(category, 0.0) + seconds
+        totals["other"] = max(self.elapsed() - sum(totals.values()), 0.0)
+        return {category: round(seconds * 1000, 2) for category, seconds in totals.items()}
+
+    def server_timing(self):
+        parts = [f"{category};dur={ms}" for category, ms in self.categories().items()]
+        return ', '.join(parts + [f"total;dur={round(self.elapsed() * 1000, 2)}"])
+
+    def breakdown(self):
+        spans = [{"category": category, "name": name, "calls": calls, "ms": round(seconds * 1000, 2)}
+                 for (category, name), (calls, seconds) in self.spans.items()]
+        return {
+            "name": self.name,
+            "route": self.route,
+            "mode": self.mode,
+            "status": self.status,
+            "started_at": self.started_at.isoformat(),
+            "total_ms": round(self.elapsed() * 1000, 2),
+            "categories": self.categories(),
+            "spans": sorted(spans, key=lambda span: span["ms"], reverse=True),
+        }
+
+
+class CommandTimer(monitoring.CommandListener):
+    """Times PyMongo commands on threads that are profiling a request.
+    Commands run and report on the calling thread, so started and
+    succeeded/failed pair up on the thread's profile."""
+
+    def started(self, event):
+        profile = current()
+        if profile is not None:
+            profile.push()
+
+    def succeeded(self, event):
+        profile = current()
+        if profile is not None:
+            profile.pop('mongo', event.command_name)
+
+    def failed(self, event):
+        self.succeeded(event)
+
+
+# Registered before any MongoClient is created: mongo_storage imports this module
+monitoring.register(CommandTimer())
+
+
+class TimedCursor:
+    """A PyMongo cursor whose iteration is timed as cursor/<name>."""
+
+    def __init__(self, name, cursor):
+        self._name = name
+        self._cursor = cursor
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        profile = current()
+        if profile is None:
+            return next(self._cursor)
+        profile.push()
+        try:
+            return next(self._cursor)
+        finally:
+            profile.pop('cursor', self._name)
+
+    def __getattr__(self, attribute):
+        value = getattr(self._cursor, attribute)
+        if not callable(value):
+            return value
+
+        def call(*args, **kwargs):
+            result = value(*args, **kwargs)
+            # Chained cursor methods (batch_size, sort, ...) keep the timing
+            return self if result is self._cursor else result
+        return call
+
+
+def timed_cursor(name, cursor):
+    return TimedCursor(name, cursor) if current() is not None else cursor
+
+
+class ProfiledTemplate(Template):
+    """Jinja template that times rendering and each block while a request is
+    profiled. Set as the environment's template_class."""
+
+    def render(self, *args, **kwargs):
+        profile = current()
+        if profile is None:
+            return super().render(*args, **kwargs)
+        profile.push()
+        try:
+            return super().render(*args, **kwargs)
+        finally:
+            profile.pop('template', self.name)
+
+    def generate(self, *args, **kwargs):
+        chunks = super().generate(*args, **kwargs)
+        if current() is None:
+            return chunks
+        return _timed_chunks(chunks, self.name)
+
+    def new_context(self, vars=None, shared=False, locals=None):
+        context = super().new_context(vars, shared, locals)
+        if current() is not None:
+            for block, functions in context.blocks.items():
+                context.blocks[block] = [_timed_block(function, f"{self.name}#{block}") for function in functions]
+        return context
+
+
+def _timed_chunks(chunks, name):
+    while True:
+        profile = current()
+        if profile is not None:
+            profile.push()
+        try:
+            chunk = next(chunks, None)
+        finally:
+            if profile is not None:
+                profile.pop('template', name)
+        if chunk is None:
+            return
+        yield chunk
+
+
+def _timed_block(function, name):
+    def render_block(context):
+        return _timed_chunks(iter(function(context)), name)
+    return render_block
+
+
+def frame_label(frame):
+    template = frame.f_globals.get('__jinja_template__')
+    if template is not None:
+        return f"{template.name}:{template.get_corresponding_lineno(frame.f_lineno)}"
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class StackSampler:
+    """Samples the stack of one thread from a background thread.
+
+    The sampled thread only yields the GIL every sys.getswitchinterval()
+    (5ms by default) while it runs Python code, so intervals shorter than
+    that get fewer samples than asked for.
+    """
+
+    def __init__(self, thread_id, interval_ms=SAMPLE_INTERVAL_MS):
+        self.thread_id = thread_id
+        self.interval = interval_ms / 1000
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='profile-sampler', daemon=True)
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            labels = []
+            while frame is not None:
+                labels.append(frame_label(frame))
+                frame = frame.f_back
+            if labels:
+                self.stacks[';'.join(reversed(labels))] += 1
+
+    def folded(self):
+        """Collapsed stacks, one "frame;frame;frame count" line each."""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+    def template_lines(self):
+        """Samples per template line, by the innermost template frame."""
+        lines = Counter()
+        for stack, count in self.stacks.items():
+            for label in reversed(stack.split(';')):
+                if re.fullmatch(r'[\w./-]+\.html:\d+', label):
+                    lines[label] += count
+                    break
+        return [{"line": line, "samples": count} for line, count in lines.most_common(TOP_ENTRIES)]
+
+
+def top_functions(profiler, limit=TOP_ENTRIES):
+    """The functions with the most cumulative time in a cProfile run."""
+    stats = pstats.Stats(profiler).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{"function": f"{name} ({os.path.basename(filename)}:{line})", "calls": calls,
+             "self_ms": round(self_time * 1000, 2), "cumulative_ms": round(cumulative * 1000, 2)}
+            for (filename, line, name), (_, calls, self_time, cumulative, _) in rows]
+
+
+class ProfileStore:
+    """Saved profiles in a directory, newest PROFILE_KEEP kept.
+
+    Each profile is <name>.json (the breakdown) plus <name>.prof or
+    <name>.folded. Names start with the time, so they sort by age.
+    """
+
+    def __init__(self, directory=PROFILE_DIR, keep=PROFILE_KEEP):
+        self.directory = os.path.abspath(directory)
+        self.keep = keep
+        self._lock = threading.Lock()
+
+    def save(self, profile):
+        slug = re.sub(r'[^A-Za-z0-9]+', '-', profile.route).strip('-').lower() or 'request'
+        profile.name = f"{profile.started_at:%Y%m%d-%H%M%S-%f}-{slug}"
+        breakdown = profile.breakdown()
+        with self._lock:
+            os.makedirs(self.directory, exist_ok=True)
+            if profile.profiler is not None:
+                profile.profiler.dump_stats(self.path(profile.name + '.prof'))
+                breakdown.update(file=profile.name + '.prof', top_functions=top_functions(profile.profiler))
+            elif profile.sampler is not None:
+                with open(self.path(profile.name + '.folded'), 'w', encoding='utf-8') as out:
+                    out.write(profile.sampler.folded())
+                breakdown.update(file=profile.name + '.folded', samples=sum(profile.sampler.stacks.values()),
+                                 template_lines=profile.sampler.template_lines())
+            with open(self.path(profile.name + '.json'), 'w', encoding='utf-8') as out:
+                json.dump(breakdown, out, indent=1)
+            self._prune()
+        return breakdown
+
+    def path(self, filename):
+        return os.path.join(self.directory, filename)
+
+    def _names(self):
+        try:
+            return sorted((filename[:-5] for filename in os.listdir(self.directory) if filename.endswith('.json')),
+                          reverse=True)
+        except FileNotFoundError:
+            return []
+
+    def _prune(self):
+        for name in self._names()[self.keep:]:
+            for extension in ('.json', '.prof', '.folded'):
+                try:
+                    os.remove(self.path(name + extension))
+                except FileNotFoundError:
+                    pass
+
+    def recent(self, limit=PROFILES_LIMIT):
+        profiles = []
+        for name in self._names()[:limit]:
+            try:
+                with open(self.path(name + '.json'), encoding='utf-8') as saved:
+                    profiles.append(json.load(saved))
+            except (OSError, ValueError):
+                continue
+        return profiles
+
+    def has(self, filename):
+        """Whether filename is a file of a saved profile (and nothing else)."""
+        return (re.fullmatch(r'[\w.-]+\.(json|prof|folded)', filename) is not None
+                and os.path.isfile(self.path(filename)))
+
+
+class RouteTimings:
+    """Request durations per route: totals plus the last ROUTE_SAMPLES for
+    percentiles."""
+
+    def __init__(self, samples=ROUTE_SAMPLES):
+        self.samples = samples
+        self._routes = {}
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds):
+        with self._lock:
+            timing = self._routes.get(route)
+            if timing is None:
+                timing = self._routes[route] = {"count": 0, "total": 0.0, "max": 0.0,
+                                                "recent": deque(maxlen=self.samples)}
+            timing["count"] += 1
+            timing["total"] += seconds
+            timing["max"] = max(timing["max"], seconds)
+            timing["recent"].append(seconds)
+
+    def slowest(self, limit=None):
+        """Routes by p95 of their recent requests, slowest first."""
+        with self._lock:
+            routes = [(route, dict(timing, recent=sorted(timing["recent"]))) for route, timing in self._routes.items()]
+        rows = []
+        for route, timing in routes:
+            recent = timing["recent"]
+            rows.append({
+                "route": route,
+                "count": timing["count"],
+                "avg_ms": round(timing["total"] / timing["count"] * 1000, 2),
+                "p50_ms": round(recent[len(recent) // 2] * 1000, 2),
+                "p95_ms": round(recent[min(int(len(recent) * 0.95), len(recent) - 1)] * 1000, 2),
+                "max_ms": round(timing["max"] * 1000, 2),
+            })
+        rows.sort(key=lambda row: row["p95_ms"], reverse=True)
+        return rows[:limit] if limit else rows
+
+
+class RequestProfiler:
+    def __init__(self, store=None):
+        self.store = store or ProfileStore()
+        self.stats = {"profiled": 0, "cprofile_busy": 0, "failed": 0}
+
+    def start(self, route, mode):
+        """Start profiling the current thread's request."""
+        if current() is not None:
+            # Left over from a streamed response that was not read to the end
+            self.finish()
+        profile = RequestProfile(route, mode)
+        if mode == 'cprofile':
+            if _cprofile_lock.acquire(blocking=False):
+                profile.profiler = cProfile.Profile()
+                profile.profiler.enable()
+            else:
+                # Another request holds cProfile; this one gets the breakdown only
+                profile.mode = 'breakdown'
+                self.stats["cprofile_busy"] += 1
+        elif mode == 'sample':
+            profile.sampler = StackSampler(threading.get_ident())
+            profile.sampler.start()
+        _local.profile = profile
+        return profile
+
+    def finish(self, status=None):
+        """Stop profiling and save the profile. Returns its breakdown."""
+        profile = current()
+        if profile is None:
+            return None
+        _local.profile = None
+        profile.duration = time.perf_counter() - profile._started
+        profile.status = status
+        if profile.profiler is not None:
+            profile.profiler.disable()
+            _cprofile_lock.release()
+        if profile.sampler is not None:
+            profile.sampler.stop()
+        try:
+            breakdown = self.store.save(profile)
+        except OSError:
+            self.stats["failed"] += 1
+            logger.exception("Could not save the profile of %s", profile.route)
+            return None
+        self.stats["profiled"] += 1
+        return breakdown
@@ -0,0 +1,184 @@
+"""Plan changes with prorated credit, and the subscription period log.
+
+When a member changes plan, the days left on the old subscription are worth
+price * remaining_days / duration_days. duration_days is the old plan's, and
+price is what the subscription was sold at. That credit goes to the new plan:
+
+- change_plan() is a purchase at the desk. The credit is taken off the new
+  plan's price, and credit beyond that price (a downgrade) becomes extra days.
+- convert_plan() is used by bulk migrations, such as retiring a plan. Nothing
+  is charged; the credit buys as many days of the new plan as it pays for.
+
+Every purchase and change is recorded as a subscription period in the
+subscription_periods collection. A period holds the new plan and dates, the
+credit and amount due, and what was left of the subscription it replaced.
+Periods are never updated. Each has a change_id, and a period whose
+change_id is already recorded is skipped, so a retried migration batch does
+not record a change twice.
+"""
+from datetime import datetime, timedelta
+
+from plans import subscription_for
+
+PERIODS_COLLECTION = 'subscription_periods'
+MIGRATION_BATCH_SIZE = 500
+PERIODS_LIMIT = 50
+
+
+def remaining_days(subscription, on):
+    """Whole days of subscription left on the date on (0 once it has ended)."""
+    expiry_date = subscription.get("expiry_date")
+    if expiry_date is None:
+        return 0
+    # A subscription bought ahead of time still has all of its days
+    start = max(on, subscription.get("start_date") or on)
+    return max((expiry_date - start).days, 0)
+
+
+def remaining_credit(subscription, old_plan, on):
+    """(remaining_days, credit) of subscription on the date on.
+
+    Uses the old plan's duration_days. If the plan is gone, the
+    subscription's own length stands in for it.
+    """
+    price = subscription.get("price")
+    if price is None and old_plan is not None:
+        price = old_plan.get("price")
+    duration_days = old_plan.get("duration_days") if old_plan is not None else None
+    if not duration_days:
+        start_date, expiry_date = subscription.get("start_date"), subscription.get("expiry_date")
+        duration_days = (expiry_date - start_date).days if start_date and expiry_date else 0
+
+    days = min(remaining_days(subscription, on), duration_days) if duration_days > 0 else 0
+    if not price or not days:
+        return days, 0
+    return days, round(price * days / duration_days, 2)
+
+
+def _days_bought(credit, plan):
+    if not plan.get("price") or not plan.get("duration_days"):
+        return 0
+    return int(credit * plan["duration_days"] / plan["price"])
+
+
+def change_plan(subscription, old_plan, new_plan, start_date, expiry_date=None):
+    """Subscription fields and proration for buying new_plan on start_date.
+
+    subscription is the member's current one. An explicit expiry_date is
+    kept as entered; leftover credit then only lowers the amount due.
+    """
+    days, credit = remaining_credit(subscription, old_plan, start_date)
+    price = new_plan.get("price") or 0
+    applied = min(credit, price)
+    bonus_days = 0
+    if expiry_date is None:
+        bonus_days = _days_bought(credit - applied, new_plan)
+        expiry_date = start_date + timedelta(days=new_plan["duration_days"] + bonus_days)
+    fields = subscription_for(new_plan, start_date, expiry_date)
+    return fields, {
+        "remaining_days": days,
+        "credit": credit,
+        "credit_applied": applied,
+        "bonus_days": bonus_days,
+        "amount_due": round(price - applied, 2),
+    }
+
+
+def convert_plan(subscription, old_plan, new_plan, on):
+    """Subscription fields and proration for moving to new_plan on the date on.
+
+    Returns (None, None) for a subscription with no days left; there is
+    nothing to convert, and its plan stays as it was sold.
+    """
+    days, credit = remaining_credit(subscription, old_plan, on)
+    if not days:
+        return None, None
+    # A free plan has no price to convert credit into; it keeps the remaining days
+    new_days = _days_bought(credit, new_plan) if new_plan.get("price") else days
+    fields = subscription_for(new_plan, on, on + timedelta(days=new_days))
+    return fields, {
+        "remaining_days": days,
+        "credit": credit,
+        "credit_applied": credit,
+        "bonus_days": 0,
+        "amount_due": 0,
+    }
+
+
+def subscription_period(member_id, branch_id, subscription, reason, change_id,
+                        previous=None, proration=None, admin=None, now=None):
+    """The subscription_periods document for one purchase or plan change."""
+    period = {
+        "change_id": change_id,
+        "member_id": member_id,
+        "branch_id": branch_id,
+        "reason": reason,
+        "plan_id": subscription.get("plan_id"),
+        "plan_name": subscription.get("plan_name"),
+        "price": subscription.get("price"),
+        "start_date": subscription.get("start_date"),
+        "expiry_date": subscription.get("expiry_date"),
+        "amount_due": subscription.get("price") if proration is None else proration["amount_due"],
+        "proration": proration,
+        "previous": None,
+        "admin": admin,
+        "created_at": now or datetime.now(),
+    }
+    if previous:
+        period["previous"] = {field: previous.get(field)
+                              for field in ('plan_id', 'plan_name', 'price', 'start_date', 'expiry_date')}
+    return period
+
+
+def migrate_members(storage, branch_id, old_plan_id, catalog, new_plan, on, key,
+                    batch_size=MIGRATION_BATCH_SIZE, admin=None, on_batch=None):
+    """Move every member of the branch on old_plan_id to new_plan.
+
+    Reads batch_size members at a time from the primary, records their
+    periods and changes their subscriptions in one bulk write per batch.
+    The write only applies to members still on old_plan_id, so running it
+    again after a partial run picks up where it stopped; the periods of
+    members it skips are removed again. key makes the
+    change_ids; pass the same key on a retry. on_batch is called with
+    (member_id, before, after) subscriptions per batch, for the members
+    whose subscription the batch actually changed. Returns
+    (migrated, skipped) where skipped members had no days left. Credit is
+    worked out from the plan version each member bought, looked up in
+    catalog (a PlanCatalog).
+    """
+    after, migrated, skipped = None, 0, 0
+    while True:
+        members = storage.list_members(branch_id, plan_id=old_plan_id, after=after, limit=batch_size,
+                                       fields=['name', 'subscription'], primary=True)
+        if not members:
+            return migrated, skipped
+
+        changes, periods, changed = [], [], []
+        now = datetime.now()
+        for member in members:
+            subscription = member.get("subscription") or {}
+            old_plan = catalog.version(old_plan_id, subscription.get("plan_version"))
+            fields, proration = convert_plan(subscription, old_plan, new_plan, on)
+            if fields is None:
+                skipped += 1
+                continue
+            # Conditional on the expiry date read, so a renewal since then is kept
+            changes.append((member["_id"], old_plan_id, subscription.get("expiry_date"), fields))
+            periods.append(subscription_period(member["_id"], branch_id, fields, 'migration',
+                                               f"{key}:{member['_id']}", previous=subscription,
+                                               proration=proration, admin=admin, now=now))
+            changed.append((member["_id"], subscription, fields))
+
+        if changes:
+            # Periods first: a retry re-reads members that weren't changed yet and
+            # skips the periods already recorded
+            storage.insert_subscription_periods(periods)
+            # Members changed by someone else since they were read are left out,
+            # and so are their periods
+            changed_ids = set(storage.change_subscriptions(branch_id, changes, now))
+            storage.delete_subscription_periods([period["change_id"] for period in periods
+                                                 if period["member_id"] not in changed_ids])
+            migrated += len(changed_ids)
+            if on_batch is not None:
+                on_batch([change for change in changed if change[0] in changed_ids])
+        after = (members[-1].get("name"), members[-1]["_id"])
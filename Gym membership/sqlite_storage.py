@@ -0,0 +1,840 @@
+import json
+import sqlite3
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+from audit import AUDIT_RETENTION_DAYS
+from dedupe import normalize_contact
+from member_details import PROFILE_FIELDS
+from storage import DuplicateMemberError, PlanVersionExistsError, Storage, project
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS plan_versions (
+    plan_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    doc TEXT NOT NULL,
+    PRIMARY KEY (plan_id, version)
+);
+CREATE TABLE IF NOT EXISTS admins (
+    username TEXT PRIMARY KEY,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS members (
+    id TEXT PRIMARY KEY,
+    branch_id TEXT,
+    name TEXT NOT NULL,
+    plan_id INTEGER,
+    expiry_date TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS members_branch_id ON members (branch_id, id);
+CREATE INDEX IF NOT EXISTS members_branch_name ON members (branch_id, name, id);
+DROP INDEX IF EXISTS members_branch_expiry;
+CREATE INDEX IF NOT EXISTS members_branch_expiry_id ON members (branch_id, expiry_date, id);
+CREATE INDEX IF NOT EXISTS members_branch_plan_name ON members (branch_id, plan_id, name, id);
+CREATE UNIQUE INDEX IF NOT EXISTS members_branch_contact
+    ON members (branch_id, json_extract(doc, '$.contact_normalized'))
+    WHERE json_type(doc, '$.contact_normalized') = 'text';
+CREATE TABLE IF NOT EXISTS audit_log (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    member_id TEXT NOT NULL,
+    branch_id TEXT,
+    ts TEXT NOT NULL,
+    change_id TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS audit_member_ts ON audit_log (member_id, ts);
+CREATE UNIQUE INDEX IF NOT EXISTS audit_change_id ON audit_log (change_id);
+CREATE INDEX IF NOT EXISTS audit_ts ON audit_log (ts);
+CREATE TABLE IF NOT EXISTS subscription_periods (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    change_id TEXT NOT NULL UNIQUE,
+    member_id TEXT NOT NULL,
+    branch_id TEXT,
+    created_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS periods_member_created ON subscription_periods (member_id, created_at);
+CREATE TABLE IF NOT EXISTS member_profiles (
+    member_id TEXT PRIMARY KEY,
+    branch_id TEXT,
+    doc TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payment_id TEXT NOT NULL UNIQUE,
+    member_id TEXT NOT NULL,
+    branch_id TEXT,
+    date TEXT,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS payments_member_date ON payments (member_id, date);
+CREATE TABLE IF NOT EXISTS notifications (
+    key TEXT PRIMARY KEY,
+    branch_id TEXT,
+    created_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS notifications_branch_created ON notifications (branch_id, created_at);
+CREATE TABLE IF NOT EXISTS card_revocations (
+    member_id TEXT PRIMARY KEY,
+    updated_at TEXT NOT NULL,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS card_revocations_updated ON card_revocations (updated_at);
+CREATE TABLE IF NOT EXISTS checkins (
+    branch_id TEXT NOT NULL,
+    member_id TEXT NOT NULL,
+    ts TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS checkins_branch_member_ts ON checkins (branch_id, member_id, ts);
+CREATE INDEX IF NOT EXISTS checkins_branch_ts ON checkins (branch_id, ts);
+CREATE TABLE IF NOT EXISTS jobs (
+    id TEXT PRIMARY KEY,
+    branch_id TEXT,
+    type TEXT NOT NULL,
+    status TEXT NOT NULL,
+    run_after TEXT,
+    lease_until TEXT,
+    created_at TEXT NOT NULL,
+    idempotency_key TEXT UNIQUE,
+    doc TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS jobs_status_run_after ON jobs (status, run_after);
+CREATE INDEX IF NOT EXISTS jobs_branch_created ON jobs (branch_id, created_at);
+CREATE TABLE IF NOT EXISTS leases (
+    name TEXT PRIMARY KEY,
+    owner TEXT,
+    until TEXT,
+    state TEXT
+);
+"""
+
+# Statements are module constants so sqlite3's per-connection statement
+# cache reuses the compiled (prepared) statement on every call
+INSERT_MEMBER = ("INSERT INTO members (id, branch_id, name, plan_id, expiry_date, doc) "
+                 "VALUES (?, ?, ?, ?, ?, ?)")
+UPDATE_MEMBER = ("UPDATE members SET branch_id = ?, name = ?, plan_id = ?, expiry_date = ?, doc = ? "
+                 "WHERE id = ?")
+SELECT_MEMBER = "SELECT doc FROM members WHERE id = ? AND branch_id = ?"
+SELECT_MEMBER_EXPIRY = "SELECT expiry_date FROM members WHERE id = ? AND branch_id = ?"
+SELECT_MEMBER_VERSION = ("SELECT json_extract(doc, '$.updated_at.\"$date\"') FROM members "
+                         "WHERE id = ? AND branch_id = ?")
+DELETE_MEMBER = "DELETE FROM members WHERE id = ? AND branch_id = ?"
+SELECT_EXPIRED = ("SELECT doc FROM members WHERE branch_id = ? AND expiry_date < ? "
+                  "ORDER BY expiry_date")
+INSERT_CHECKIN = "INSERT INTO checkins (branch_id, member_id, ts) VALUES (?, ?, ?)"
+INSERT_AUDIT = ("INSERT OR IGNORE INTO audit_log (member_id, branch_id, ts, change_id, doc) "
+                "VALUES (?, ?, ?, ?, ?)")
+SELECT_SNAPSHOT = ("SELECT plan_id, json_extract(doc, '$.subscription.start_date.\"$date\"'), expiry_date, "
+                   "json_extract(doc, '$.created_at.\"$date\"') FROM members WHERE branch_id = ?")
+SELECT_WITHOUT_PLAN_FIELDS = ("SELECT id, plan_id FROM members WHERE id > ? "
+                              "AND json_extract(doc, '$.subscription.plan_name') IS NULL ORDER BY id LIMIT ?")
+INSERT_JOB = ("INSERT INTO jobs (branch_id, type, status, run_after, lease_until, created_at, "
+              "idempotency_key, doc, id) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+UPDATE_JOB = ("UPDATE jobs SET branch_id = ?, type = ?, status = ?, run_after = ?, lease_until = ?, "
+              "created_at = ?, idempotency_key = ?, doc = ? WHERE id = ?")
+SELECT_EXPIRING = ("SELECT expiry_date, id, json_extract(doc, '$.subscription.status') FROM members "
+                   "WHERE branch_id = ? AND expiry_date > ? AND expiry_date <= ? "
+                   "AND (expiry_date > ? OR (expiry_date = ? AND id > ?)) "
+                   "ORDER BY expiry_date, id LIMIT ?")
+SELECT_BY_CONTACT = ("SELECT id FROM members WHERE branch_id = ? "
+                     "AND json_extract(doc, '$.contact_normalized') = ? "
+                     "AND json_type(doc, '$.contact_normalized') = 'text'")
+SELECT_WITHOUT_NORMALIZED = ("SELECT id, json_extract(doc, '$.contact'), json_extract(doc, '$.email') "
+                             "FROM members WHERE id > ? AND json_type(doc, '$.contact_normalized') IS NULL "
+                             "ORDER BY id LIMIT ?")
+# normalize_contact() is registered on every connection
+SELECT_DUPLICATE_CONTACTS = ("SELECT branch_id, normalize_contact(json_extract(doc, '$.contact')) AS contact, "
+                             "group_concat(id) FROM members GROUP BY branch_id, contact "
+                             "HAVING contact IS NOT NULL AND COUNT(*) > 1")
+INSERT_PERIOD = ("INSERT OR IGNORE INTO subscription_periods (change_id, member_id, branch_id, created_at, doc) "
+                 "VALUES (?, ?, ?, ?, ?)")
+SELECT_PERIODS = ("SELECT doc FROM subscription_periods WHERE member_id = ? AND branch_id = ? "
+                  "ORDER BY created_at DESC LIMIT ?")
+INSERT_PLAN_VERSION = "INSERT INTO plan_versions (plan_id, version, doc) VALUES (?, ?, ?)"
+SELECT_WITH_COLD_FIELDS = (
+    "SELECT doc FROM members WHERE id > ? AND ("
+    + " OR ".join(f"json_type(doc, '$.{field}') IS NOT NULL" for field in PROFILE_FIELDS + ("subscription.payments",))
+    + ") ORDER BY id LIMIT ?")
+SELECT_PROFILE = "SELECT doc FROM member_profiles WHERE member_id = ? AND branch_id = ?"
+UPSERT_PROFILE = "INSERT OR REPLACE INTO member_profiles (member_id, branch_id, doc) VALUES (?, ?, ?)"
+DELETE_PROFILE = "DELETE FROM member_profiles WHERE member_id = ? AND branch_id = ?"
+INSERT_PAYMENT = ("INSERT OR IGNORE INTO payments (payment_id, member_id, branch_id, date, doc) "
+                  "VALUES (?, ?, ?, ?, ?)")
+SELECT_PAYMENTS = ("SELECT doc FROM payments WHERE member_id = ? AND branch_id = ? "
+                   "ORDER BY date DESC LIMIT ?")
+DELETE_PAYMENTS = "DELETE FROM payments WHERE member_id = ? AND branch_id = ?"
+INSERT_NOTIFICATION = "INSERT OR IGNORE INTO notifications (key, branch_id, created_at, doc) VALUES (?, ?, ?, ?)"
+SELECT_NOTIFICATIONS = ("SELECT doc FROM notifications WHERE branch_id = ? "
+                        "ORDER BY created_at DESC LIMIT ?")
+UPSERT_CARD_REVOCATION = ("INSERT INTO card_revocations (member_id, updated_at, doc) VALUES (?, ?, ?) "
+                          "ON CONFLICT (member_id) DO UPDATE SET updated_at = excluded.updated_at, doc = excluded.doc")
+SELECT_HISTORY = ("SELECT doc FROM audit_log WHERE member_id = ? AND branch_id = ? "
+                  "ORDER BY ts DESC LIMIT ?")
+
+
+def to_timestamp(value):
+    # Fixed-width "YYYY-MM-DD HH:MM:SS.ffffff", so string order is chronological
+    return value.isoformat(' ', 'microseconds') if value is not None else None
+
+
+def from_timestamp(value):
+    return datetime.fromisoformat(value) if value is not None else None
+
+
+def _encode(value):
+    if isinstance(value, datetime):
+        return {"$date": to_timestamp(value)}
+    if isinstance(value, ObjectId):
+        return {"$oid": str(value)}
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _decode(value):
+    if len(value) == 1:
+        if "$date" in value:
+            return from_timestamp(value["$date"])
+        if "$oid" in value:
+            return ObjectId(value["$oid"])
+    return value
+
+
+def dump_document(document):
+    return json.dumps(document, default=_encode, separators=(',', ':'))
+
+
+def load_document(raw):
+    return json.loads(raw, object_hook=_decode)
+
+
+def member_row(member):
+    subscription = member.get("subscription") or {}
+    return (
+        str(member["_id"]),
+        member.get("branch_id"),
+        member.get("name") or '',
+        subscription.get("plan_id"),
+        to_timestamp(subscription.get("expiry_date")),
+        dump_document(member),
+    )
+
+
+def job_row(job):
+    return (
+        job.get("branch_id"),
+        job["type"],
+        job["status"],
+        to_timestamp(job.get("run_after")),
+        to_timestamp(job.get("lease_until")),
+        to_timestamp(job["created_at"]),
+        job.get("idempotency_key"),
+        dump_document(job),
+        str(job["_id"]),
+    )
+
+
+class SqliteCheckinStore:
+    """SQLite counterpart of checkins.CheckinStore."""
+
+    bucketed = False
+
+    def __init__(self, storage):
+        self.storage = storage
+
+    def ensure_collection(self, bucketed=None):
+        pass
+
+    def record(self, branch_id, member_id, ts=None):
+        self.record_many([(branch_id, member_id, ts or datetime.now())])
+
+    def record_many(self, checkins):
+        with self.storage.transaction() as conn:
+            conn.executemany(INSERT_CHECKIN, [
+                (branch_id, str(member_id), to_timestamp(ts)) for branch_id, member_id, ts in checkins
+            ])
+
+    def reassign(self, member_ids, new_member_id):
+        with self.storage.transaction() as conn:
+            conn.executemany("UPDATE checkins SET member_id = ? WHERE member_id = ?",
+                             [(str(new_member_id), str(member_id)) for member_id in member_ids])
+
+    def member_checkins(self, branch_id, member_id, limit=50):
+        rows = self.storage.connection().execute(
+            "SELECT ts FROM checkins WHERE branch_id = ? AND member_id = ? ORDER BY ts DESC LIMIT ?",
+            (branch_id, str(member_id), limit)
+        )
+        return [{"ts": from_timestamp(ts)} for (ts,) in rows]
+
+    def hourly_occupancy(self, branch_id, start, end):
+        rows = self.storage.connection().execute(
+            "SELECT substr(ts, 1, 13), COUNT(*), COUNT(DISTINCT member_id) FROM checkins "
+            "WHERE branch_id = ? AND ts >= ? AND ts < ? GROUP BY 1 ORDER BY 1",
+            (branch_id, to_timestamp(start), to_timestamp(end))
+        )
+        return [
+            {"hour": datetime.strptime(hour, '%Y-%m-%d %H'), "checkins": count, "unique_members": unique}
+            for hour, count, unique in rows
+        ]
+
+
+class SqliteStorage(Storage):
+    """Embedded single-file storage for branches that don't run mongod.
+
+    Each table keeps the whole document as JSON next to the columns that are
+    filtered or sorted on, so documents keep their MongoDB shape while the
+    queries use the same (branch-led) indexes as the MongoDB backend. The
+    database runs in WAL mode so readers never block the writer, and every
+    thread reuses its own connection.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self.checkins = SqliteCheckinStore(self)
+
+    def connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, cached_statements=256)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute("PRAGMA busy_timeout=5000")
+            conn.create_function("normalize_contact", 1, normalize_contact, deterministic=True)
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def ping(self):
+        self.connection().execute("SELECT 1").fetchone()
+
+    def ensure_indexes(self):
+        self._migrate_checkins()
+        self._migrate_audit_log()
+        self.connection().executescript(SCHEMA)
+        self._migrate_plans()
+        # SQLite has no TTL indexes; expired audit entries are purged at startup
+        cutoff = datetime.now() - timedelta(days=AUDIT_RETENTION_DAYS)
+        with self.transaction() as conn:
+            conn.execute("DELETE FROM audit_log WHERE ts < ?", (to_timestamp(cutoff),))
+
+    def _migrate_checkins(self):
+        # Check-ins used to have no branch_id; they get their member's branch
+        with self.transaction() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(checkins)")]
+            if not columns or 'branch_id' in columns:
+                return
+            conn.execute("ALTER TABLE checkins ADD COLUMN branch_id TEXT")
+            conn.execute("UPDATE checkins SET branch_id = "
+                         "(SELECT branch_id FROM members WHERE members.id = checkins.member_id)")
+            conn.execute("DROP INDEX IF EXISTS checkins_member_ts")
+            conn.execute("DROP INDEX IF EXISTS checkins_ts")
+
+    def _migrate_audit_log(self):
+        # audit_log used to have no change_id column; SCHEMA indexes it
+        with self.transaction() as conn:
+            columns = [row[1] for row in conn.execute("PRAGMA table_info(audit_log)")]
+            if columns and 'change_id' not in columns:
+                conn.execute("ALTER TABLE audit_log ADD COLUMN change_id TEXT")
+
+    def _migrate_plans(self):
+        # Plans used to be one row per plan_id in "plans"; they become version 1
+        with self.transaction() as conn:
+            if conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'plans'").fetchone() is None:
+                return
+            for plan_id, doc in conn.execute("SELECT plan_id, doc FROM plans").fetchall():
+                plan = load_document(doc)
+                plan.setdefault("version", 1)
+                conn.execute(INSERT_PLAN_VERSION, (plan_id, plan["version"], dump_document(plan)))
+            conn.execute("DROP TABLE plans")
+
+    def count_plans(self):
+        return self.connection().execute("SELECT COUNT(*) FROM plan_versions").fetchone()[0]
+
+    def insert_plans(self, plans):
+        with self.transaction() as conn:
+            for plan in plans:
+                plan.setdefault("_id", ObjectId())
+                conn.execute(INSERT_PLAN_VERSION, (plan["plan_id"], plan.get("version", 1), dump_document(plan)))
+
+    def list_plans(self):
+        rows = self.connection().execute("SELECT doc FROM plan_versions ORDER BY plan_id, version")
+        return [load_document(doc) for (doc,) in rows]
+
+    def get_plan(self, plan_id):
+        row = self.connection().execute("SELECT doc FROM plan_versions WHERE plan_id = ? "
+                                        "ORDER BY version DESC LIMIT 1", (plan_id,)).fetchone()
+        return load_document(row[0]) if row else None
+
+    def insert_plan_version(self, plan):
+        plan.setdefault("_id", ObjectId())
+        try:
+            with self.transaction() as conn:
+                conn.execute(INSERT_PLAN_VERSION, (plan["plan_id"], plan["version"], dump_document(plan)))
+        except sqlite3.IntegrityError:
+            raise PlanVersionExistsError(plan["plan_id"], plan["version"])
+
+    def count_admins(self):
+        return self.connection().execute("SELECT COUNT(*) FROM admins").fetchone()[0]
+
+    def insert_admin(self, admin):
+        admin.setdefault("_id", ObjectId())
+        with self.transaction() as conn:
+            conn.execute("INSERT INTO admins (username, doc) VALUES (?, ?)",
+                         (admin["username"], dump_document(admin)))
+
+    def find_admin(self, username):
+        row = self.connection().execute("SELECT doc FROM admins WHERE username = ?", (username,)).fetchone()
+        return load_document(row[0]) if row else None
+
+    def record_logins(self, logins):
+        with self.transaction() as conn:
+            for username, ts in logins:
+                row = conn.execute("SELECT doc FROM admins WHERE username = ?", (username,)).fetchone()
+                if row:
+                    admin = load_document(row[0])
+                    admin["last_login"] = ts
+                    conn.execute("UPDATE admins SET doc = ? WHERE username = ?",
+                                 (dump_document(admin), username))
+
+    def count_members(self):
+        return self.connection().execute("SELECT COUNT(*) FROM members").fetchone()[0]
+
+    def insert_members(self, members):
+        for member in members:
+            member.setdefault("_id", ObjectId())
+        with self.transaction() as conn:
+            conn.executemany(INSERT_MEMBER, [member_row(member) for member in members])
+
+    def assign_default_branch(self, branch_id):
+        with self.transaction() as conn:
+            for table, key in (("members", "id"), ("admins", "username")):
+                rows = conn.execute(f"SELECT {key}, doc FROM {table}").fetchall()
+                for row_key, raw in rows:
+                    document = load_document(raw)
+                    if "branch_id" not in document:
+                        document["branch_id"] = branch_id
+                        conn.execute(f"UPDATE {table} SET doc = ? WHERE {key} = ?",
+                                     (dump_document(document), row_key))
+            conn.execute("UPDATE members SET branch_id = ? WHERE branch_id IS NULL", (branch_id,))
+
+    def insert_member(self, member):
+        member.setdefault("_id", ObjectId())
+        with self.transaction() as conn:
+            try:
+                conn.execute(INSERT_MEMBER, member_row(member))
+            except sqlite3.IntegrityError:
+                row = conn.execute(SELECT_BY_CONTACT, (member.get("branch_id"),
+                                                       member.get("contact_normalized"))).fetchone()
+                if row is None:
+                    raise
+                raise DuplicateMemberError(ObjectId(row[0]))
+        return member["_id"]
+
+    def get_members(self, branch_id, member_ids):
+        member_ids = [str(member_id) for member_id in member_ids]
+        placeholders = ', '.join('?' * len(member_ids))
+        rows = self.connection().execute(
+            f"SELECT doc FROM members WHERE branch_id = ? AND id IN ({placeholders})", [branch_id] + member_ids)
+        return [load_document(doc) for (doc,) in rows]
+
+    def list_members(self, branch_id, plan_id=None, after=None, limit=None, fields=None, primary=False):
+        sql = "SELECT doc FROM members WHERE branch_id = ?"
+        params = [branch_id]
+        if plan_id is not None:
+            sql += " AND plan_id = ?"
+            params.append(plan_id)
+        if after is not None:
+            last_name, last_id = after
+            sql += " AND (name > ? OR (name = ? AND id > ?))"
+            params += [last_name or '', last_name or '', str(last_id)]
+        sql += " ORDER BY name, id LIMIT ?"
+        params.append(limit if limit is not None else -1)
+
+        rows = self.connection().execute(sql, params)
+        return [project(load_document(doc), fields) if fields is not None else load_document(doc)
+                for (doc,) in rows]
+
+    def expired_members(self, branch_id, now, primary=False):
+        rows = self.connection().execute(SELECT_EXPIRED, (branch_id, to_timestamp(now)))
+        return [load_document(doc) for (doc,) in rows]
+
+    def member_snapshot(self, branch_id, batch_size):
+        cursor = self.connection().execute(SELECT_SNAPSHOT, (branch_id,))
+        while True:
+            rows = cursor.fetchmany(batch_size)
+            if not rows:
+                break
+            yield [(plan_id, from_timestamp(start), from_timestamp(expiry), from_timestamp(created))
+                   for plan_id, start, expiry, created in rows]
+
+    def get_member(self, branch_id, member_id, fields=None):
+        row = self.connection().execute(SELECT_MEMBER, (str(member_id), branch_id)).fetchone()
+        if row is None:
+            return None
+        member = load_document(row[0])
+        return project(member, fields) if fields is not None else member
+
+    def get_member_expiry(self, branch_id, member_id):
+        row = self.connection().execute(SELECT_MEMBER_EXPIRY, (str(member_id), branch_id)).fetchone()
+        return from_timestamp(row[0]) if row else None
+
+    def get_member_version(self, branch_id, member_id):
+        row = self.connection().execute(SELECT_MEMBER_VERSION, (str(member_id), branch_id)).fetchone()
+        return from_timestamp(row[0]) if row else None
+
+    def update_subscription(self, branch_id, member_id, subscription, updated_at):
+        with self.transaction() as conn:
+            row = conn.execute(SELECT_MEMBER, (str(member_id), branch_id)).fetchone()
+            if row is None:
+                return None
+
+            member = load_document(row[0])
+            before = {"_id": member["_id"], "subscription": dict(member.get("subscription") or {})}
+            member.setdefault("subscription", {}).update(subscription)
+            member["updated_at"] = updated_at
+            values = member_row(member)
+            conn.execute(UPDATE_MEMBER, values[1:] + values[:1])
+        return before
+
+    def change_subscriptions(self, branch_id, changes, updated_at):
+        changed = []
+        with self.transaction() as conn:
+            for member_id, plan_id, expiry_date, subscription in changes:
+                row = conn.execute(SELECT_MEMBER, (str(member_id), branch_id)).fetchone()
+                if row is None:
+                    continue
+                member = load_document(row[0])
+                current = member.get("subscription") or {}
+                if current.get("plan_id") != plan_id or current.get("expiry_date") != expiry_date:
+                    continue
+                member.setdefault("subscription", {}).update(subscription)
+                member["updated_at"] = updated_at
+                values = member_row(member)
+                conn.execute(UPDATE_MEMBER, values[1:] + values[:1])
+                changed.append(member_id)
+        return changed
+
+    def delete_member(self, branch_id, member_id):
+        with self.transaction() as conn:
+            row = conn.execute(SELECT_MEMBER, (str(member_id), branch_id)).fetchone()
+            if row is None:
+                return None
+            conn.execute(DELETE_MEMBER, (str(member_id), branch_id))
+            conn.execute(DELETE_PROFILE, (str(member_id), branch_id))
+            conn.execute(DELETE_PAYMENTS, (str(member_id), branch_id))
+        return load_document(row[0])
+
+    def delete_members(self, branch_id, member_ids):
+        keys = [(str(member_id), branch_id) for member_id in member_ids]
+        with self.transaction() as conn:
+            deleted = conn.executemany(DELETE_MEMBER, keys).rowcount
+            conn.executemany(DELETE_PROFILE, keys)
+            conn.executemany(DELETE_PAYMENTS, keys)
+            return deleted
+
+    def list_branches(self):
+        return [branch_id for (branch_id,) in self.connection().execute("SELECT DISTINCT branch_id FROM members")]
+
+    def members_expiring_between(self, branch_id, low, high, after, limit):
+        # '' sorts before every timestamp, so it stands in for "no bound"
+        last_expiry, last_id = (to_timestamp(after[0]), str(after[1])) if after is not None else ('', '')
+        rows = self.connection().execute(SELECT_EXPIRING, (
+            branch_id, to_timestamp(low) if low is not None else '', to_timestamp(high),
+            last_expiry, last_expiry, last_id, limit))
+        return [(from_timestamp(expiry), ObjectId(member_id), status) for expiry, member_id, status in rows]
+
+    def mark_expired(self, branch_id, member_ids, updated_at):
+        updated = 0
+        with self.transaction() as conn:
+            for member_id in member_ids:
+                row = conn.execute(SELECT_MEMBER, (str(member_id), branch_id)).fetchone()
+                if row is None:
+                    continue
+                member = load_document(row[0])
+                subscription = member.setdefault("subscription", {})
+                if subscription.get("status") != "expired":
+                    subscription["status"] = "expired"
+                    member["updated_at"] = updated_at
+                    conn.execute("UPDATE members SET doc = ? WHERE id = ?", (dump_document(member), str(member_id)))
+                    updated += 1
+        return updated
+
+    def members_without_plan_fields(self, after, limit):
+        # Hex ObjectId strings sort in ObjectId order
+        rows = self.connection().execute(SELECT_WITHOUT_PLAN_FIELDS,
+                                         (str(after) if after is not None else '', limit))
+        return [(ObjectId(member_id), plan_id) for member_id, plan_id in rows]
+
+    def set_plan_fields(self, updates):
+        updated = 0
+        with self.transaction() as conn:
+            for member_id, plan_id, fields in updates:
+                row = conn.execute("SELECT doc FROM members WHERE id = ?", (str(member_id),)).fetchone()
+                if row is None:
+                    continue
+                member = load_document(row[0])
+                subscription = member.get("subscription") or {}
+                if subscription.get("plan_id") == plan_id and subscription.get("plan_name") is None:
+                    subscription.update(fields)
+                    conn.execute("UPDATE members SET doc = ? WHERE id = ?", (dump_document(member), str(member_id)))
+                    updated += 1
+        return updated
+
+    def members_without_normalized_fields(self, after, limit):
+        rows = self.connection().execute(SELECT_WITHOUT_NORMALIZED,
+                                         (str(after) if after is not None else '', limit))
+        return [(ObjectId(member_id), contact, email) for member_id, contact, email in rows]
+
+    def set_normalized_fields(self, updates):
+        updated = 0
+        with self.transaction() as conn:
+            for member_id, fields in updates:
+                row = conn.execute("SELECT doc FROM members WHERE id = ?", (str(member_id),)).fetchone()
+                if row is None:
+                    continue
+                member = load_document(row[0])
+                if "contact_normalized" in member:
+                    continue
+                member.update(fields)
+                try:
+                    conn.execute("UPDATE members SET doc = ? WHERE id = ?", (dump_document(member), str(member_id)))
+                except sqlite3.IntegrityError:
+                    # The contact is taken in this branch; left for dedupe.py
+                    continue
+                updated += 1
+        return updated
+
+    def duplicate_contact_groups(self):
+        rows = self.connection().execute(SELECT_DUPLICATE_CONTACTS).fetchall()
+        for branch_id, contact, member_ids in rows:
+            yield branch_id, contact, sorted(ObjectId(member_id) for member_id in member_ids.split(','))
+
+    def merge_members(self, branch_id, merged, duplicate_ids):
+        with self.transaction() as conn:
+            deleted = conn.executemany(DELETE_MEMBER, [(str(member_id), branch_id)
+                                                       for member_id in duplicate_ids]).rowcount
+            conn.executemany("UPDATE checkins SET member_id = ? WHERE member_id = ?",
+                             [(str(merged["_id"]), str(member_id)) for member_id in duplicate_ids])
+            for member_id in duplicate_ids:
+                rows = conn.execute("SELECT id, doc FROM payments WHERE member_id = ? AND branch_id = ?",
+                                    (str(member_id), branch_id)).fetchall()
+                for row_id, doc in rows:
+                    payment = load_document(doc)
+                    payment["member_id"] = merged["_id"]
+                    conn.execute("UPDATE payments SET member_id = ?, doc = ? WHERE id = ?",
+                                 (str(merged["_id"]), dump_document(payment), row_id))
+            conn.executemany(DELETE_PROFILE, [(str(member_id), branch_id) for member_id in duplicate_ids])
+            values = member_row(merged)
+            conn.execute(UPDATE_MEMBER + " AND branch_id = ?", values[1:] + values[:1] + (branch_id,))
+        return deleted
+
+    def insert_job(self, job):
+        job.setdefault("_id", ObjectId())
+        with self.transaction() as conn:
+            try:
+                conn.execute(INSERT_JOB, job_row(job))
+            except sqlite3.IntegrityError:
+                row = conn.execute("SELECT doc FROM jobs WHERE idempotency_key = ?",
+                                   (job.get("idempotency_key"),)).fetchone()
+                if row is None:
+                    raise
+                return load_document(row[0])
+        return job
+
+    def claim_job(self, types, now, lease_until):
+        placeholders = ', '.join('?' * len(types))
+        with self.transaction() as conn:
+            row = conn.execute(
+                f"SELECT doc FROM jobs WHERE type IN ({placeholders}) AND "
+                "((status = 'queued' AND run_after <= ?) OR (status = 'running' AND lease_until < ?)) "
+                "ORDER BY run_after LIMIT 1",
+                list(types) + [to_timestamp(now), to_timestamp(now)]).fetchone()
+            if row is None:
+                return None
+            job = load_document(row[0])
+            job.update(status="running", started_at=now, lease_until=lease_until, attempts=job["attempts"] + 1)
+            conn.execute(UPDATE_JOB, job_row(job))
+        return job
+
+    def update_job(self, job_id, changes):
+        with self.transaction() as conn:
+            row = conn.execute("SELECT doc FROM jobs WHERE id = ?", (str(job_id),)).fetchone()
+            if row is None:
+                return None
+            job = load_document(row[0])
+            job.update(changes)
+            conn.execute(UPDATE_JOB, job_row(job))
+        return job
+
+    def get_job(self, job_id):
+        row = self.connection().execute("SELECT doc FROM jobs WHERE id = ?", (str(job_id),)).fetchone()
+        return load_document(row[0]) if row else None
+
+    def list_jobs(self, branch_id, limit):
+        rows = self.connection().execute(
+            "SELECT doc FROM jobs WHERE branch_id = ? ORDER BY created_at DESC LIMIT ?", (branch_id, limit))
+        return [load_document(doc) for (doc,) in rows]
+
+    def acquire_lease(self, name, owner, now, until):
+        with self.transaction() as conn:
+            row = conn.execute("SELECT owner, until, state FROM leases WHERE name = ?", (name,)).fetchone()
+            if row is None:
+                state = None
+                conn.execute("INSERT INTO leases (name, owner, until) VALUES (?, ?, ?)",
+                             (name, owner, to_timestamp(until)))
+            else:
+                holder, held_until, state = row
+                if holder != owner and held_until is not None and from_timestamp(held_until) >= now:
+                    return None
+                conn.execute("UPDATE leases SET owner = ?, until = ? WHERE name = ?",
+                             (owner, to_timestamp(until), name))
+        return {"_id": name, "owner": owner, "until": until,
+                "state": load_document(state) if state is not None else None}
+
+    def release_lease(self, name, owner, state):
+        with self.transaction() as conn:
+            conn.execute("UPDATE leases SET state = ?, until = NULL WHERE name = ? AND owner = ?",
+                         (dump_document(state), name, owner))
+
+    def insert_audit_entries(self, entries):
+        with self.transaction() as conn:
+            conn.executemany(INSERT_AUDIT, [
+                (str(entry["member_id"]), entry.get("branch_id"), to_timestamp(entry["ts"]),
+                 entry.get("change_id"), dump_document(entry))
+                for entry in entries
+            ])
+
+    def member_history(self, branch_id, member_id, limit):
+        rows = self.connection().execute(SELECT_HISTORY, (str(member_id), branch_id, limit))
+        return [load_document(doc) for (doc,) in rows]
+
+    def insert_subscription_periods(self, periods):
+        with self.transaction() as conn:
+            for period in periods:
+                period.setdefault("_id", ObjectId())
+            conn.executemany(INSERT_PERIOD, [
+                (period["change_id"], str(period["member_id"]), period.get("branch_id"),
+                 to_timestamp(period["created_at"]), dump_document(period))
+                for period in periods
+            ])
+
+    def subscription_periods(self, branch_id, member_id, limit):
+        rows = self.connection().execute(SELECT_PERIODS, (str(member_id), branch_id, limit))
+        return [load_document(doc) for (doc,) in rows]
+
+    def delete_subscription_periods(self, change_ids):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM subscription_periods WHERE change_id = ?",
+                             [(change_id,) for change_id in change_ids])
+
+    def members_with_cold_fields(self, after, limit):
+        rows = self.connection().execute(SELECT_WITH_COLD_FIELDS,
+                                         (str(after) if after is not None else '', limit))
+        return [load_document(doc) for (doc,) in rows]
+
+    def move_cold_fields(self, moves):
+        changed = 0
+        with self.transaction() as conn:
+            for member_id, branch_id, profile, payments in moves:
+                if profile:
+                    row = conn.execute("SELECT doc FROM member_profiles WHERE member_id = ?",
+                                       (str(member_id),)).fetchone()
+                    stored = load_document(row[0]) if row else {"_id": ObjectId(), "member_id": member_id}
+                    stored.update(profile, branch_id=branch_id)
+                    conn.execute(UPSERT_PROFILE, (str(member_id), branch_id, dump_document(stored)))
+                self._insert_payments(conn, payments)
+
+                row = conn.execute("SELECT doc FROM members WHERE id = ?", (str(member_id),)).fetchone()
+                if row is None:
+                    continue
+                member = load_document(row[0])
+                removed = [member.pop(field) for field in PROFILE_FIELDS if field in member]
+                if "payments" in (member.get("subscription") or {}):
+                    removed.append(member["subscription"].pop("payments"))
+                if removed:
+                    conn.execute("UPDATE members SET doc = ? WHERE id = ?", (dump_document(member), str(member_id)))
+                    changed += 1
+        return changed
+
+    def get_member_profile(self, branch_id, member_id):
+        row = self.connection().execute(SELECT_PROFILE, (str(member_id), branch_id)).fetchone()
+        return load_document(row[0]) if row else None
+
+    def _insert_payments(self, conn, payments):
+        for payment in payments:
+            payment.setdefault("_id", ObjectId())
+        conn.executemany(INSERT_PAYMENT, [
+            (payment["payment_id"], str(payment["member_id"]), payment.get("branch_id"),
+             to_timestamp(payment.get("date")), dump_document(payment))
+            for payment in payments
+        ])
+
+    def insert_payments(self, payments):
+        with self.transaction() as conn:
+            self._insert_payments(conn, payments)
+
+    def member_payments(self, branch_id, member_id, limit):
+        rows = self.connection().execute(SELECT_PAYMENTS, (str(member_id), branch_id, limit))
+        return [load_document(doc) for (doc,) in rows]
+
+    def claim_notifications(self, entries):
+        claimed = []
+        with self.transaction() as conn:
+            for entry in entries:
+                entry.setdefault("_id", ObjectId())
+                cursor = conn.execute(INSERT_NOTIFICATION, (entry["key"], entry.get("branch_id"),
+                                                            to_timestamp(entry["created_at"]), dump_document(entry)))
+                if cursor.rowcount:
+                    claimed.append(entry["key"])
+        return claimed
+
+    def mark_notifications_sent(self, keys, sent_at):
+        with self.transaction() as conn:
+            for key in keys:
+                row = conn.execute("SELECT doc FROM notifications WHERE key = ?", (key,)).fetchone()
+                if row is None:
+                    continue
+                entry = load_document(row[0])
+                entry.update(status="sent", sent_at=sent_at)
+                conn.execute("UPDATE notifications SET doc = ? WHERE key = ?", (dump_document(entry), key))
+
+    def release_notifications(self, keys):
+        with self.transaction() as conn:
+            conn.executemany("DELETE FROM notifications WHERE key = ?", [(key,) for key in keys])
+
+    def recent_notifications(self, branch_id, limit):
+        rows = self.connection().execute(SELECT_NOTIFICATIONS, (branch_id, limit))
+        return [load_document(doc) for (doc,) in rows]
+
+    def revoke_cards(self, member_id, branch_id, revoked_before, expires_at, reason, updated_at):
+        with self.transaction() as conn:
+            row = conn.execute("SELECT doc FROM card_revocations WHERE member_id = ?", (str(member_id),)).fetchone()
+            revocation = load_document(row[0]) if row else {"_id": ObjectId(), "member_id": member_id,
+                                                            "revoked_before": revoked_before, "expires_at": expires_at}
+            revocation.update(revoked_before=max(revocation["revoked_before"], revoked_before),
+                              expires_at=max(revocation["expires_at"], expires_at),
+                              branch_id=branch_id, reason=reason, updated_at=updated_at)
+            conn.execute(UPSERT_CARD_REVOCATION, (str(member_id), to_timestamp(updated_at), dump_document(revocation)))
+
+    def card_revocations(self, since):
+        if since is None:
+            rows = self.connection().execute("SELECT doc FROM card_revocations ORDER BY updated_at")
+        else:
+            rows = self.connection().execute("SELECT doc FROM card_revocations WHERE updated_at >= ? "
+                                             "ORDER BY updated_at", (to_timestamp(since),))
+        return [load_document(doc) for (doc,) in rows]
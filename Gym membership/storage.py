@@ -0,0 +1,419 @@
+import os
+from contextlib import contextmanager
+
+STORAGE_BACKEND = os.environ.get('GYM_STORAGE', 'mongo')
+MONGO_URI = os.environ.get('GYM_MONGO_URI', 'mongodb://localhost:27017/')
+SQLITE_PATH = os.environ.get('GYM_SQLITE_PATH', 'gym.db')
+# Where list, report and analytics reads go on a replica set (MongoDB only)
+READ_PREFERENCE = os.environ.get('GYM_READ_PREFERENCE', 'secondaryPreferred')
+MAX_STALENESS_SECONDS = int(os.environ.get('GYM_MAX_STALENESS_SECONDS', 90))  # 90 is the server minimum
+# Connections the MongoDB driver keeps open per server, opened during warm-up
+MONGO_MIN_POOL_SIZE = int(os.environ.get('GYM_MONGO_MIN_POOL_SIZE', 5))
+
+
+def clone(value):
+    if isinstance(value, dict):
+        return {key: clone(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [clone(item) for item in value]
+    return value
+
+
+def project(document, fields):
+    if fields is None:
+        return clone(document)
+
+    result = {"_id": document["_id"]}
+    for field in fields:
+        source, target = document, result
+        parts = field.split('.')
+        for part in parts[:-1]:
+            source = source.get(part) if isinstance(source, dict) else None
+            if not isinstance(source, dict):
+                break
+            target = target.setdefault(part, {})
+        else:
+            if parts[-1] in source:
+                target[parts[-1]] = clone(source[parts[-1]])
+    return result
+
+
+class DuplicateMemberError(Exception):
+    """Another member of the branch already has this contact number."""
+
+    def __init__(self, existing_id):
+        super().__init__(f"A member with this contact number already exists (ID: {existing_id})")
+        self.existing_id = existing_id
+
+
+class PlanVersionExistsError(Exception):
+    """Someone else saved this version of the plan first."""
+
+    def __init__(self, plan_id, version):
+        super().__init__(f"Plan {plan_id} was changed by someone else (version {version} exists); "
+                         f"reload and try again")
+        self.plan_id = plan_id
+        self.version = version
+
+
+class Storage:
+    """The member, plan and admin operations the routes rely on.
+
+    Members are always read and written within a branch. Member documents
+    keep the MongoDB shape (nested "subscription", ObjectId "_id") whatever
+    the backend, so templates and the JSON API work unchanged.
+
+    Every backend also provides `checkins`, an object with the CheckinStore
+    interface (ensure_collection, record, record_many, member_checkins,
+    hourly_occupancy, reassign).
+    """
+
+    checkins = None
+
+    def ensure_indexes(self):
+        raise NotImplementedError
+
+    def ping(self):
+        """One round trip to the database; raises if it can't be reached."""
+        raise NotImplementedError
+
+    def open_connections(self):
+        """Open pooled connections ahead of the first requests. Returns how
+        many were asked for; backends without a pool open none."""
+        return 0
+
+    # Plans
+    def count_plans(self):
+        raise NotImplementedError
+
+    def insert_plans(self, plans):
+        raise NotImplementedError
+
+    def list_plans(self):
+        """Every version of every plan, sorted by (plan_id, version)."""
+        raise NotImplementedError
+
+    def get_plan(self, plan_id):
+        """The latest version of a plan, or None."""
+        raise NotImplementedError
+
+    def insert_plan_version(self, plan):
+        """Add a plan version. Versions are never updated; raises
+        PlanVersionExistsError if (plan_id, version) is taken."""
+        raise NotImplementedError
+
+    # Admins
+    def count_admins(self):
+        raise NotImplementedError
+
+    def insert_admin(self, admin):
+        raise NotImplementedError
+
+    def find_admin(self, username):
+        raise NotImplementedError
+
+    def record_logins(self, logins):
+        """Set last_login for a batch of (username, timestamp) pairs."""
+        raise NotImplementedError
+
+    # Members
+    def count_members(self):
+        raise NotImplementedError
+
+    def insert_members(self, members):
+        raise NotImplementedError
+
+    def assign_default_branch(self, branch_id):
+        """Move members and admins without a branch_id into branch_id."""
+        raise NotImplementedError
+
+    def insert_member(self, member):
+        """Insert a member document and return its new _id.
+
+        Raises DuplicateMemberError if another member of the branch has the
+        same contact_normalized.
+        """
+        raise NotImplementedError
+
+    def get_members(self, branch_id, member_ids):
+        """The given members of the branch, in no particular order."""
+        raise NotImplementedError
+
+    def list_members(self, branch_id, plan_id=None, after=None, limit=None, fields=None, primary=False):
+        """Members sorted by (name, _id).
+
+        after is a (name, _id) pair; only members sorting after it are
+        returned. fields is a list of dotted field names (None for all).
+        primary: see expired_members().
+        """
+        raise NotImplementedError
+
+    def expired_members(self, branch_id, now, primary=False):
+        """Members whose expiry date is before now, oldest expiry first.
+
+        Like list_members this may be served by a lagging replica; callers
+        that act on the result (deleting the members) pass primary=True.
+        """
+        raise NotImplementedError
+
+    def get_member(self, branch_id, member_id, fields=None):
+        raise NotImplementedError
+
+    def member_snapshot(self, branch_id, batch_size):
+        """Yield lists of up to batch_size (plan_id, start_date, expiry_date,
+        created_at) tuples, one per member of the branch, in no particular order."""
+        raise NotImplementedError
+
+    def get_member_expiry(self, branch_id, member_id):
+        """Expiry date of a member of the branch, or None if not found."""
+        raise NotImplementedError
+
+    def get_member_version(self, branch_id, member_id):
+        """updated_at of a member, or None if not found."""
+        raise NotImplementedError
+
+    def watch_members(self, on_change, on_error):
+        """Call on_change(member_id) for every member changed by any process.
+
+        Returns False if the backend cannot watch for changes. on_error is
+        called if watching stops later on.
+        """
+        return False
+
+    def update_subscription(self, branch_id, member_id, subscription, updated_at):
+        """Set the given subscription fields and return the member as it was
+        before the update (only _id and subscription), or None if not found."""
+        raise NotImplementedError
+
+    def change_subscriptions(self, branch_id, changes, updated_at):
+        """Apply (member_id, plan_id, expiry_date, subscription fields)
+        changes in one batch.
+
+        Each change is only made if the member is still on plan_id with that
+        expiry_date, so a batch can be applied again safely and a renewal
+        made since the member was read is not overwritten. Returns the
+        member_ids that were changed.
+        """
+        raise NotImplementedError
+
+    def delete_member(self, branch_id, member_id):
+        """Delete a member with its profile and payments and return the
+        deleted member document, or None."""
+        raise NotImplementedError
+
+    def delete_members(self, branch_id, member_ids):
+        """Delete the given members with their profiles and payments and
+        return how many members were deleted."""
+        raise NotImplementedError
+
+    def list_branches(self):
+        """Distinct branch_id values of all members."""
+        raise NotImplementedError
+
+    def members_expiring_between(self, branch_id, low, high, after, limit):
+        """(expiry_date, _id, status) of up to limit members whose expiry_date
+        is in (low, high], ordered by (expiry_date, _id).
+
+        low may be None for no lower bound. after is the (expiry_date, _id)
+        of the last row of the previous batch, or None.
+        """
+        raise NotImplementedError
+
+    def mark_expired(self, branch_id, member_ids, updated_at):
+        """Set subscription.status to "expired" on the given members that are
+        not expired yet; return how many were changed."""
+        raise NotImplementedError
+
+    def members_without_plan_fields(self, after, limit):
+        """(_id, plan_id) of up to limit members of any branch whose
+        subscription has no plan_name, in _id order, starting after _id after."""
+        raise NotImplementedError
+
+    def set_plan_fields(self, updates):
+        """Copy plan fields into subscriptions.
+
+        updates is a list of (member_id, plan_id, fields). A member is only
+        changed if its subscription still has that plan_id and no plan_name.
+        Returns the number of members changed.
+        """
+        raise NotImplementedError
+
+    # Duplicate members
+    def members_without_normalized_fields(self, after, limit):
+        """(_id, contact, email) of up to limit members of any branch that
+        have no contact_normalized field yet, in _id order, starting after _id after."""
+        raise NotImplementedError
+
+    def set_normalized_fields(self, updates):
+        """Set contact_normalized and email_normalized.
+
+        updates is a list of (member_id, fields). A member whose normalized
+        contact is already taken in its branch is skipped. Returns the number
+        of members changed.
+        """
+        raise NotImplementedError
+
+    def duplicate_contact_groups(self):
+        """Yield (branch_id, normalized contact, [_id, ...]) for every contact
+        number shared by more than one member of a branch.
+
+        The contact is normalized from the raw contact field, so members
+        without contact_normalized are included.
+        """
+        raise NotImplementedError
+
+    def merge_members(self, branch_id, merged, duplicate_ids):
+        """Replace the surviving member with merged, move the duplicates'
+        check-ins and payments to it and delete the duplicates (with their
+        profiles). Returns how many were deleted. Running it again after a
+        partial merge is safe."""
+        raise NotImplementedError
+
+    # Audit log
+    def insert_audit_entries(self, entries):
+        """Record entries, skipping any whose change_id is already recorded."""
+        raise NotImplementedError
+
+    def member_history(self, branch_id, member_id, limit):
+        raise NotImplementedError
+
+    # Subscription periods
+    def insert_subscription_periods(self, periods):
+        """Record periods, skipping any whose change_id is already recorded."""
+        raise NotImplementedError
+
+    def subscription_periods(self, branch_id, member_id, limit):
+        """The member's periods, most recent change first."""
+        raise NotImplementedError
+
+    def delete_subscription_periods(self, change_ids):
+        """Remove the periods recorded under change_ids."""
+        raise NotImplementedError
+
+    # Profiles and payments (member_details.py)
+    def members_with_cold_fields(self, after, limit):
+        """Up to limit whole members of any branch that still embed profile
+        fields or subscription.payments, in _id order, starting after _id after."""
+        raise NotImplementedError
+
+    def move_cold_fields(self, moves):
+        """Store profiles and payments and remove them from the members.
+
+        moves is a list of (member_id, branch_id, profile, payments). The
+        profile fields are set on the member's profile, which is created if
+        missing, and payments are recorded as in insert_payments(). Then the
+        profile fields and subscription.payments are removed from the
+        members. Returns the number of members changed.
+        """
+        raise NotImplementedError
+
+    def get_member_profile(self, branch_id, member_id):
+        """The member's profile document, or None."""
+        raise NotImplementedError
+
+    def insert_payments(self, payments):
+        """Record payments, skipping any whose payment_id is already recorded."""
+        raise NotImplementedError
+
+    def member_payments(self, branch_id, member_id, limit):
+        """The member's payments, most recent first."""
+        raise NotImplementedError
+
+    # Notification ledger (notifications.py)
+    def claim_notifications(self, entries):
+        """Record ledger entries and return the keys of those recorded; an
+        entry whose key is already in the ledger is skipped."""
+        raise NotImplementedError
+
+    def mark_notifications_sent(self, keys, sent_at):
+        raise NotImplementedError
+
+    def release_notifications(self, keys):
+        """Remove ledger entries, so their notices can be sent again."""
+        raise NotImplementedError
+
+    def recent_notifications(self, branch_id, limit):
+        """The branch's ledger entries, most recently claimed first."""
+        raise NotImplementedError
+
+    # Card revocations (cards.py)
+    def revoke_cards(self, member_id, branch_id, revoked_before, expires_at, reason, updated_at):
+        """Record that the member's cards issued before revoked_before are
+        revoked. An earlier revocation of the member is extended: the later
+        revoked_before and expires_at are kept."""
+        raise NotImplementedError
+
+    def card_revocations(self, since):
+        """Revocations updated at or after since (all if None), in
+        updated_at order."""
+        raise NotImplementedError
+
+    # Background jobs
+    def insert_job(self, job):
+        """Insert a job and return it with its _id. If a job with the same
+        idempotency_key already exists, return that one instead."""
+        raise NotImplementedError
+
+    def claim_job(self, types, now, lease_until):
+        """Atomically take the oldest runnable job of one of the given types.
+
+        A job is runnable when it is queued with run_after <= now, or running
+        with a lease that ran out before now (its worker died). The job is
+        marked running until lease_until, its attempts are incremented and it
+        is returned; None if there is nothing to run.
+        """
+        raise NotImplementedError
+
+    def update_job(self, job_id, changes):
+        raise NotImplementedError
+
+    def get_job(self, job_id):
+        raise NotImplementedError
+
+    def list_jobs(self, branch_id, limit):
+        """Jobs of a branch, newest first."""
+        raise NotImplementedError
+
+    # Leases (one holder at a time across processes)
+    def acquire_lease(self, name, owner, now, until):
+        """Take or renew the named lease until the given time.
+
+        Succeeds if the lease is free, expired at now or already held by
+        owner. Returns the lease ({"_id": name, "owner", "until", "state"}),
+        or None if another owner holds it.
+        """
+        raise NotImplementedError
+
+    def release_lease(self, name, owner, state):
+        """Save state with the lease and give it up, if owner still holds it."""
+        raise NotImplementedError
+
+    def query_plan_report(self):
+        """explain() findings per query shape, or None if not collected."""
+        return None
+
+    @contextmanager
+    def causal_session(self, after=None):
+        """Run the block's reads and writes in one causally consistent session.
+
+        after is the token of an earlier block, usually from an earlier
+        request; reads in this block then see everything written before it,
+        even when a secondary serves them. Yields a function that returns the
+        token for this block, or None. Backends without replicas always read
+        their own writes and need no session.
+        """
+        yield lambda: None
+
+
+def create_storage(backend=STORAGE_BACKEND):
+    if backend == 'mongo':
+        from mongo_storage import MongoStorage
+        return MongoStorage(MONGO_URI, read_preference=READ_PREFERENCE,
+                            max_staleness=MAX_STALENESS_SECONDS, minPoolSize=MONGO_MIN_POOL_SIZE)
+    if backend == 'memory':
+        from memory_storage import MemoryStorage
+        return MemoryStorage()
+    if backend == 'sqlite':
+        from sqlite_storage import SqliteStorage
+        return SqliteStorage(SQLITE_PATH)
+    raise ValueError(f"Unknown storage backend: {backend}")
@@ -0,0 +1,112 @@
+"""Periodic sweep that marks lapsed subscriptions as expired.
+
+Each run handles only the members whose expiry date falls between the
+previous run's watermark and now. Per branch this is a range scan on the
+(branch_id, subscription.expiry_date, _id) index, read in keyset batches
+with one update_many per batch. The watermark is stored in a lease document.
+Whichever app process holds the lease does the run; the others skip it, so
+any number of nodes can run the sweeper.
+
+Subscriptions that are renewed or added with a past expiry date get their
+status from plans.subscription_for(), so the sweeper never has to look
+behind its watermark.
+"""
+import logging
+import os
+import socket
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+logger = logging.getLogger(__name__)
+
+SWEEP_INTERVAL_SECONDS = int(os.environ.get('GYM_SWEEP_INTERVAL_SECONDS', 300))
+SWEEP_BATCH_SIZE = 1000
+LEASE_NAME = 'status-sweeper'
+LEASE_SECONDS = 120
+HISTORY_SIZE = 20
+
+
+class StatusSweeper:
+    def __init__(self, storage, interval=SWEEP_INTERVAL_SECONDS, batch_size=SWEEP_BATCH_SIZE,
+                 on_expired=None):
+        self.storage = storage
+        self.interval = interval
+        self.batch_size = batch_size
+        self.on_expired = on_expired
+        self.owner = f"{socket.gethostname()}:{os.getpid()}"
+        self.runs = deque(maxlen=HISTORY_SIZE)
+        self.stats = {"completed": 0, "skipped": 0, "failed": 0, "expired": 0}
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self, now=None):
+        """Sweep up to now. Returns the run's counts, or None if another
+        process holds the lease."""
+        now = now or datetime.now()
+        lease = self.storage.acquire_lease(LEASE_NAME, self.owner, now, now + timedelta(seconds=LEASE_SECONDS))
+        if lease is None:
+            self.stats["skipped"] += 1
+            return None
+
+        low = (lease.get("state") or {}).get("watermark")
+        started = time.perf_counter()
+        by_branch = {}
+        for branch_id in self.storage.list_branches():
+            by_branch[branch_id] = self._sweep_branch(branch_id, low, now)
+            # Keep the lease while a long first sweep goes through the branches
+            self.storage.acquire_lease(LEASE_NAME, self.owner, datetime.now(),
+                                       datetime.now() + timedelta(seconds=LEASE_SECONDS))
+
+        run = {
+            "owner": self.owner,
+            "from": low,
+            "to": now,
+            "expired": sum(by_branch.values()),
+            "by_branch": by_branch,
+            "duration_ms": round((time.perf_counter() - started) * 1000, 1),
+        }
+        self.storage.release_lease(LEASE_NAME, self.owner, {"watermark": now, "last_run": run})
+        self.runs.append(run)
+        self.stats["completed"] += 1
+        self.stats["expired"] += run["expired"]
+        logger.info("Status sweep %s -> %s: %d members expired in %.0fms",
+                    low, now, run["expired"], run["duration_ms"])
+        return run
+
+    def _sweep_branch(self, branch_id, low, high):
+        after, expired = None, 0
+        while True:
+            rows = self.storage.members_expiring_between(branch_id, low, high, after, self.batch_size)
+            if not rows:
+                return expired
+
+            member_ids = [member_id for _, member_id, status in rows if status != "expired"]
+            if member_ids:
+                expired += self.storage.mark_expired(branch_id, member_ids, high)
+                if self.on_expired is not None:
+                    self.on_expired(member_ids)
+            after = rows[-1][:2]
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='status-sweeper', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                self.run_once()
+            except Exception:
+                self.stats["failed"] += 1
+                logger.exception("Status sweep failed")
+            self._stop.wait(self.interval)
+
+    def snapshot(self):
+        return dict(self.stats, interval_seconds=self.interval, runs=list(self.runs))
@@ -0,0 +1,76 @@
+import os
+import sys
+import tempfile
+from datetime import datetime, timedelta
+
+import pytest
+from bson.objectid import ObjectId
+from werkzeug.security import generate_password_hash
+
+APP_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# The app module connects to storage and writes its templates when imported
+os.environ.setdefault('GYM_STORAGE', 'memory')
+os.environ.setdefault('GYM_SQLITE_PATH', os.path.join(tempfile.mkdtemp(), 'gym.db'))
+os.chdir(APP_DIR)
+sys.path.insert(0, APP_DIR)
+
+import gymmember  # noqa: E402
+
+
+@pytest.fixture(scope='session')
+def app_module():
+    return gymmember
+
+
+def login(username, password):
+    client = gymmember.app.test_client()
+    client.post('/login', data={'username': username, 'password': password})
+    return client
+
+
+@pytest.fixture
+def client():
+    return login('admin', 'admin123')
+
+
+@pytest.fixture(scope='session')
+def other_branch_client():
+    gymmember.storage.insert_admin({
+        "username": "north-admin",
+        "password": generate_password_hash("north123"),
+        "branch_id": "north",
+        "created_at": datetime.now(),
+        "last_login": None
+    })
+    return lambda: login('north-admin', 'north123')
+
+
+@pytest.fixture
+def active_member():
+    """Insert an active member of the default branch and return it."""
+    def insert(branch_id=gymmember.DEFAULT_BRANCH_ID, days=30, plan_id=1, **fields):
+        now = datetime.now().replace(microsecond=0)
+        plan = gymmember.plan_catalog.get(plan_id)
+        member = {
+            "_id": ObjectId(),
+            "branch_id": branch_id,
+            "name": f"Test Member {ObjectId()}",
+            "age": 30,
+            "contact": "5550100",
+            "subscription": {
+                "plan_id": plan_id,
+                "plan_version": plan.get("version", 1),
+                "plan_name": plan["plan_name"],
+                "price": plan["price"],
+                "start_date": now,
+                "expiry_date": now + timedelta(days=days),
+                "status": "active"
+            },
+            "created_at": now,
+            "updated_at": now
+        }
+        member.update(fields)
+        gymmember.storage.insert_members([member])
+        return member
+    return insert
@@ -0,0 +1,39 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+analytics = pytest.importorskip('analytics')
+
+NOW = datetime(2026, 6, 15, 12, 0)
+
+
+def snapshot(rows):
+    """rows of (plan_id, start_date, expiry_date, created_at)."""
+    return analytics.MemberSnapshot.load([rows])
+
+
+def test_cohort_retention_ignores_future_sign_ups():
+    member = (1, NOW - timedelta(days=40), NOW + timedelta(days=20), NOW - timedelta(days=40))
+    future = (1, NOW + timedelta(days=60), NOW + timedelta(days=90), NOW + timedelta(days=60))
+
+    rows = analytics.cohort_retention(snapshot([member, future]), NOW)
+
+    assert len(rows) == analytics.COHORT_MONTHS
+    assert sum(row["size"] for row in rows) == 1
+
+
+def test_monthly_churn_ignores_future_sign_ups():
+    member = (1, NOW - timedelta(days=100), NOW + timedelta(days=20), NOW - timedelta(days=100))
+    # Imported with a start date after now and an expiry date before it
+    future = (1, NOW + timedelta(days=90), NOW - timedelta(days=40), NOW + timedelta(days=90))
+
+    rows = analytics.monthly_churn(snapshot([member, future]), NOW)
+
+    assert [row["active"] for row in rows][-3:] == [1, 1, 1]
+    assert all(row["churned"] == 0 for row in rows)
+
+
+def test_analytics_page_with_future_member(client, app_module, active_member):
+    active_member(created_at=datetime.now() + timedelta(days=400))
+    app_module.snapshot_cache.clear()
+    assert client.get('/analytics').status_code == 200
@@ -0,0 +1,14 @@
+def test_fields_selects_member_fields(client, active_member):
+    member = active_member()
+    response = client.get(f'/api/v1/members/{member["_id"]}?fields=name,subscription.plan_id')
+    assert response.status_code == 200
+    assert set(response.get_json()["data"]) == {"_id", "name", "subscription"}
+
+
+def test_overlapping_fields_are_rejected(client, active_member):
+    member = active_member()
+    for url in ('/api/v1/members?fields=subscription,subscription.plan_id',
+                f'/api/v1/members/{member["_id"]}?fields=subscription.expiry_date,subscription'):
+        response = client.get(url)
+        assert response.status_code == 400
+        assert "subscription." in response.get_json()["error"]
@@ -0,0 +1,74 @@
+from datetime import datetime
+
+import checkins
+from checkins import ExpiryCache
+
+
+def test_checkin_records_visit(client, app_module, active_member):
+    member = active_member()
+    response = client.post(f'/checkin/{member["_id"]}')
+    assert response.status_code == 201
+
+    app_module.write_queue.flush()
+    history = client.get(f'/api/v1/members/{member["_id"]}/checkins').get_json()["data"]
+    assert len(history) == 1
+
+
+def test_other_branch_cannot_check_in_or_read_history(client, other_branch_client, app_module, active_member):
+    member = active_member()
+    client.post(f'/checkin/{member["_id"]}')
+    app_module.write_queue.flush()
+
+    north = other_branch_client()
+    assert north.post(f'/checkin/{member["_id"]}').status_code == 404
+    assert north.get(f'/api/v1/members/{member["_id"]}/checkins').status_code == 404
+
+
+def test_occupancy_counts_own_branch_only(client, other_branch_client, app_module, active_member):
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    def total(c):
+        return sum(hour["checkins"] for hour in c.get(f'/api/v1/occupancy?date={today}').get_json()["data"])
+
+    north = other_branch_client()
+    main_before, north_before = total(client), total(north)
+
+    main_member, north_member = active_member(), active_member(branch_id='north')
+    client.post(f'/checkin/{main_member["_id"]}')
+    client.post(f'/checkin/{main_member["_id"]}')
+    north.post(f'/checkin/{north_member["_id"]}')
+    app_module.write_queue.flush()
+
+    assert total(client) == main_before + 2
+    assert total(north) == north_before + 1
+
+
+def test_expiry_cache_is_bounded():
+    cache = ExpiryCache(lambda branch_id, member_id: None, capacity=100)
+    for member_id in range(1000):
+        cache.get('main', member_id)
+    assert len(cache) == 100
+
+
+def test_expired_entries_are_dropped(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(checkins.time, 'monotonic', lambda: now[0])
+    cache = ExpiryCache(lambda branch_id, member_id: None, ttl=60)
+    for member_id in range(10):
+        cache.get('main', member_id)
+    now[0] += 61
+    cache.get('main', 'new')
+    assert len(cache) == 1
+
+
+def test_member_deleted_during_load_is_not_cached():
+    expiry_dates = {('main', 'm1'): datetime(2030, 1, 1)}
+
+    def load_then_delete(branch_id, member_id):
+        expiry_date = expiry_dates.pop((branch_id, member_id), None)
+        cache.invalidate(branch_id, member_id)
+        return expiry_date
+
+    cache = ExpiryCache(load_then_delete)
+    assert cache.get('main', 'm1') == datetime(2030, 1, 1)
+    assert cache.get('main', 'm1') is None
@@ -0,0 +1,27 @@
+from member_cache import MemberCache
+
+
+def test_invalidate_during_load_does_not_cache_stale_member():
+    cache = MemberCache()
+    stale = {"_id": "m1", "branch_id": "main", "name": "Old name"}
+
+    def load_then_get_invalidated():
+        cache.invalidate("m1")
+        return stale
+
+    assert cache.get("main", "m1", load_then_get_invalidated) is stale
+    fresh = {"_id": "m1", "branch_id": "main", "name": "New name"}
+    assert cache.get("main", "m1", lambda: fresh) is fresh
+    assert cache.get("main", "m1", lambda: stale) is fresh
+
+
+def test_clear_during_load_does_not_cache_stale_member():
+    cache = MemberCache()
+    stale = {"_id": "m1", "branch_id": "main"}
+
+    def load_then_clear():
+        cache.clear()
+        return stale
+
+    cache.get("main", "m1", load_then_clear)
+    assert cache.snapshot()["size"] == 0
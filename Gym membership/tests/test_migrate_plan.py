@@ -0,0 +1,91 @@
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+from audit import audit_entry
+
+BRANCH = 'migrate-test'
+
+
+def run_job(app_module, job_id):
+    job = {"_id": job_id, "branch_id": BRANCH,
+           "params": {"from_plan_id": 1, "to_plan_id": 2, "effective_date": datetime.now(), "admin": "admin"}}
+    result = app_module.run_migrate_plan(job, lambda *args: None)
+    app_module.write_queue.flush()
+    return result
+
+
+def history(app_module, member_id):
+    return [entry for entry in app_module.storage.member_history(BRANCH, member_id, 50)
+            if entry["action"] == 'migrate_plan']
+
+
+def test_member_changed_concurrently_is_not_audited(app_module, active_member, monkeypatch):
+    storage = app_module.storage
+    moved, changed_meanwhile = active_member(branch_id=BRANCH), active_member(branch_id=BRANCH)
+    list_members = storage.list_members
+
+    def list_then_change(*args, **kwargs):
+        # Another admin moves one member to plan 3 between the read and the bulk write
+        members = list_members(*args, **kwargs)
+        if members:
+            storage.update_subscription(BRANCH, changed_meanwhile["_id"], {"plan_id": 3}, datetime.now())
+        return members
+
+    monkeypatch.setattr(storage, 'list_members', list_then_change)
+    result = run_job(app_module, ObjectId())
+
+    assert result["migrated"] == 1
+    assert len(history(app_module, moved["_id"])) == 1
+    assert history(app_module, changed_meanwhile["_id"]) == []
+
+
+def test_member_changed_concurrently_keeps_no_migration_period(app_module, active_member, monkeypatch):
+    storage = app_module.storage
+    member = active_member(branch_id=BRANCH)
+    list_members = storage.list_members
+
+    def list_then_change(*args, **kwargs):
+        members = list_members(*args, **kwargs)
+        if members:
+            storage.update_subscription(BRANCH, member["_id"], {"plan_id": 3}, datetime.now())
+        return members
+
+    monkeypatch.setattr(storage, 'list_members', list_then_change)
+    assert run_job(app_module, ObjectId())["migrated"] == 0
+
+    assert storage.get_member(BRANCH, member["_id"])["subscription"]["plan_id"] == 3
+    assert storage.subscription_periods(BRANCH, member["_id"], 50) == []
+
+
+def test_renewal_during_migration_is_not_overwritten(app_module, active_member, monkeypatch):
+    storage = app_module.storage
+    member = active_member(branch_id=BRANCH)
+    renewed_until = member["subscription"]["expiry_date"] + timedelta(days=365)
+    list_members = storage.list_members
+
+    def list_then_renew(*args, **kwargs):
+        # The desk renews the member on the same plan before the bulk write
+        members = list_members(*args, **kwargs)
+        if members:
+            storage.update_subscription(BRANCH, member["_id"], {"expiry_date": renewed_until}, datetime.now())
+        return members
+
+    monkeypatch.setattr(storage, 'list_members', list_then_renew)
+    assert run_job(app_module, ObjectId())["migrated"] == 0
+
+    subscription = storage.get_member(BRANCH, member["_id"])["subscription"]
+    assert (subscription["plan_id"], subscription["expiry_date"]) == (1, renewed_until)
+
+
+def test_retried_job_logs_nothing_twice(app_module, active_member):
+    member = active_member(branch_id=BRANCH)
+    job_id = ObjectId()
+    run_job(app_module, job_id)
+    assert run_job(app_module, job_id)["migrated"] == 0
+
+    # A batch whose audit entries were written before the attempt died is logged once
+    change_id = f"migrate_plan:{job_id}:{member['_id']}"
+    app_module.storage.insert_audit_entries([
+        audit_entry('migrate_plan', member["_id"], {}, {"plan_id": 2}, branch_id=BRANCH, change_id=change_id)])
+    assert len(history(app_module, member["_id"])) == 1
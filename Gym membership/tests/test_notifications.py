@@ -0,0 +1,59 @@
+import io
+import json
+from datetime import datetime, timedelta
+
+from bson.objectid import ObjectId
+
+import notifications
+from notifications import NotificationDispatcher, SmsGatewayTransport, create_transports
+
+
+def test_transports_are_off_by_default(app_module):
+    assert notifications.EMAIL_TRANSPORT == 'off'
+    assert notifications.SMS_TRANSPORT == 'off'
+    assert create_transports() == {}
+    assert app_module.notification_dispatcher._thread is None
+
+
+class FakeResponse(io.BytesIO):
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def test_sms_messages_without_result_fail(monkeypatch):
+    monkeypatch.setattr(notifications.urllib.request, 'urlopen',
+                        lambda request, timeout: FakeResponse(json.dumps({"results": [{"error": None}]}).encode()))
+    transport = SmsGatewayTransport('http://gateway.invalid/send', rate=None)
+    messages = [{"key": str(i), "to": "555010%d" % i, "subject": None, "body": "hi"} for i in range(3)]
+
+    errors = transport.send(messages)
+
+    assert errors[0] is None
+    assert errors[1] is not None and errors[2] is not None
+
+
+def test_sms_short_response_releases_unmatched_claims(app_module, monkeypatch):
+    storage = app_module.storage
+    monkeypatch.setattr(notifications.urllib.request, 'urlopen',
+                        lambda request, timeout: FakeResponse(json.dumps({"results": [{"error": None}]}).encode()))
+    transport = SmsGatewayTransport('http://gateway.invalid/send', rate=None)
+    dispatcher = NotificationDispatcher(storage, {'sms': transport})
+    now = datetime.now()
+    messages = []
+    for i in range(2):
+        member_id = ObjectId()
+        messages.append({"key": notifications.notification_key(member_id, 7, now + timedelta(days=5)),
+                         "member_id": member_id, "branch_id": app_module.DEFAULT_BRANCH_ID, "window_days": 7,
+                         "expiry_date": now + timedelta(days=5), "channel": 'sms', "to": "555010%d" % i,
+                         "subject": None, "body": "hi"})
+    storage.claim_notifications([dispatcher._ledger_entry(message) for message in messages])
+
+    _, _, sent, failed = dispatcher._send(transport, 7, messages)
+
+    assert (sent, failed) == (1, 1)
+    # The failed message was released, so it can be claimed again on the next run
+    retry = storage.claim_notifications([dispatcher._ledger_entry(message) for message in messages])
+    assert list(retry) == [messages[1]["key"]]
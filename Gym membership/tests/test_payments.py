@@ -0,0 +1,33 @@
+from datetime import datetime
+
+
+def test_plan_change_records_payment(client, app_module, active_member):
+    member = active_member(plan_id=1)
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    client.post(f'/update_subscription/{member["_id"]}',
+                data={'new_plan': '2', 'start_date': today, 'method of payment': 'card'})
+
+    payments = client.get(f'/api/v1/members/{member["_id"]}/payments').get_json()["data"]
+    assert len(payments) == 1
+    payment = payments[0]
+    assert payment["method"] == 'card'
+    assert payment["plan_id"] == 2
+    assert payment["date"].startswith(today)
+    # The unused days of the old plan are credited, so less than the full price is due
+    periods = client.get(f'/api/v1/members/{member["_id"]}/periods').get_json()["data"]
+    assert payment["amount_due"] == periods[0]["proration"]["amount_due"]
+    assert payment["amount_due"] < payment["price"]
+    assert client.get(f'/view_member/{member["_id"]}').status_code == 200
+
+
+def test_renewal_without_method_keeps_last_one(client, app_module, active_member):
+    member = active_member()
+    app_module.storage.update_subscription(app_module.DEFAULT_BRANCH_ID, member["_id"],
+                                           {"method_payment": "cash"}, datetime.now())
+    today = datetime.now().strftime('%Y-%m-%d')
+
+    client.post(f'/update_subscription/{member["_id"]}', data={'new_plan': '1', 'start_date': today})
+
+    payments = client.get(f'/api/v1/members/{member["_id"]}/payments').get_json()["data"]
+    assert [payment["method"] for payment in payments] == ['cash']
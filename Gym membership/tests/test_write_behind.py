@@ -0,0 +1,34 @@
+from write_behind import WriteBehindQueue
+
+
+def test_failed_items_are_retried_in_order():
+    written, failures = [], [1]
+
+    def sink(items):
+        if failures:
+            failures.pop()
+            raise ConnectionError("primary stepped down")
+        written.extend(items)
+
+    queue = WriteBehindQueue(max_batch=2, max_retries=3)
+    queue.add_sink('checkins', sink)
+    for n in range(3):
+        queue.enqueue('checkins', n)
+    queue.flush()
+
+    assert written == [0, 1, 2]
+    stats = queue.snapshot()
+    assert (stats["flushed"], stats["failed"], stats["retried"], stats["dropped"]) == (3, 2, 2, 0)
+
+
+def test_items_are_dropped_after_max_retries():
+    def sink(items):
+        raise ConnectionError("no primary")
+
+    queue = WriteBehindQueue(max_retries=2)
+    queue.add_sink('audit', sink)
+    queue.enqueue('audit', {"action": "login"})
+    queue.flush()
+
+    stats = queue.snapshot()
+    assert (stats["failed"], stats["retried"], stats["dropped"], stats["depth"]) == (3, 2, 1, 0)
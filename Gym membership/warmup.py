@@ -0,0 +1,94 @@
+"""Warm-up before the app takes traffic, and the state behind /readyz.
+
+Storage, sample data and templates are set up when the app module is
+imported, but the first requests would still pay for the rest: connecting
+to MongoDB and opening pool connections, compiling each Jinja template on
+first use, and loading the plan catalog. WarmUp runs those steps on a
+background thread right after import and times each one.
+
+/readyz answers 503 until every step has finished, so a load balancer only
+sends requests to a worker that is warm. /healthz only says that the process
+answers. If a step fails, the error is logged, the worker stays not ready,
+and the whole warm-up starts over after GYM_WARMUP_RETRY_SECONDS.
+"""
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+WARMUP_RETRY_SECONDS = int(os.environ.get('GYM_WARMUP_RETRY_SECONDS', 5))
+
+# Close enough to process start: the app module imports this early
+PROCESS_STARTED = time.perf_counter()
+
+
+class WarmUp:
+    def __init__(self, steps, retry_seconds=WARMUP_RETRY_SECONDS):
+        """steps is a list of (name, function). A function may return a
+        count (templates compiled, connections opened) to report."""
+        self.steps = steps
+        self.retry_seconds = retry_seconds
+        self.ready = False
+        self.attempts = 0
+        self.durations = {}
+        self.error = None
+        self.total_ms = None
+        self.ready_after_ms = None
+        self._stop = threading.Event()
+        self._thread = None
+
+    def run_once(self):
+        """Run every step in order. Returns True once all have succeeded."""
+        self.attempts += 1
+        durations = {}
+        started = time.perf_counter()
+        for name, step in self.steps:
+            step_started = time.perf_counter()
+            try:
+                result = step()
+            except Exception as e:
+                # Only the step and error type are shown on /readyz, which needs no login
+                self.error = {"step": name, "error": type(e).__name__}
+                self.durations = durations
+                logger.exception("Warm-up step %s failed", name)
+                return False
+            durations[name] = {"ms": round((time.perf_counter() - step_started) * 1000, 1)}
+            if result is not None:
+                durations[name]["count"] = result
+
+        self.durations = durations
+        self.error = None
+        self.total_ms = round((time.perf_counter() - started) * 1000, 1)
+        self.ready_after_ms = round((time.perf_counter() - PROCESS_STARTED) * 1000, 1)
+        self.ready = True
+        logger.info("Warm-up finished in %.0fms (%s)", self.total_ms,
+                    ', '.join(f"{name} {step['ms']:.0f}ms" for name, step in durations.items()))
+        return True
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='warm-up', daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+
+    def _run(self):
+        while not self._stop.is_set():
+            if self.run_once():
+                return
+            self._stop.wait(self.retry_seconds)
+
+    def snapshot(self):
+        return {
+            "ready": self.ready,
+            "attempts": self.attempts,
+            "steps": self.durations,
+            "error": self.error,
+            "warm_up_ms": self.total_ms,
+            "ready_after_ms": self.ready_after_ms,
+        }
@@ -0,0 +1,165 @@
+import logging
+import os
+import threading
+import time
+from collections import deque
+
+logger = logging.getLogger(__name__)
+
+FLUSH_INTERVAL_MS = 200
+MAX_BATCH = 500
+MAX_PENDING = 10000
+ENQUEUE_TIMEOUT = 0.5  # seconds a caller may wait for space before giving up
+MAX_RETRIES = int(os.environ.get('GYM_WRITE_BEHIND_RETRIES', 5))
+
+
+class WriteBehindQueue:
+    """Buffers small writes and flushes them in batches from a background thread.
+
+    Each item is queued for a named sink; a sink is a function that receives
+    a list of items and writes them in one round-trip (usually bulk_write).
+    A flush happens every FLUSH_INTERVAL_MS or as soon as MAX_BATCH items are
+    waiting. The buffer holds at most MAX_PENDING items: when it is full,
+    enqueue() blocks for up to ENQUEUE_TIMEOUT and then returns False so the
+    caller can write synchronously instead. Items whose sink raises are put
+    back at the front of the buffer and retried with the next flush; they
+    are only dropped after MAX_RETRIES failed retries.
+    """
+
+    def __init__(self, flush_interval_ms=FLUSH_INTERVAL_MS, max_batch=MAX_BATCH,
+                 max_pending=MAX_PENDING, max_retries=MAX_RETRIES):
+        self.flush_interval = flush_interval_ms / 1000.0
+        self.max_batch = max_batch
+        self.max_pending = max_pending
+        self.max_retries = max_retries
+        self._sinks = {}
+        self._pending = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._closed = False
+        self._retrying = False
+        self.stats = {
+            "enqueued": 0,
+            "flushed": 0,
+            "rejected": 0,
+            "failed": 0,
+            "retried": 0,
+            "dropped": 0,
+            "flushes": 0,
+            "last_flush_ms": 0.0,
+            "max_flush_ms": 0.0,
+            "total_flush_ms": 0.0,
+        }
+
+    def add_sink(self, name, writer):
+        self._sinks[name] = writer
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name='write-behind', daemon=True)
+            self._thread.start()
+
+    def enqueue(self, sink, item):
+        if sink not in self._sinks:
+            raise KeyError(f"Unknown write-behind sink: {sink}")
+
+        deadline = time.monotonic() + ENQUEUE_TIMEOUT
+        with self._cond:
+            while len(self._pending) >= self.max_pending and not self._closed:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.stats["rejected"] += 1
+                    return False
+                self._cond.notify_all()
+                self._cond.wait(remaining)
+
+            if self._closed:
+                self.stats["rejected"] += 1
+                return False
+
+            self._pending.append((sink, item, 0))
+            self.stats["enqueued"] += 1
+            if len(self._pending) >= self.max_batch:
+                self._cond.notify_all()
+        return True
+
+    def depth(self):
+        return len(self._pending)
+
+    def snapshot(self):
+        flushes = self.stats["flushes"]
+        return dict(
+            self.stats,
+            depth=self.depth(),
+            avg_flush_ms=self.stats["total_flush_ms"] / flushes if flushes else 0.0,
+        )
+
+    def flush(self):
+        """Write everything that is currently buffered."""
+        while self._flush_batch():
+            pass
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+        if self._thread is not None:
+            self._thread.join(timeout=10)
+        self.flush()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                # After a failed flush, wait before retrying even if the buffer is full
+                if not self._closed and (self._retrying or len(self._pending) < self.max_batch):
+                    self._cond.wait(self.flush_interval)
+                if self._closed:
+                    return
+            self._flush_batch()
+
+    def _flush_batch(self):
+        with self._flush_lock:
+            with self._cond:
+                count = min(len(self._pending), self.max_batch)
+                batch = [self._pending.popleft() for _ in range(count)]
+                # Wake up writers blocked on a full buffer
+                self._cond.notify_all()
+            if not batch:
+                return False
+
+            by_sink = {}
+            for sink, item, retries in batch:
+                by_sink.setdefault(sink, []).append((item, retries))
+
+            started = time.perf_counter()
+            retry = []
+            for sink, entries in by_sink.items():
+                items = [item for item, _ in entries]
+                try:
+                    self._sinks[sink](items)
+                    self.stats["flushed"] += len(items)
+                except Exception:
+                    self.stats["failed"] += len(items)
+                    logger.exception("Write-behind flush to %s failed (%d items)", sink, len(items))
+                    for item, retries in entries:
+                        if retries < self.max_retries:
+                            retry.append((sink, item, retries + 1))
+                        else:
+                            self.stats["dropped"] += 1
+                            logger.error("Write-behind dropped %s item after %d retries: %r",
+                                         sink, retries, item)
+            elapsed_ms = (time.perf_counter() - started) * 1000
+
+            self._retrying = bool(retry)
+            if retry:
+                with self._cond:
+                    # Ahead of newer writes, so each sink keeps its order
+                    self._pending.extendleft(reversed(retry))
+                self.stats["retried"] += len(retry)
+
+            self.stats["flushes"] += 1
+            self.stats["last_flush_ms"] = elapsed_ms
+            self.stats["total_flush_ms"] += elapsed_ms
+            self.stats["max_flush_ms"] = max(self.stats["max_flush_ms"], elapsed_ms)
+            return True